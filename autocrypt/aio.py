@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""asyncio variants of the blocking Autocrypt functions.
+
+The OpenPGP and storage work is run in an executor, so that it does not
+block the event loop. At most ``concurrency`` calls run at once, the rest
+wait for their turn.
+
+Functions that update the profile hold the profile lock in the executor,
+so that updates from concurrent coroutines are applied one after the
+other. parse_email decrypts and parses the Email without it and takes it
+only to update the peers state. The executor has to share memory with
+the event loop, a thread pool, for those functions.
+
+Example::
+
+    configure(ThreadPoolExecutor(4), concurrency=4)
+    msg = await gen_ac_email(profile, sender, recipients, subject, body)
+    pt = await parse_email(msg.as_string(), profile)
+
+"""
+
+import asyncio
+import functools
+import logging
+import weakref
+
+from . import crypto, message, storage
+from .constants import AIO_CONCURRENCY, KEY_ALG
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['configure', 'run', 'decrypt', 'encrypt', 'gen_ac_email',
+           'gen_ac_setup_email', 'gen_gossip_email', 'gen_key',
+           'new_account', 'new_peer', 'parse_email', 'sign', 'sign_encrypt',
+           'verify']
+
+_executor = None
+_concurrency = AIO_CONCURRENCY
+# NOTE: asyncio semaphores belong to a loop, one per loop is created
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def configure(executor=None, concurrency=AIO_CONCURRENCY):
+    """Set the executor and the maximum number of calls run at once.
+
+    :param executor: executor to run the blocking functions, the loop
+        default executor if None
+    :type executor: concurrent.futures.Executor
+    :param concurrency: maximum number of calls run at once
+    :type concurrency: int
+    """
+    global _executor, _concurrency
+    assert concurrency > 0
+    _executor = executor
+    _concurrency = concurrency
+    _semaphores.clear()
+
+
+def _semaphore(loop):
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(_concurrency)
+    return semaphore
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking function in the executor.
+
+    :return: what func returns
+    """
+    loop = asyncio.get_running_loop()
+    async with _semaphore(loop):
+        return await loop.run_in_executor(
+            _executor, functools.partial(func, *args, **kwargs))
+
+
+def _locked(func, profile, *args, **kwargs):
+    with storage._lock(profile):
+        return func(profile, *args, **kwargs)
+
+
+async def _run_locked(func, profile, *args, **kwargs):
+    return await run(_locked, func, profile, *args, **kwargs)
+
+
+async def gen_key(addr, alg=KEY_ALG):
+    return await run(crypto.gen_key, addr, alg)
+
+
+async def sign(profile, data, addr):
+    return await run(crypto.sign, profile, data, addr)
+
+
+async def verify(profile, data, signature):
+    return await run(crypto.verify, profile, data, signature)
+
+
+async def encrypt(profile, data, recipients):
+    return await run(crypto.encrypt, profile, data, recipients)
+
+
+async def sign_encrypt(profile, data, addr, recipients):
+    return await run(crypto.sign_encrypt, profile, data, addr, recipients)
+
+
+async def decrypt(profile, cdata, seckey=None):
+    return await run(crypto.decrypt, profile, cdata, seckey)
+
+
+async def gen_ac_email(profile, sender, recipients, subject, body, **kwargs):
+    return await run(message.gen_ac_email, profile, sender, recipients,
+                     subject, body, **kwargs)
+
+
+async def gen_gossip_email(sender, recipients, profile, subject, body,
+                           **kwargs):
+    return await run(message.gen_gossip_email, sender, recipients, profile,
+                     subject, body, **kwargs)
+
+
+async def gen_ac_setup_email(sender, pe, profile, **kwargs):
+    return await run(message.gen_ac_setup_email, sender, pe, profile,
+                     **kwargs)
+
+
+async def parse_email(msg, profile, passphrase=None):
+    # NOTE: the peers state is updated in a transaction, that holds the
+    # profile lock, after the Email is decrypted
+    return await run(message.parse_email, msg, profile, passphrase)
+
+
+async def new_account(profile, addr, **kwargs):
+    return await _run_locked(storage.new_account, profile, addr, **kwargs)
+
+
+async def new_peer(profile, addr, **kwargs):
+    return await _run_locked(storage.new_peer, profile, addr, **kwargs)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Process-wide caches for objects that are expensive to build."""
+
+import hashlib
+import threading
+from base64 import b64decode
+from collections import OrderedDict
+
+from .constants import (AC_HEADER_CACHE_SIZE, GOSSIP_HEADER_CACHE_SIZE,
+                        KEY_CACHE_SIZE)
+
+__all__ = ['LRUCache', 'ac_header_cache', 'gossip_header_cache',
+           'keydata_digest', 'key_cache']
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entries.
+
+    It counts hits and misses, so that its efficiency can be checked with
+    :meth:`info`.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+def keydata_digest(keydata):
+    """Digest identifying a key, the same for its keydata and its bytes.
+
+    It is the digest the key store uses to reference the key.
+
+    :param keydata: keydata (base 64 encoded key) or key bytes
+    :type keydata: string or bytes
+    :return: SHA-256 digest of the key bytes
+    :rtype: bytes
+    """
+    if isinstance(keydata, str):
+        keydata = b64decode(keydata.encode('ascii'))
+    return hashlib.sha256(keydata).digest()
+
+
+# NOTE: parsed keys (PGPKey) by key digest
+key_cache = LRUCache(KEY_CACHE_SIZE)
+# NOTE: folded Autocrypt header values with the account key they were
+# generated from, by account address and prefer-encrypt
+ac_header_cache = LRUCache(AC_HEADER_CACHE_SIZE)
+# NOTE: Autocrypt-Gossip header values, unfolded and folded, with the peer
+# key they were generated from, by peer address
+gossip_header_cache = LRUCache(GOSSIP_HEADER_CACHE_SIZE)
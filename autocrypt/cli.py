@@ -12,19 +12,25 @@ import logging.config
 import os.path
 
 from autocrypt import __version__
+from . import metrics
 from .conflog import LOGGING
-from .constants import BASE_DIR, MUTUAL
-from .tests_data import PGPHOME
+from .constants import (BASE_DIR, DAEMON_SOCKET, KEY_ALG, KEY_ALGS, MUTUAL,
+                        PGPHOME)
+from .daemon import Server
 from .message import (gen_ac_email, gen_gossip_email, gen_ac_setup_email,
                       parse_email, gen_ac_setup_passphrase)
-from .storage import load, new_account, new_peer, repr_profile
+from .ingest import ingest
+from .storage import (load, migrate, new_account, new_peer, repr_profile,
+                      transaction)
 
-logging.config.dictConfig(LOGGING)
 logger = logging.getLogger('autocrypt')
 DATAPATH = os.path.join(BASE_DIR, "tests", "data")
 
 
 def main():
+    # NOTE: logging is only configured here, importing the modules of the
+    # package does not configure it
+    logging.config.dictConfig(LOGGING)
     parser = argparse.ArgumentParser()
     parser.add_argument('--version', action='version',
                         version='%(prog)s ' + __version__)
@@ -40,10 +46,20 @@ def main():
                         help='List account and peers',
                         action='store_true')
 
+    parser.add_argument('--migrate',
+                        help="""Copy the profile to the given path.
+                        Use a .sqlite extension to store it in SQLite,
+                        .idx in a memory-mapped peer index.""",
+                        default=None)
+
     parser.add_argument('-n', '--newaccount',
                         help="""Email address for the new account.
                         It will also generate new OpenPGP keys.""",
                         default='alice@autocrypt.example')
+    parser.add_argument('--keyalg',
+                        help='Key algorithm for the new account.',
+                        choices=KEY_ALGS,
+                        default=KEY_ALG)
     parser.add_argument('-r', '--newpeer',
                         help="""Email address for the new peer.""",
                         default='bob@autocrypt.example,')
@@ -91,51 +107,94 @@ def main():
                             DATAPATH,
                             'example-simple-autocrypt-pyac.eml'))
 
+    parser.add_argument('--ingest', nargs='+',
+                        help="""Paths to mbox files or Maildir directories
+                        to import the peers Autocrypt headers from""",
+                        default=None)
+
     parser.add_argument('-o', '--output',
                         help="""Path to store the Autocrypt Email, by default:
                         /tmp/output.eml""",
                         default='/tmp/output.eml')
 
+    parser.add_argument('--daemon', nargs='?', const=DAEMON_SOCKET,
+                        help="""Serve requests on a Unix socket, by default
+                        {}, keeping the profile and keys in memory
+                        """.format(DAEMON_SOCKET),
+                        default=None)
+
+    parser.add_argument('--metrics',
+                        help="""Path to write the operations metrics in
+                        Prometheus text format""",
+                        default=None)
+
     args = parser.parse_args()
     if args.debug:
         logger.setLevel(logging.DEBUG)
     logger.debug('args %s', args)
+    if args.metrics is not None:
+        metrics.enable()
+
+    if args.daemon is not None:
+        server = Server(socket_path=args.daemon)
+        logger.info('Serving on %s', args.daemon)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
 
     profile = load()
     msg = None
 
+    if args.migrate is not None:
+        profile = migrate(profile['path'], args.migrate)
+
     if args.list:
         logger.info(repr_profile(profile))
 
-    if args.newaccount is not None:
-        new_account(profile, args.newaccount)
-
-    if args.newpeer is not None:
-        new_peer(profile, args.newpeer)
-
-    if args.genac:
-        msg = gen_ac_email(args.fromh, args.to.split(','), profile,
-                           args.subject, args.body, args.pe)
-    if args.genag:
-        msg = gen_gossip_email(args.fromh, args.to.split(','),
-                               profile, args.subject, args.body, args.pe)
-    if args.genasc:
-        gen_ac_setup_passphrase()
-
-    if args.genas:
-        if args.passphrase is None:
-            args.passphrase = gen_ac_setup_passphrase()
-        msg = gen_ac_setup_email(args.fromh, args.pe, profile,
-                                 passphrase=args.passphrase)
-
-    if args.input is not None:
-        pt = open(args.input).read()
-        msg = parse_email(pt, profile)
-        logger.info('Parsed Email: \n%s', msg)
+    if args.ingest is not None:
+        stats = ingest(profile, args.ingest)
+        logger.info('Ingested %(messages)s messages in %(seconds).1fs '
+                    '(%(rate).0f messages/s), %(updates)s peer updates, '
+                    '%(errors)s errors', stats)
+
+    # NOTE: the profile is written once, after all the updates
+    with transaction(profile):
+        if args.newaccount is not None:
+            new_account(profile, args.newaccount, alg=args.keyalg)
+
+        if args.newpeer is not None:
+            new_peer(profile, args.newpeer)
+
+        if args.genac:
+            msg = gen_ac_email(args.fromh, args.to.split(','), profile,
+                               args.subject, args.body, args.pe)
+        if args.genag:
+            msg = gen_gossip_email(args.fromh, args.to.split(','),
+                                   profile, args.subject, args.body, args.pe)
+        if args.genasc:
+            gen_ac_setup_passphrase()
+
+        if args.genas:
+            if args.passphrase is None:
+                args.passphrase = gen_ac_setup_passphrase()
+            msg = gen_ac_setup_email(args.fromh, args.pe, profile,
+                                     passphrase=args.passphrase)
+
+        if args.input is not None:
+            pt = open(args.input).read()
+            msg = parse_email(pt, profile)
+            logger.info('Parsed Email: \n%s', msg)
 
     if msg is not None:
         open(args.output, 'w').write(msg.as_string())
 
+    if args.metrics is not None:
+        metrics.dump_prometheus(args.metrics)
+
 
 if __name__ == '__main__':
     main()
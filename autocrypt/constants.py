@@ -6,6 +6,12 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # NOTE: key size is 3072 for Level 1
 KEY_SIZE = 3072
+# NOTE: key algorithms for new keys, RSA (KEY_SIZE bits) or an Ed25519
+# primary key with a Cv25519 encryption subkey
+KEY_ALG_RSA = 'rsa'
+KEY_ALG_25519 = '25519'
+KEY_ALGS = [KEY_ALG_RSA, KEY_ALG_25519]
+KEY_ALG = KEY_ALG_RSA
 
 NOPREFERENCE = 'nopreference'
 MUTUAL = 'mutual'
@@ -19,6 +25,11 @@ PE_HEADER_TYPES = [None, NOPREFERENCE, MUTUAL]
 
 AC_HEADER_PE = "addr=%(addr)s; prefer-encrypt=%(pe)s; keydata=%(keydata)s"
 AC_HEADER = "addr=%(addr)s; keydata=%(keydata)s"
+# NOTE: attributes an Autocrypt header can have, other attributes not
+# starting with "_" make the header invalid
+AC_HEADER_ATTRS = [ADDR, PE, KEYDATA]
+# NOTE: longer header values are rejected before being parsed
+AC_HEADER_MAXLEN = 32 * 1024
 
 AC_GOSSIP = 'Autocrypt-Gossip'
 AC_GOSSIP_HEADER = "addr=%(addr)s; keydata=%(keydata)s"
@@ -28,6 +39,12 @@ GOSSIP = 'gossip'
 
 ACCOUNTS = 'accounts'
 PEERS = 'peers'
+# NOTE: index of key ids and fingerprints (including subkeys) to addresses,
+# one dict per ACCOUNTS and PEERS
+KEYHANDLES = 'keyhandles'
+# NOTE: number of times the profile has been written, to detect writers
+# that loaded an older profile
+VERSION = 'version'
 
 SECKEY = 'seckey'
 PUBKEY = 'pubkey'
@@ -52,6 +69,15 @@ DISABLE = 'disable'
 DISCOURAGE = 'discourage'
 AVAILABE = 'available'
 ENCRYPT = 'encrypt'
+# NOTE: from worst to best, so that the recommendation for several
+# recipients is the worst one
+RECOMMENDATIONS = [DISABLE, DISCOURAGE, AVAILABE, ENCRYPT]
+# NOTE: an Autocrypt key is discouraged when the last Autocrypt header
+# is older than this before the last message seen
+AC_STALE_SECONDS = 35 * 24 * 60 * 60
+# NOTE: a header repeating the peer key and prefer-encrypt only updates
+# the peer timestamps when they are this newer than the stored ones
+PEER_TIMESTAMP_RESOLUTION = 24 * 60 * 60
 
 AC_PREFER_ENCRYPT_HEADER = 'Autocrypt-Prefer-Encrypt: '
 AC_SETUP_MSG = "Autocrypt-Setup-Message"
@@ -96,4 +122,56 @@ ACCOUNT_ATTRS = ["addr", "pr", "sk", "pk"]
 ACCOUNTS_PATH = os.path.join(PYAC_HOME, 'accounts.json')
 PEERS_PATH = os.path.join(PYAC_HOME, 'peers.json')
 PROFILE_PATH = os.path.join(PYAC_HOME, 'profile.json')
+# NOTE: the writes of a JSON profile are serialized between processes by
+# locking the file with this extension next to it
+LOCK_EXT = '.lock'
 INITIALDATA = os.path.join(BASE_DIR, 'data', 'intial_data.json')
+PGPHOME = os.path.join(BASE_DIR, "tests", "data", "pgphome")
+
+# NOTE: maximum number of parsed keys kept in memory
+KEY_CACHE_SIZE = 256
+# NOTE: maximum number of folded Autocrypt headers of the accounts kept in
+# memory, one per account and prefer-encrypt
+AC_HEADER_CACHE_SIZE = 64
+# NOTE: maximum number of peers whose Autocrypt-Gossip headers are kept in
+# memory, a few KB each
+GOSSIP_HEADER_CACHE_SIZE = 1024
+
+# NOTE: the journal is synced to disk every JOURNAL_SYNC_RECORDS records or
+# JOURNAL_SYNC_MS milliseconds after the first record not synced, and
+# compacted into the profile every JOURNAL_COMPACT_RECORDS records
+JOURNAL_EXT = '.log'
+JOURNAL_SYNC_RECORDS = 64
+JOURNAL_SYNC_MS = 50
+JOURNAL_COMPACT_RECORDS = 10000
+
+# NOTE: keys of the profiles that use a key store are stored once, in
+# <profile path>.keys, and referenced by KEYREF_PREFIX and their SHA-256
+# hex digest. The key store file is rewritten when at least
+# KEYSTORE_GARBAGE of its keys are not referenced
+KEYSTORE_EXT = '.keys'
+KEYREF_PREFIX = 'sha256:'
+KEYSTORE_GARBAGE = 0.5
+
+# NOTE: number of messages ingested per profile write
+INGEST_BATCH = 1000
+
+# NOTE: pre-generated keys kept in reserve for new accounts, the pool is
+# refilled in background when it has less than KEYPOOL_LOW keys
+KEYPOOL_PATH = os.path.join(PYAC_HOME, 'keypool.json')
+KEYPOOL_SIZE = 8
+KEYPOOL_LOW = 4
+
+# NOTE: maximum number of blocking calls run at once by autocrypt.aio
+AIO_CONCURRENCY = 8
+
+# NOTE: upper bounds, in seconds, of the latency histograms buckets
+METRICS_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1,
+                   5, 10]
+METRICS_PREFIX = 'autocrypt'
+
+# NOTE: the daemon socket, the period to fold the profile journal into the
+# profile and the maximum size of a request or response
+DAEMON_SOCKET = os.path.join(PYAC_HOME, 'autocrypt.sock')
+DAEMON_FLUSH_SECONDS = 5
+DAEMON_MAX_FRAME = 64 * 1024 * 1024
@@ -7,54 +7,103 @@
 from __future__ import print_function, unicode_literals
 
 import logging
-import logging.config
 import os
 import sys
 from base64 import b64decode, b64encode
 
-from pgpy import PGPUID, PGPKey, PGPMessage, PGPSignature
-from pgpy.constants import (CompressionAlgorithm, HashAlgorithm, KeyFlags,
-                            PubKeyAlgorithm, SymmetricKeyAlgorithm)
-from pgpy.packet import Packet
-from pgpy.types import Armorable
+from . import metrics
+from .cache import key_cache, keydata_digest
+from .constants import (ACCOUNTS, GOSSIPKEY, KEY_ALG, KEY_ALG_25519,
+                        KEY_ALG_RSA, KEY_SIZE, KEYHANDLES, PEERS, PUBKEY,
+                        SECKEY)
+from .utils import LazyModule
 
-from .conflog import LOGGING
-from .constants import ACCOUNTS, KEY_SIZE, PEERS, PUBKEY, SECKEY
-
-logging.config.dictConfig(LOGGING)
 logger = logging.getLogger('autocrypt')
 
-__all__ = ['_encrypt_with_key', '_gen_skey_usage_all',
+# NOTE: pgpy is imported the first time it is used, because importing it
+# takes most of the start up time of commands that do not need it
+pgpy = LazyModule('pgpy')
+pgpy_constants = LazyModule('pgpy.constants')
+pgpy_packet = LazyModule('pgpy.packet')
+pgpy_types = LazyModule('pgpy.types')
+
+__all__ = ['_add_uid', '_bind_key', '_encrypt_with_key', '_gen_skey',
+           '_gen_skey_usage_all',
            '_gen_skey_with_subkey', '_gen_ssubkey',
            '_get_addr_from_keyhandle', '_get_keyhandle_from_addr',
+           '_index_keydata', '_index_profile', '_key_handles',
+           '_keydata_handles', '_record_keydatas', '_unindex_keydata',
            '_get_peer_keydata_from_addr', '_get_pubkey_from_addr',
            '_get_public_keydata_from_addr',
            '_get_public_own_keydata_from_addr', '_get_seckey_from_addr',
            '_get_secret_own_keydata_from_addr', '_key2keydata',
-           '_key2keydatas', '_key_path', '_keydata2key', '_save_key_to_file',
+           '_key2keydatas', '_key_path', '_keydata2key', '_peer_key_field',
+           '_save_key_to_file', '_uncache_keydata',
            'decrypt', 'encrypt', 'gen_key', 'get_own_public_keydata',
            'get_peer_keydata', 'get_secret_keydata', 'key_bytes',
            'list_packets_pgpy', 'sign', 'sign_encrypt', 'sym_decrypt',
            'sym_encrypt', 'verify']
 
-# TODO: see which defaults we would like here
-SKEY_ARGS = {
-    'hashes': [HashAlgorithm.SHA512, HashAlgorithm.SHA256],
-    'ciphers': [SymmetricKeyAlgorithm.AES256,
-                SymmetricKeyAlgorithm.AES192,
-                SymmetricKeyAlgorithm.AES128],
-    'compression': [CompressionAlgorithm.ZLIB,
-                    CompressionAlgorithm.BZ2,
-                    CompressionAlgorithm.ZIP,
-                    CompressionAlgorithm.Uncompressed]
-}
-# RSAEncrypt is deprecated, therefore using RSAEncryptOrSign
-# also for the subkey
-SKEY_ALG = PubKeyAlgorithm.RSAEncryptOrSign
-SKEY_USAGE_SIGN = {KeyFlags.Sign}
-SKEY_USAGE_ENC = {KeyFlags.EncryptCommunications, KeyFlags.EncryptStorage}
-SKEY_USAGE_ALL = {KeyFlags.Sign, KeyFlags.EncryptCommunications,
-                  KeyFlags.EncryptStorage}
+_pgpy_constants_cache = {}
+
+
+def _pgpy_constants():
+    """Key generation constants, that need pgpy to be defined.
+
+    They are also available as module attributes, ie. ``crypto.SKEY_ARGS``.
+
+    :rtype: dict
+    """
+    if _pgpy_constants_cache:
+        return _pgpy_constants_cache
+    c = pgpy_constants
+    constants = {}
+    # TODO: see which defaults we would like here
+    constants['SKEY_ARGS'] = {
+        'hashes': [c.HashAlgorithm.SHA512, c.HashAlgorithm.SHA256],
+        'ciphers': [c.SymmetricKeyAlgorithm.AES256,
+                    c.SymmetricKeyAlgorithm.AES192,
+                    c.SymmetricKeyAlgorithm.AES128],
+        'compression': [c.CompressionAlgorithm.ZLIB,
+                        c.CompressionAlgorithm.BZ2,
+                        c.CompressionAlgorithm.ZIP,
+                        c.CompressionAlgorithm.Uncompressed]
+    }
+    # RSAEncrypt is deprecated, therefore using RSAEncryptOrSign
+    # also for the subkey
+    constants['SKEY_ALG'] = c.PubKeyAlgorithm.RSAEncryptOrSign
+    constants['SKEY_USAGE_SIGN'] = {c.KeyFlags.Sign}
+    constants['SKEY_USAGE_ENC'] = {c.KeyFlags.EncryptCommunications,
+                                   c.KeyFlags.EncryptStorage}
+    constants['SKEY_USAGE_ALL'] = {c.KeyFlags.Sign,
+                                   c.KeyFlags.EncryptCommunications,
+                                   c.KeyFlags.EncryptStorage}
+    # NOTE: EdDSA keys can only sign, the encryption is done by the
+    # ECDH subkey
+    constants['SKEY_USAGE_CERTIFY_SIGN'] = {c.KeyFlags.Certify,
+                                            c.KeyFlags.Sign}
+    # key algorithm: (primary algorithm and size or curve,
+    #                 subkey algorithm and size or curve, primary usage)
+    constants['KEY_ALG_PARAMS'] = {
+        KEY_ALG_RSA: ((constants['SKEY_ALG'], KEY_SIZE),
+                      (constants['SKEY_ALG'], KEY_SIZE),
+                      constants['SKEY_USAGE_ALL']),
+        KEY_ALG_25519: ((c.PubKeyAlgorithm.EdDSA, c.EllipticCurveOID.Ed25519),
+                        (c.PubKeyAlgorithm.ECDH,
+                         c.EllipticCurveOID.Curve25519),
+                        constants['SKEY_USAGE_CERTIFY_SIGN']),
+    }
+    _pgpy_constants_cache.update(constants)
+    return _pgpy_constants_cache
+
+
+# NOTE: module __getattr__ needs Python >= 3.7, as python_requires
+def __getattr__(name):
+    if name in ('SKEY_ARGS', 'SKEY_ALG', 'SKEY_USAGE_SIGN', 'SKEY_USAGE_ENC',
+                'SKEY_USAGE_ALL', 'SKEY_USAGE_CERTIFY_SIGN', 'KEY_ALG_PARAMS'):
+        return _pgpy_constants()[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
 
 
 def key_bytes(key):
@@ -66,13 +115,16 @@ def key_bytes(key):
     :rtype: string
 
     """
-    assert isinstance(key, PGPKey)
+    assert isinstance(key, pgpy.PGPKey)
     return bytes(key) if sys.version_info >= (3, 0) \
         else key.__bytes__()
 
 
-def _gen_skey_usage_all(addr):
-    seckey = PGPKey.new(SKEY_ALG, KEY_SIZE)
+def _gen_skey(alg=KEY_ALG):
+    return pgpy.PGPKey.new(*_pgpy_constants()['KEY_ALG_PARAMS'][alg][0])
+
+
+def _add_uid(seckey, addr):
     # NOTE: pgpy implements separate attributes for name and e-mail
     # address. Name is mandatory.
     # Here e-mail address is used for the attribute name,
@@ -80,37 +132,72 @@ def _gen_skey_usage_all(addr):
     # If name attribute would be set to empty string
     # and email to the e-mail address, the uid would be
     # ' <e-mail address>', which we do not want.
-    uid = PGPUID.new(addr)
-    seckey.add_uid(uid, usage=SKEY_USAGE_ALL, **SKEY_ARGS)
+    constants = _pgpy_constants()
+    uid = pgpy.PGPUID.new(addr)
+    usage = constants['SKEY_USAGE_CERTIFY_SIGN'] \
+        if seckey.key_algorithm == pgpy_constants.PubKeyAlgorithm.EdDSA \
+        else constants['SKEY_USAGE_ALL']
+    seckey.add_uid(uid, usage=usage, **constants['SKEY_ARGS'])
     return seckey
 
 
-def _gen_ssubkey():
+def _gen_skey_usage_all(addr):
+    return _add_uid(_gen_skey(KEY_ALG_RSA), addr)
+
+
+def _gen_ssubkey(alg=KEY_ALG):
     # NOTE: the uid for the subkeys can be obtained with .parent,
     # but, unlike keys generated with gpg, it's not printed when imported
     # in gpg keyring and run --fingerprint.
     # in case of adding uid to the subkey, it raises currently some
     # exceptions depending on which are the arguments used, which are not
     # clear from the documentation.
-    ssubkey = PGPKey.new(SKEY_ALG, KEY_SIZE)
+    ssubkey = pgpy.PGPKey.new(
+        *_pgpy_constants()['KEY_ALG_PARAMS'][alg][1])
     return ssubkey
 
 
-def _gen_skey_with_subkey(addr):
+def _bind_key(seckey, ssubkey, addr):
+    """Add the uid and the encryption subkey to a secret key.
+
+    The subkey can only be bound once the key has a uid, so that keys
+    generated in advance (without uid) are bound with this.
+
+    :param seckey: secret key without uid
+    :type seckey: PGPKey
+    :param ssubkey: secret key to add as subkey
+    :type ssubkey: PGPKey
+    :param addr: e-mail address for the uid
+    :type addr: str
+    :return: the secret key with uid and subkey
+    :rtype: PGPKey
+    """
+    _add_uid(seckey, addr)
     # NOTE: seckey should be generated with usage sign, but otherwise
     # encryption does not work currently.
-    seckey = _gen_skey_usage_all(addr)
-    ssubkey = _gen_ssubkey()
-    seckey.add_subkey(ssubkey, usage=SKEY_USAGE_ENC)
+    seckey.add_subkey(ssubkey, usage=_pgpy_constants()['SKEY_USAGE_ENC'])
     return seckey
 
 
-def gen_key(addr):
-    return _gen_skey_with_subkey(addr)
+def _gen_skey_with_subkey(addr, alg=KEY_ALG):
+    return _bind_key(_gen_skey(alg), _gen_ssubkey(alg), addr)
+
+
+def gen_key(addr, alg=KEY_ALG):
+    """Generate a secret key with an encryption subkey for addr.
+
+    :param addr: e-mail address for the key uid
+    :type addr: str
+    :param alg: key algorithm, one of KEY_ALGS
+    :type alg: str
+    :return: secret key
+    :rtype: PGPKey
+    """
+    return _gen_skey_with_subkey(addr, alg)
 
 
 def _key2keydata(key):
-    assert isinstance(key, PGPKey)
+    assert isinstance(key, pgpy.PGPKey)
     keybytes = bytes(key)
     kb64bytes = b64encode(keybytes)
     kb64str = kb64bytes.decode('ascii')
@@ -118,10 +205,17 @@ def _key2keydata(key):
 
 
 def _keydata2key(keydata):
-    assert isinstance(keydata, str)
-    kb64bytes = keydata.encode('ascii')
-    kbytes = b64decode(kb64bytes)
-    key, _ = PGPKey.from_blob(kbytes)
+    """Parsed key of a keydata or key bytes, cached by the key digest."""
+    if isinstance(keydata, bytes):
+        kbytes = keydata
+    else:
+        kbytes = b64decode(keydata.encode('ascii'))
+    digest = keydata_digest(kbytes)
+    key = key_cache.get(digest)
+    if key is None:
+        with metrics.timer('key_parse'):
+            key, _ = pgpy.PGPKey.from_blob(kbytes)
+        key_cache.put(digest, key)
     return key
 
 
@@ -133,6 +227,30 @@ def _key2keydatas(key):
         return (_key2keydata(key), _key2keydata(key.pubkey))
 
 
+def _key_handles(key):
+    """Key ids and fingerprints of a key and its subkeys.
+
+    :param key: key (either public or private)
+    :type key: PGPKey
+    :return: key ids and fingerprints
+    :rtype: list
+    """
+    handles = []
+    for k in [key] + list(key.subkeys.values()):
+        fpr = str(k.fingerprint).replace(' ', '')
+        handles.extend([fpr, k.fingerprint.keyid])
+    return handles
+
+
+def _keydata_handles(keydata):
+    try:
+        key = _keydata2key(keydata)
+    except ValueError:
+        logger.warning('Could not parse keydata to index it.')
+        return []
+    return _key_handles(key)
+
+
 def _key_path(pgpydir, key):
     ext = '.asc' if key.is_public else '.sec.asc'
     keypath = os.path.join(pgpydir, key.fingerprint.keyid + ext)
@@ -150,15 +268,15 @@ def list_packets_pgpy(keydata):
     if isinstance(keydata, bytes):
         data = bytearray(keydata)
     elif isinstance(keydata, str):
-        data = Armorable.ascii_unarmor(keydata)['body']
+        data = pgpy_types.Armorable.ascii_unarmor(keydata)['body']
     packets = []
     while data:
-        packets.append(Packet(data))
+        packets.append(pgpy_packet.Packet(data))
     return packets
 
 
 def _encrypt_with_key(data, key):
-    msg = PGPMessage.new(data)
+    msg = pgpy.PGPMessage.new(data)
     pubkey = key if key.is_public else key.pubkey
     cmsg = pubkey.encrypt(msg)
     return cmsg
@@ -166,14 +284,15 @@ def _encrypt_with_key(data, key):
 
 def sym_encrypt(text, passphrase):
     if isinstance(text, str):
-        text = PGPMessage.new(text)
-    cmsg = text.encrypt(passphrase, cipher=SymmetricKeyAlgorithm.AES128)
+        text = pgpy.PGPMessage.new(text)
+    cmsg = text.encrypt(passphrase,
+                        cipher=pgpy_constants.SymmetricKeyAlgorithm.AES128)
     return cmsg
 
 
 def sym_decrypt(text, passphrase):
     if isinstance(text, str):
-        text = PGPMessage.from_blob(text)
+        text = pgpy.PGPMessage.from_blob(text)
     pmsg = text.decrypt(passphrase)
     return pmsg
 
@@ -181,9 +300,16 @@ def sym_decrypt(text, passphrase):
 # from here functions that need profile
 
 
+def _peer_key_field(peer):
+    """Field of the key of a peer, the gossip key when it has no other."""
+    keybytes = getattr(peer, 'keybytes', peer.get)
+    return PUBKEY if keybytes(PUBKEY) is not None else GOSSIPKEY
+
+
 def _get_peer_keydata_from_addr(profile, addr):
-    if profile[PEERS].get(addr):
-        return profile[PEERS][addr][PUBKEY]
+    peer = profile[PEERS].get(addr)
+    if peer:
+        return peer[_peer_key_field(peer)]
     return None
 
 
@@ -202,9 +328,7 @@ def _get_secret_own_keydata_from_addr(profile, addr):
 def _get_public_keydata_from_addr(profile, addr):
     if profile[ACCOUNTS].get(addr):
         return profile[ACCOUNTS][addr][PUBKEY]
-    if profile[PEERS].get(addr):
-        return profile[PEERS][addr][PUBKEY]
-    return None
+    return _get_peer_keydata_from_addr(profile, addr)
 
 
 def get_peer_keydata(profile, addr):
@@ -219,14 +343,29 @@ def get_secret_keydata(profile, addr):
     return _get_public_own_keydata_from_addr(profile, addr)
 
 
-def _get_seckey_from_addr(profile, addr):
-    keydata = _get_secret_own_keydata_from_addr(profile, addr)
+def _record_key(record, field):
+    # NOTE: records hold the key bytes, that are parsed without encoding
+    # them to keydata first
+    keydata = getattr(record, 'keybytes', record.get)(field)
     return _keydata2key(keydata) if keydata is not None else None
 
 
+@metrics.timed('key_lookup')
+def _get_seckey_from_addr(profile, addr):
+    account = profile[ACCOUNTS].get(addr)
+    return _record_key(account, SECKEY) if account else None
+
+
+@metrics.timed('key_lookup')
 def _get_pubkey_from_addr(profile, addr):
-    keydata = _get_public_keydata_from_addr(profile, addr)
-    return _keydata2key(keydata) if keydata is not None else None
+    account = profile[ACCOUNTS].get(addr)
+    if account:
+        return _record_key(account, PUBKEY)
+    peer = profile[PEERS].get(addr)
+    if peer:
+        # NOTE: a peer only known from gossip is encrypted to its gossip key
+        return _record_key(peer, _peer_key_field(peer))
+    return None
 
 
 def _get_keyhandle_from_addr(profile, addr):
@@ -234,22 +373,70 @@ def _get_keyhandle_from_addr(profile, addr):
     return key.fingerprint.keyid
 
 
+def _record_keydatas(section, record):
+    """Distinct keydata stored in an account or peer record."""
+    fields = [SECKEY, PUBKEY] if section == ACCOUNTS else [PUBKEY, GOSSIPKEY]
+    keydatas = []
+    for field in fields:
+        keydata = record.get(field)
+        if keydata is not None and keydata not in keydatas:
+            keydatas.append(keydata)
+    return keydatas
+
+
+def _index_keydata(profile, section, addr, record):
+    """Add the key handles of an account or peer record to the index."""
+    index = profile[KEYHANDLES][section]
+    for keydata in _record_keydatas(section, record):
+        for handle in _keydata_handles(keydata):
+            index[handle] = addr
+
+
+def _unindex_keydata(profile, section, addr, record):
+    """Remove the key handles of an account or peer record from the index."""
+    index = profile[KEYHANDLES][section]
+    for keydata in _record_keydatas(section, record):
+        for handle in _keydata_handles(keydata):
+            if index.get(handle) == addr:
+                del index[handle]
+
+
+def _uncache_keydata(section, record, keep=None):
+    """Drop the parsed keys of a record that are not in the keep record."""
+    kept = _record_keydatas(section, keep) if keep is not None else []
+    for keydata in _record_keydatas(section, record):
+        if keydata not in kept:
+            key_cache.invalidate(keydata_digest(keydata))
+
+
+def _index_profile(profile):
+    """(Re)build the key handles index of a profile."""
+    profile[KEYHANDLES] = {ACCOUNTS: {}, PEERS: {}}
+    for section in [ACCOUNTS, PEERS]:
+        for addr, record in profile[section].items():
+            _index_keydata(profile, section, addr, record)
+    logger.debug('Indexed key handles.')
+
+
+@metrics.timed('key_lookup')
 def _get_addr_from_keyhandle(profile, keyhandle):
-    addrs = profile[ACCOUNTS].keys()
-    for addr in addrs:
-        if _get_keyhandle_from_addr(profile, addr) == keyhandle:
-            return addr
-    return None
-    addrs = (profile[PEERS].keys())
-    for addr in addrs:
-        if _get_keyhandle_from_addr(profile, addr) == keyhandle:
-            return addr
-    return None
+    """Address of the account or peer owning a key id or fingerprint.
+
+    Accounts take precedence over peers, so that a message encrypted to an
+    own key is resolved to the account holding the secret key.
+    """
+    if KEYHANDLES not in profile:
+        _index_profile(profile)
+    keyhandle = str(keyhandle).replace(' ', '').upper()
+    index = profile[KEYHANDLES]
+    return index[ACCOUNTS].get(keyhandle) or index[PEERS].get(keyhandle)
 
 
+@metrics.timed('encrypt')
 def encrypt(profile, data, recipients):
     assert isinstance(recipients, list)
-    msg = data if isinstance(data, PGPMessage) else PGPMessage.new(data)
+    msg = data if isinstance(data, pgpy.PGPMessage) \
+        else pgpy.PGPMessage.new(data)
     # pmsg |= seckey.sign(msg)
     if len(recipients) == 1:
         key = _get_pubkey_from_addr(profile, recipients[0])
@@ -262,14 +449,14 @@ def encrypt(profile, data, recipients):
         # The symmetric cipher should be specified, in case the first
         # preferred cipher is not the same for all recipients public
         # keys.
-        cipher = SymmetricKeyAlgorithm.AES256
+        cipher = pgpy_constants.SymmetricKeyAlgorithm.AES256
         sessionkey = cipher.gen_key()
         cmsg = msg
         for r in recipients:
             key = _get_pubkey_from_addr(profile, r)
             if key is None:
                 logger.error('No key found to encrypt message.')
-                break
+                return None
             pubkey = key if key.is_public else key.pubkey
             cmsg = pubkey.encrypt(cmsg, cipher=cipher,
                                   sessionkey=sessionkey)
@@ -277,6 +464,7 @@ def encrypt(profile, data, recipients):
     return cmsg
 
 
+@metrics.timed('sign')
 def sign(profile, data, addr):
     seckey = _get_seckey_from_addr(profile, addr)
     sig_data = seckey.sign(data)
@@ -284,7 +472,8 @@ def sign(profile, data, addr):
 
 
 def sign_encrypt(profile, data, addr, recipients):
-    pmsg = data if isinstance(data, PGPMessage) else PGPMessage.new(data)
+    pmsg = data if isinstance(data, pgpy.PGPMessage) \
+        else pgpy.PGPMessage.new(data)
     sig = sign(profile, pmsg, addr)
     pmsg |= sig
     assert pmsg.is_signed
@@ -292,8 +481,9 @@ def sign_encrypt(profile, data, addr, recipients):
     return cmsg
 
 
+@metrics.timed('verify')
 def verify(profile, data, signature):
-    sig = PGPSignature(signature) \
+    sig = pgpy.PGPSignature(signature) \
         if isinstance(signature, str) else signature
     keyhandle = sig.signer
     logger.debug('keyhandle %s', keyhandle)
@@ -304,9 +494,10 @@ def verify(profile, data, signature):
     return good.by
 
 
+@metrics.timed('decrypt')
 def decrypt(profile, cdata, seckey=None):
-    cmsg = cdata if isinstance(cdata, PGPMessage) \
-        else PGPMessage.from_blob(cdata)
+    cmsg = cdata if isinstance(cdata, pgpy.PGPMessage) \
+        else pgpy.PGPMessage.from_blob(cdata)
     assert cmsg.is_encrypted
     if seckey is None:
         encrypter = cmsg.encrypters.pop()
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Daemon keeping the profile and the parsed keys in memory.
+
+The daemon serves requests over a Unix domain socket, so that each Email
+only costs the OpenPGP operations, not loading the profile, importing
+pgpy and parsing the keys.
+
+Requests and responses are JSON objects, each one sent as a frame: its
+length as 4 bytes big endian unsigned integer followed by the UTF-8
+encoded JSON. A request is ``{"op": name, "args": {...}}`` and a response
+``{"ok": true, "result": ...}`` or
+``{"ok": false, "error": message, "type": exception name}``.
+
+The JSON profiles are used in journal mode, records are appended to the
+journal and the journal is folded into the profile every
+``flush_seconds``.
+
+Example::
+
+    server = Server(profile_path, socket_path)
+    server.serve_forever()
+
+    client = Client(socket_path)
+    text = client.gen_ac_email(sender, recipients, subject, body)
+
+"""
+
+import base64
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+from . import storage
+from .cache import key_cache
+from .constants import (ACCOUNTS, DAEMON_FLUSH_SECONDS, DAEMON_MAX_FRAME,
+                        DAEMON_SOCKET, PEERS, PROFILE_PATH, PUBKEY, SECKEY)
+from .crypto import _keydata2key, decrypt, encrypt, sign_encrypt
+from .journal import get_journal
+from .message import (gen_ac_email, gen_gossip_email, parse_email,
+                      scan_ac_headers)
+from .records import json_default
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Client', 'DaemonError', 'Server', 'recv_frame', 'send_frame']
+
+HEADER = struct.Struct('>I')
+
+
+class DaemonError(Exception):
+    """Error returned by the daemon for a request."""
+
+
+def send_frame(sock, obj):
+    data = json.dumps(obj, separators=(',', ':'),
+                      default=json_default).encode('utf-8')
+    if len(data) > DAEMON_MAX_FRAME:
+        raise ValueError('Frame too large: {} bytes'.format(len(data)))
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """Receive a frame, return None when the connection is closed."""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > DAEMON_MAX_FRAME:
+        raise ValueError('Frame too large: {} bytes'.format(size))
+    data = _recv_exactly(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def _encode_data(data):
+    if isinstance(data, (bytes, bytearray)):
+        return {'data': base64.b64encode(bytes(data)).decode('ascii'),
+                'binary': True}
+    return {'data': data, 'binary': False}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request = recv_frame(self.request)
+            except (OSError, ValueError) as e:
+                logger.warning('Invalid request: %s', e)
+                return
+            if request is None:
+                return
+            try:
+                result = self.server.dispatch(request.get('op'),
+                                              request.get('args') or {})
+                response = {'ok': True, 'result': result}
+            except Exception as e:
+                logger.debug('Request %s failed: %r', request.get('op'), e)
+                response = {'ok': False, 'error': str(e),
+                            'type': type(e).__name__}
+            send_frame(self.request, response)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Daemon serving a profile over a Unix domain socket.
+
+    :param profile_path: path to the profile
+    :type profile_path: str
+    :param socket_path: path to the socket
+    :type socket_path: str
+    :param flush_seconds: period to fold the journal into the profile
+    :type flush_seconds: float
+    """
+
+    daemon_threads = True
+
+    def __init__(self, profile_path=PROFILE_PATH, socket_path=DAEMON_SOCKET,
+                 flush_seconds=DAEMON_FLUSH_SECONDS):
+        for dirname in set([os.path.dirname(profile_path),
+                            os.path.dirname(socket_path)]):
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        self.profile = storage.load(profile_path, journal=True)
+        self.flush_seconds = flush_seconds
+        self._stop = threading.Event()
+        self._flusher = None
+        self.warm()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # NOTE: the socket is created only accessible by the user, changing
+        # its mode afterwards would let other users connect meanwhile
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path,
+                                                   _Handler)
+        finally:
+            os.umask(umask)
+        self.ops = {
+            'ping': lambda: 'pong',
+            'gen_ac_email': self.gen_ac_email,
+            'gen_gossip_email': self.gen_gossip_email,
+            'parse_email': self.parse_email,
+            'encrypt': self.encrypt,
+            'sign_encrypt': self.sign_encrypt,
+            'decrypt': self.decrypt,
+            'peer': self.peer,
+            'flush': self.flush,
+        }
+
+    def warm(self):
+        """Parse the accounts secret keys and the peers keys.
+
+        Secret keys are parsed first, so that they are kept in the key
+        cache if it can not hold all the keys.
+        """
+        keydatas = [a[SECKEY] for a in self.profile[ACCOUNTS].values()] + \
+            [p[PUBKEY] for p in self.profile[PEERS].values()]
+        for keydata in keydatas[:key_cache.maxsize]:
+            if keydata is None:
+                continue
+            try:
+                _keydata2key(keydata)
+            except ValueError:
+                logger.warning('Could not parse key.')
+
+    def dispatch(self, op, args):
+        func = self.ops.get(op)
+        if func is None:
+            raise ValueError('Unknown operation {!r}'.format(op))
+        return func(**args)
+
+    def gen_ac_email(self, sender, recipients, subject, body, pe=None,
+                     **kwargs):
+        return gen_ac_email(self.profile, sender, recipients, subject, body,
+                            pe, **kwargs).as_string()
+
+    def gen_gossip_email(self, sender, recipients, subject, body, pe=None,
+                         **kwargs):
+        return gen_gossip_email(sender, recipients, self.profile, subject,
+                                body, pe, **kwargs).as_string()
+
+    def parse_email(self, msg, passphrase=None):
+        # NOTE: the daemon can not ask for the passphrase
+        if passphrase is None and scan_ac_headers(msg)[1] is not None:
+            raise ValueError('A passphrase is required to parse an '
+                             'Autocrypt Setup Message.')
+        pt = parse_email(msg, self.profile, passphrase)
+        return {'text': str(pt), 'body': getattr(pt, 'body', None),
+                'gossip': getattr(pt, 'gossip', [])}
+
+    def encrypt(self, data, recipients):
+        return str(encrypt(self.profile, data, recipients))
+
+    def sign_encrypt(self, data, sender, recipients):
+        return str(sign_encrypt(self.profile, data, sender, recipients))
+
+    def decrypt(self, data):
+        pt = decrypt(self.profile, data)
+        if pt is None:
+            raise ValueError('No secret key found to decrypt the message.')
+        return _encode_data(pt)
+
+    def peer(self, addr):
+        return self.profile[PEERS].get(addr)
+
+    def flush(self):
+        """Fold the journal into the profile."""
+        # NOTE: the lock is held so that the updates of a transaction being
+        # run are not written before it ends
+        with storage._lock(self.profile):
+            journal = get_journal(self.profile['path'])
+            if journal is None or journal.records:
+                storage.compact(self.profile)
+                return True
+        return False
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush the profile.')
+
+    def serve_forever(self, poll_interval=0.5):
+        self._flusher = threading.Thread(target=self._flush_loop,
+                                         name='autocrypt-flush', daemon=True)
+        self._flusher.start()
+        try:
+            socketserver.UnixStreamServer.serve_forever(self, poll_interval)
+        finally:
+            self._stop.set()
+
+    def server_close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        socketserver.UnixStreamServer.server_close(self)
+        self.flush()
+        storage.close(self.profile)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class Client(object):
+    """Client of the daemon.
+
+    :param socket_path: path to the daemon socket
+    :type socket_path: str
+    """
+
+    def __init__(self, socket_path=DAEMON_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def call(self, op, **args):
+        """Send a request and return its result.
+
+        :raises: DaemonError when the daemon returns an error
+        """
+        send_frame(self.sock, {'op': op, 'args': args})
+        response = recv_frame(self.sock)
+        if response is None:
+            raise DaemonError('Connection closed by the daemon.')
+        if not response['ok']:
+            raise DaemonError('{}: {}'.format(response['type'],
+                                              response['error']))
+        return response['result']
+
+    def gen_ac_email(self, sender, recipients, subject, body, pe=None):
+        return self.call('gen_ac_email', sender=sender,
+                         recipients=recipients, subject=subject, body=body,
+                         pe=pe)
+
+    def gen_gossip_email(self, sender, recipients, subject, body, pe=None):
+        return self.call('gen_gossip_email', sender=sender,
+                         recipients=recipients, subject=subject, body=body,
+                         pe=pe)
+
+    def parse_email(self, msg, passphrase=None):
+        return self.call('parse_email', msg=msg, passphrase=passphrase)
+
+    def encrypt(self, data, recipients):
+        return self.call('encrypt', data=data, recipients=recipients)
+
+    def sign_encrypt(self, data, sender, recipients):
+        return self.call('sign_encrypt', data=data, sender=sender,
+                         recipients=recipients)
+
+    def decrypt(self, data):
+        result = self.call('decrypt', data=data)
+        if result['binary']:
+            return base64.b64decode(result['data'])
+        return result['data']
+
+    def peer(self, addr):
+        return self.call('peer', addr=addr)
+
+    def flush(self):
+        return self.call('flush')
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Ingestion of mailbox archives to seed the peers state.
+
+Messages are read lazily from mbox files and Maildir directories and
+processed in Date order, so that the most recent Autocrypt header of a
+peer wins as in Autocrypt timestamp semantics.
+The profile is written once per batch of messages.
+"""
+import logging
+import mailbox
+import os.path
+import time
+from email import policy
+from email.parser import BytesParser
+from email.utils import getaddresses
+
+from .constants import AC, INGEST_BATCH, KEYDATA, PE
+from .message import (ParsedEmail, _parse_ac_values, decrypt_email,
+                      get_seckey_from_msg, scan_headers)
+from .peerstate import message_date, update_gossip, update_peer
+from .storage import transaction
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['open_mailbox', 'message_date',
+           'iter_messages', 'ingest_message', 'ingest']
+
+bytes_parser = BytesParser(policy=policy.default)
+
+
+def open_mailbox(path):
+    """Open a Maildir directory or a mbox file, without creating it."""
+    if os.path.isdir(path):
+        return mailbox.Maildir(path, factory=None, create=False)
+    return mailbox.mbox(path, factory=None, create=False)
+
+
+def _date_index(paths):
+    """Dates of all the messages, reading only their headers."""
+    index = []
+    for source, path in enumerate(paths):
+        box = open_mailbox(path)
+        for key in box.iterkeys():
+            with box.get_file(key) as fp:
+                dates = scan_headers(fp, ['Date']).get('date')
+            index.append((message_date(dates[0] if dates else None),
+                          source, key))
+        box.close()
+    return index
+
+
+def iter_messages(paths):
+    """Iterate over the messages of mailboxes in Date order.
+
+    Messages without a valid Date are yielded last.
+
+    :param paths: paths to mbox files or Maildir directories
+    :type paths: list
+    :return: (date, raw message) in Date order
+    :rtype: iterator
+    """
+    index = _date_index(paths)
+    index.sort(key=lambda i: (i[0] is None, i[0] or 0))
+    boxes = [open_mailbox(path) for path in paths]
+    try:
+        for date, source, key in index:
+            yield date, boxes[source].get_bytes(key)
+    finally:
+        for box in boxes:
+            box.close()
+
+
+def ingest_message(profile, raw, date, decrypt=False):
+    """Update the peers state from the headers of a message.
+
+    :param raw: the message
+    :type raw: bytes
+    :param date: effective date of the message
+    :type date: int
+    :param decrypt: decrypt encrypted messages to import their
+        Autocrypt-Gossip headers
+    :type decrypt: bool
+    :return: number of peers updated
+    :rtype: int
+    """
+    # NOTE: only the header block is scanned, unless the message has to be
+    # decrypted
+    headers = scan_headers(raw, ['From', AC, 'Content-Type'])
+    updated = 0
+    sender = getaddresses(headers.get('from', []))
+    sender = sender[0][1] if sender else None
+    # NOTE: Autocrypt headers not matching the sender are ignored
+    ac_headers = [header for header in
+                  _parse_ac_values(headers.get(AC.lower(), []))
+                  if header['addr'] == sender]
+    if date is None:
+        # NOTE: the peers state can not be ordered without a date
+        return updated
+    if sender is not None:
+        # NOTE: as in Autocrypt, more than one header is no header, and
+        # without a header only the last seen date of a known peer is
+        # updated
+        header = ac_headers[0] if len(ac_headers) == 1 else {}
+        updated += update_peer(profile, sender, date, header.get(KEYDATA),
+                               header.get(PE))
+    content_type = headers.get('content-type', [''])[0].lower()
+    if decrypt and content_type.startswith('multipart/encrypted'):
+        msg = bytes_parser.parsebytes(raw)
+        key = get_seckey_from_msg(msg, profile)
+        if key is None:
+            return updated
+        pt = ParsedEmail(decrypt_email(msg, profile, key))
+        for header in _parse_ac_values(pt.gossip):
+            updated += update_gossip(profile, header['addr'], date,
+                                     header[KEYDATA])
+    return updated
+
+
+def ingest(profile, paths, decrypt=False, batch=INGEST_BATCH):
+    """Seed the peers state from mailboxes.
+
+    :param paths: paths to mbox files or Maildir directories
+    :type paths: list
+    :param decrypt: decrypt encrypted messages to import their
+        Autocrypt-Gossip headers
+    :type decrypt: bool
+    :param batch: number of messages per profile write
+    :type batch: int
+    :return: statistics in the form
+        {'messages': ..., 'updates': ..., 'errors': ..., 'seconds': ...,
+         'rate': ...}
+    :rtype: dict
+    """
+    stats = {'messages': 0, 'updates': 0, 'errors': 0}
+    start = time.time()
+    messages = iter_messages(paths)
+    done = False
+    while not done:
+        done = True
+        with transaction(profile):
+            for date, raw in messages:
+                stats['messages'] += 1
+                if date is not None:
+                    try:
+                        stats['updates'] += ingest_message(profile, raw, date,
+                                                           decrypt)
+                    except Exception:
+                        logger.exception('Could not ingest message.')
+                        stats['errors'] += 1
+                if stats['messages'] % batch == 0:
+                    done = False
+                    break
+        elapsed = time.time() - start
+        logger.info('Ingested %s messages, %.0f messages/s',
+                    stats['messages'], stats['messages'] / (elapsed or 1))
+    stats['seconds'] = time.time() - start
+    stats['rate'] = stats['messages'] / (stats['seconds'] or 1)
+    return stats
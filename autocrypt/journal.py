@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Append-only journal of profile record updates.
+
+In journal mode, adding, updating or deleting an account or peer appends
+one line to ``<profile path>.log`` instead of rewriting the profile.
+Syncs to disk are grouped: the journal is fsynced every ``sync_every``
+records, or ``sync_ms`` milliseconds after the first record that was not
+synced yet.
+On compaction the journal is sealed (renamed to ``<profile path>.log.1``)
+and a new one started, so that the profile can be written while records
+keep being appended.
+
+The profile file is written by compaction like by any other writer,
+locked and merged with the records written by other processes.
+Only one process at a time appends to the journal of a profile.
+It holds a lock on ``<profile path>.log.lock`` meanwhile, so that the
+journals left by a process that exited without compacting them are told
+apart and folded into the profile by the next writer.
+"""
+import fcntl
+import json
+import logging
+import os
+import os.path
+import shutil
+import threading
+from collections import OrderedDict
+
+from .constants import (JOURNAL_COMPACT_RECORDS, JOURNAL_EXT,
+                        JOURNAL_SYNC_MS, JOURNAL_SYNC_RECORDS, LOCK_EXT)
+from .records import json_default
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['PUT', 'DEL', 'Journal', 'journal_paths', 'journal_in_use',
+           'replay', 'open_journal', 'get_journal', 'close_journal']
+
+PUT = 'put'
+DEL = 'del'
+
+_journals = {}
+
+
+def journal_paths(path):
+    """Paths of the sealed and the current journal of a profile."""
+    return path + JOURNAL_EXT + '.1', path + JOURNAL_EXT
+
+
+def _lock_path(path):
+    return path + JOURNAL_EXT + LOCK_EXT
+
+
+def journal_in_use(path):
+    """Whether a process has the journal of the profile at path open."""
+    lockpath = _lock_path(path)
+    if not os.path.isfile(lockpath):
+        return False
+    with open(lockpath, 'a') as fp:
+        try:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+def _truncate(jpath):
+    """Cut the journal at jpath after its last valid entry.
+
+    So that the entries appended after a crash are not written after a
+    truncated one, where replay stops.
+    """
+    if not os.path.isfile(jpath):
+        return
+    length = 0
+    with open(jpath, 'rb') as fp:
+        for line in fp:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            length += len(line)
+    if length < os.path.getsize(jpath):
+        logger.warning('Truncating %s after its last valid entry', jpath)
+        with open(jpath, 'r+b') as fp:
+            fp.truncate(length)
+
+
+def replay(path):
+    """Iterate over the journal entries of the profile at path.
+
+    :return: entries in the form (op, section, addr, record)
+    :rtype: iterator
+    """
+    for jpath in journal_paths(path):
+        if os.path.isfile(jpath):
+            yield from _replay_file(jpath)
+
+
+def _replay_file(jpath):
+    with open(jpath) as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # NOTE: last line of a journal being written on crash
+                logger.warning('Ignoring truncated entry in %s', jpath)
+                break
+            yield entry['op'], entry['section'], entry['addr'], \
+                entry.get('record')
+
+
+class Journal(object):
+    """Journal being appended to for the profile at path."""
+
+    def __init__(self, path, sync_every=JOURNAL_SYNC_RECORDS,
+                 sync_ms=JOURNAL_SYNC_MS,
+                 compact_every=JOURNAL_COMPACT_RECORDS):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_ms = sync_ms
+        self.compact_every = compact_every
+        self.sealed_path, self.journal_path = journal_paths(path)
+        self.lock = threading.RLock()
+        self.records = 0
+        # NOTE: records appended since the journal was last sealed, in the
+        # form [(section, addr),]
+        self.keys = OrderedDict()
+        self.pending = 0
+        self.syncs = 0
+        self.compaction = None
+        self._timer = None
+        self._lockfp = open(_lock_path(path), 'a')
+        fcntl.flock(self._lockfp.fileno(), fcntl.LOCK_SH)
+        _truncate(self.journal_path)
+        self._fp = open(self.journal_path, 'a')
+
+    def append(self, op, section, addr, record=None):
+        """Append an entry, return True when compaction is due."""
+        entry = {'op': op, 'section': section, 'addr': addr}
+        if op == PUT:
+            entry['record'] = record
+        line = json.dumps(entry, separators=(',', ':'),
+                          default=json_default) + '\n'
+        with self.lock:
+            self._fp.write(line)
+            self._fp.flush()
+            self.records += 1
+            self.keys[(section, addr)] = None
+            self.pending += 1
+            if self.pending >= self.sync_every:
+                self.sync()
+            elif self.pending == 1 and self.sync_ms:
+                self._timer = threading.Timer(self.sync_ms / 1000.0,
+                                              self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+            return self.records >= self.compact_every
+
+    def sync(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending or self._fp.closed:
+                return
+            os.fsync(self._fp.fileno())
+            self.pending = 0
+            self.syncs += 1
+
+    def seal(self):
+        """Start a new journal.
+
+        Any previous compaction has to be finished before sealing again.
+        The sealed journal of a compaction that failed is kept, with the
+        journal appended to it.
+
+        :return: the path of the sealed journal and the records appended
+            to it, in the form [(section, addr),]
+        :rtype: tuple
+        """
+        with self.lock:
+            self.wait()
+            self.sync()
+            self._fp.close()
+            if os.path.isfile(self.sealed_path):
+                keys = self._append_sealed()
+            else:
+                os.replace(self.journal_path, self.sealed_path)
+                keys = list(self.keys)
+            self._fp = open(self.journal_path, 'a')
+            self.records = 0
+            self.keys = OrderedDict()
+            return self.sealed_path, keys
+
+    def _append_sealed(self):
+        """Append the journal to the sealed one, return all their records."""
+        logger.warning('Keeping %s, left by a failed compaction',
+                       self.sealed_path)
+        _truncate(self.sealed_path)
+        keys = OrderedDict(((section, addr), None) for _, section, addr, _
+                           in _replay_file(self.sealed_path))
+        keys.update(self.keys)
+        with open(self.journal_path) as fp, \
+                open(self.sealed_path, 'a') as sealed:
+            shutil.copyfileobj(fp, sealed)
+            sealed.flush()
+            os.fsync(sealed.fileno())
+        os.remove(self.journal_path)
+        return list(keys)
+
+    def wait(self):
+        """Wait for a compaction running in the background."""
+        if self.compaction is not None:
+            self.compaction.join()
+            self.compaction = None
+
+    def close(self):
+        with self.lock:
+            self.wait()
+            self.sync()
+            self._fp.close()
+            # NOTE: closing the file releases the lock
+            self._lockfp.close()
+
+
+def open_journal(path, **kwargs):
+    """Start journal mode for the profile at path."""
+    journal = _journals.get(path)
+    if journal is None:
+        journal = _journals[path] = Journal(path, **kwargs)
+        logger.debug('Opened journal for %s', path)
+    return journal
+
+
+def get_journal(path):
+    """Journal of the profile at path, None when not in journal mode."""
+    return _journals.get(path)
+
+
+def close_journal(path):
+    journal = _journals.pop(path, None)
+    if journal is not None:
+        journal.close()
+        logger.debug('Closed journal for %s', path)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Reserve of pre-generated keys, so that accounts are created instantly.
+
+Generating a primary key and its subkey takes seconds. The pool keeps
+keys generated in advance, without uid, in a file. When an account is
+created a key is taken from the pool, bound to the address and the pool
+is refilled in a background thread.
+
+The pool file is locked while keys are taken or added and read again,
+so that processes sharing it never take the same key.
+
+"""
+
+import json
+import logging
+import os
+import os.path
+import threading
+from contextlib import contextmanager
+
+from .constants import (KEY_ALG, KEY_ALG_RSA, KEYPOOL_LOW, KEYPOOL_PATH,
+                        KEYPOOL_SIZE)
+from .crypto import _bind_key, _gen_skey, _gen_ssubkey, gen_key, pgpy
+from .utils import file_lock
+
+logger = logging.getLogger('autocrypt')
+
+__all__ = ['KeyPool']
+
+ALG = 'alg'
+PRIMARY = 'primary'
+SUBKEY = 'subkey'
+
+
+class KeyPool(object):
+    """Persistent reserve of keys without uid.
+
+    :param path: path to the file where the keys are stored
+    :type path: str
+    :param size: number of keys to keep in the pool
+    :type size: int
+    :param low: refill the pool when it has less than this number of keys
+    :type low: int
+    :param alg: key algorithm of the keys in the pool, one of KEY_ALGS
+    :type alg: str
+    """
+
+    def __init__(self, path=KEYPOOL_PATH, size=KEYPOOL_SIZE,
+                 low=KEYPOOL_LOW, alg=KEY_ALG):
+        assert 0 <= low <= size
+        self.path = path
+        self.alg = alg
+        self.size = size
+        self.low = low
+        self.lock = threading.RLock()
+        self.worker = None
+        self._stop = threading.Event()
+        self.keys = self._load()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path) as fp:
+            try:
+                keys = json.load(fp)
+            except ValueError:
+                logger.warning('Ignoring corrupted key pool %s', self.path)
+                return []
+        # NOTE: keys of other algorithms are discarded, the pool is refilled
+        # with keys of the current one
+        return [entry for entry in keys
+                if entry.get(ALG, KEY_ALG_RSA) == self.alg]
+
+    @contextmanager
+    def _locked(self):
+        """Hold the pool locks, with the keys read again from the file."""
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with self.lock, file_lock(self.path):
+            # NOTE: other processes may have taken or added keys
+            self.keys = self._load()
+            yield
+
+    def _save(self):
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as fp:
+            json.dump(self.keys, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmppath, self.path)
+
+    def _generate(self):
+        # NOTE: subkeys can not be bound before the key has an uid, so
+        # both keys are kept separately until the address is known
+        return {ALG: self.alg, PRIMARY: str(_gen_skey(self.alg)),
+                SUBKEY: str(_gen_ssubkey(self.alg))}
+
+    def fill(self):
+        """Generate keys until the pool is full.
+
+        Keys are saved one by one, so that the work done is not lost if
+        the process is interrupted.
+        """
+        while not self._stop.is_set():
+            with self._locked():
+                if len(self.keys) >= self.size:
+                    break
+            entry = self._generate()
+            with self._locked():
+                self.keys.append(entry)
+                self._save()
+            logger.debug('Key pool has %s keys', len(self.keys))
+
+    def refill(self):
+        """Fill the pool in a background thread if it is below the low mark.
+
+        :return: the worker thread or None if no refill was needed
+        :rtype: threading.Thread
+        """
+        with self.lock:
+            if len(self.keys) >= self.low:
+                return None
+            if self.worker is not None and self.worker.is_alive():
+                return self.worker
+            self._stop.clear()
+            self.worker = threading.Thread(target=self.fill,
+                                           name='autocrypt-keypool',
+                                           daemon=True)
+            self.worker.start()
+            return self.worker
+
+    def wait(self, timeout=None):
+        """Wait for the background refill to finish."""
+        worker = self.worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def stop(self):
+        """Stop the background refill after the key being generated."""
+        self._stop.set()
+        self.wait()
+
+    def get(self, addr):
+        """Return a secret key for addr, taken from the pool if possible.
+
+        If the pool is empty the key is generated synchronously.
+
+        :param addr: e-mail address for the key uid
+        :type addr: str
+        :return: secret key with uid and encryption subkey
+        :rtype: PGPKey
+        """
+        with self._locked():
+            entry = self.keys.pop(0) if self.keys else None
+            if entry is not None:
+                self._save()
+        self.refill()
+        if entry is None:
+            logger.info('Key pool is empty, generating key for %s', addr)
+            return gen_key(addr, self.alg)
+        seckey, _ = pgpy.PGPKey.from_blob(entry[PRIMARY])
+        ssubkey, _ = pgpy.PGPKey.from_blob(entry[SUBKEY])
+        return _bind_key(seckey, ssubkey, addr)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Content addressed store of the keys of a profile.
+
+With a key store, the profile records reference their keys by the
+SHA-256 digest of the key bytes, ``sha256:<hex digest>``, and the keys
+are stored once, as raw bytes, in ``<profile path>.keys``. A peer key
+that is also its gossip key, or the same key seen for several peers, is
+stored and kept in memory once.
+
+The key store file is a sequence of entries: the 32 bytes digest, the
+length of the key as 4 bytes big endian unsigned integer and the key.
+New keys are appended to it before the profile that references them is
+written, and it is rewritten without the keys that are not referenced
+anymore when they are at least ``KEYSTORE_GARBAGE`` of them.
+
+Example::
+
+    profile = load(path, keystore=True)
+    new_peer(profile, addr, keydata)
+    save(profile)
+
+"""
+import logging
+import os
+import os.path
+import struct
+import threading
+
+from .cache import keydata_digest
+from .constants import (ACCOUNTS, KEYREF_PREFIX, KEYSTORE_EXT,
+                        KEYSTORE_GARBAGE, PEERS)
+from .records import Account, Peer, _keydata2bytes, _Record, json_default
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['KeyStore', 'close_keystore', 'get_keystore', 'is_keyref',
+           'keystore_path', 'open_keystore']
+
+ENTRY = struct.Struct('>32sI')
+KEYFIELDS = {ACCOUNTS: Account._keyfields, PEERS: Peer._keyfields}
+
+_keystores = {}
+
+
+def keystore_path(path):
+    """Path of the key store of the profile at path."""
+    return path + KEYSTORE_EXT
+
+
+def is_keyref(value):
+    return isinstance(value, str) and value.startswith(KEYREF_PREFIX)
+
+
+def _keyref(digest):
+    return KEYREF_PREFIX + digest.hex()
+
+
+def _digest(keyref):
+    return bytes.fromhex(keyref[len(KEYREF_PREFIX):])
+
+
+class KeyStore(object):
+    """Keys of the profile at path, by digest.
+
+    :param path: path to the profile
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = keystore_path(path)
+        self.lock = threading.RLock()
+        # NOTE: key bytes by digest, and digests not written yet
+        self.keys = {}
+        self.pending = []
+        # NOTE: length and inode of the file read, other processes append
+        # keys to it or rewrite it
+        self.size = 0
+        self.inode = None
+        self.refresh()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def refresh(self):
+        """Read the keys written to the file since it was last read.
+
+        It has to be called with the profile locked, as in
+        storage._sync_json, so that no other process is writing it.
+        """
+        with self.lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if self.inode is not None:
+                    # NOTE: removed, all the keys have to be written again
+                    self.inode = None
+                    self.size = 0
+                    self.pending = list(self.keys)
+                return
+            rewritten = st.st_ino != self.inode
+            if rewritten:
+                # NOTE: a new file, or rewritten by collect
+                self.inode = st.st_ino
+                self.size = 0
+            elif st.st_size <= self.size:
+                return
+            with open(self.path, 'rb') as fp:
+                fp.seek(self.size)
+                data = fp.read()
+            offset = 0
+            read = set()
+            while offset + ENTRY.size <= len(data):
+                digest, size = ENTRY.unpack_from(data, offset)
+                start = offset + ENTRY.size
+                if start + size > len(data):
+                    break
+                # NOTE: the keys in memory are kept, as records use them
+                self.keys.setdefault(digest, data[start:start + size])
+                read.add(digest)
+                offset = start + size
+            if offset < len(data):
+                # NOTE: last entry of a key store being written on crash,
+                # it is overwritten by the next keys
+                logger.warning('Ignoring truncated entry in %s', self.path)
+            self.size += offset
+            if rewritten:
+                # NOTE: keys collected by another process are written again
+                self.pending = [d for d in self.keys if d not in read]
+            elif read:
+                self.pending = [d for d in self.pending if d not in read]
+            logger.debug('Read %s keys from %s', len(read), self.path)
+
+    def intern(self, kbytes):
+        """Add the key bytes, return the stored bytes that are equal.
+
+        :type kbytes: bytes
+        :rtype: bytes
+        """
+        digest = keydata_digest(kbytes)
+        with self.lock:
+            stored = self.keys.get(digest)
+            if stored is None:
+                stored = self.keys[digest] = kbytes
+                self.pending.append(digest)
+        return stored
+
+    def put(self, kbytes):
+        """Add the key bytes, return their reference.
+
+        :type kbytes: bytes
+        :rtype: str
+        """
+        digest = keydata_digest(kbytes)
+        with self.lock:
+            if digest not in self.keys:
+                self.keys[digest] = kbytes
+                self.pending.append(digest)
+        return _keyref(digest)
+
+    def get(self, keyref):
+        """Key bytes of a reference.
+
+        :raises: KeyError when the key is not in the store
+        :rtype: bytes
+        """
+        return self.keys[_digest(keyref)]
+
+    def resolve(self, section, record):
+        """Record with the key references replaced by the key bytes.
+
+        Key bytes and keydata are replaced by the stored key bytes, so
+        that equal keys are kept in memory once. Line breaks in keydata
+        are not kept.
+
+        :param section: ACCOUNTS or PEERS
+        :type section: str
+        :param record: record
+        :type record: dict or Account or Peer
+        :rtype: dict
+        """
+        if isinstance(record, _Record):
+            return record.to_dict(keyref=self.intern)
+        record = dict(record)
+        for name in KEYFIELDS[section]:
+            value = record.get(name)
+            if is_keyref(value):
+                record[name] = self.get(value)
+            elif isinstance(value, str):
+                kbytes = _keydata2bytes(''.join(value.split()))
+                if isinstance(kbytes, bytes):
+                    record[name] = self.intern(kbytes)
+            elif isinstance(value, bytes):
+                record[name] = self.intern(value)
+        return record
+
+    def json_default(self, live):
+        """``default`` argument for json.dump to write key references.
+
+        :param live: set the references of the keys written are added to
+        :type live: set
+        """
+        def keyref(kbytes):
+            keyref = self.put(kbytes)
+            live.add(keyref)
+            return keyref
+
+        def default(obj):
+            if isinstance(obj, _Record):
+                return obj.to_dict(keyref=keyref)
+            return json_default(obj)
+        return default
+
+    def _write(self, fp, digests):
+        for digest in digests:
+            kbytes = self.keys[digest]
+            fp.write(ENTRY.pack(digest, len(kbytes)))
+            fp.write(kbytes)
+        fp.truncate()
+        fp.flush()
+        os.fsync(fp.fileno())
+        return fp.tell()
+
+    def flush(self):
+        """Append the keys not written yet and sync them to disk."""
+        with self.lock:
+            # NOTE: after the keys appended by other processes
+            self.refresh()
+            if not self.pending:
+                return
+            mode = 'r+b' if os.path.isfile(self.path) else 'wb'
+            with open(self.path, mode) as fp:
+                fp.seek(self.size)
+                self.size = self._write(fp, self.pending)
+                self.inode = os.fstat(fp.fileno()).st_ino
+            logger.debug('Wrote %s keys in %s', len(self.pending), self.path)
+            self.pending = []
+
+    def collect(self, live):
+        """Rewrite the store without the keys not referenced, if many.
+
+        :param live: references of the keys to keep
+        :type live: set
+        :return: whether the store has been rewritten
+        :rtype: bool
+        """
+        with self.lock:
+            garbage = len(self.keys) - len(live)
+            if not garbage or garbage < KEYSTORE_GARBAGE * len(self.keys):
+                return False
+            digests = set(_digest(keyref) for keyref in live)
+            # NOTE: keys added after the profile was written are kept
+            digests.update(self.pending)
+            self.keys = dict((d, k) for d, k in self.keys.items()
+                             if d in digests)
+            tmppath = self.path + '.tmp'
+            with open(tmppath, 'wb') as fp:
+                self.size = self._write(fp, list(self.keys))
+                self.inode = os.fstat(fp.fileno()).st_ino
+            os.replace(tmppath, self.path)
+            self.pending = []
+            logger.debug('Collected key store %s, %s keys', self.path,
+                         len(self.keys))
+            return True
+
+
+def open_keystore(path):
+    """Start using a key store for the profile at path."""
+    keystore = _keystores.get(path)
+    if keystore is None:
+        keystore = _keystores[path] = KeyStore(path)
+        logger.debug('Opened key store for %s', path)
+    return keystore
+
+
+def get_keystore(path):
+    """Key store of the profile at path, None when it does not use one."""
+    return _keystores.get(path)
+
+
+def close_keystore(path):
+    keystore = _keystores.pop(path, None)
+    if keystore is not None:
+        keystore.flush()
+        logger.debug('Closed key store for %s', path)
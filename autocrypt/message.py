@@ -6,7 +6,6 @@
  Autcrypt technical specifications.
 """
 import logging
-import logging.config
 import random
 import re
 from email import policy
@@ -14,32 +13,47 @@ from email.message import Message
 from email.mime.text import MIMEText
 from email.parser import Parser
 
-from emailpgp.mime.multipartpgp import MIMEMultipartPGP
-
+from . import metrics
 from .acmime import MIMEMultipartACSetup
+from .cache import ac_header_cache, gossip_header_cache
 from .constants import (AC, AC_GOSSIP, AC_GOSSIP_HEADER, AC_HEADER,
-                        AC_HEADER_PE, AC_PASSPHRASE_BEGIN,
+                        AC_HEADER_ATTRS, AC_HEADER_MAXLEN, AC_HEADER_PE,
+                        AC_PASSPHRASE_BEGIN,
                         AC_PASSPHRASE_BEGIN_LEN, AC_PASSPHRASE_FORMAT,
                         AC_PASSPHRASE_LEN, AC_PASSPHRASE_NUM_BLOCKS,
                         AC_PASSPHRASE_NUM_WORDS, AC_PASSPHRASE_WORD_LEN,
                         AC_PREFER_ENCRYPT_HEADER, AC_SETUP_INTRO, AC_SETUP_MSG,
                         AC_SETUP_SUBJECT, ACCOUNTS, ADDR, KEYDATA,
-                        LEVEL_NUMBER, NOPREFERENCE, PE, PE_HEADER_TYPES, PEERS)
-from .crypto import (_get_seckey_from_addr, decrypt,
-                     get_own_public_keydata, get_peer_keydata,
+                        LEVEL_NUMBER, NOPREFERENCE, PE_HEADER_TYPES, PEERS,
+                        PUBKEY)
+from .crypto import (_get_seckey_from_addr, _peer_key_field, decrypt,
                      sign_encrypt, sym_decrypt,
                      sym_encrypt)
-from .storage import new_peer
+from .peerstate import message_date, update_gossip, update_peer
+from .storage import transaction
+from .utils import LazyModule
 
 logger = logging.getLogger(__name__)
 parser = Parser(policy=policy.default)
+HEADER_END_RE = re.compile(b'\r?\n\r?\n')
+# NOTE: the name of an attribute of a header value, with the whitespace
+# around it, the value goes up to the next ";"
+HEADER_ATTR_RE = re.compile(r'\s*([^\s=;]+)\s*=')
+HEADER_TAIL_RE = re.compile(r'\s*\Z')
+FOLDING_WS = ' \t\r\n'
+# NOTE: imported the first time an encrypted Email is generated
+multipartpgp = LazyModule('emailpgp.mime.multipartpgp')
+pgpy_errors = LazyModule('pgpy.errors')
 
 
 __all__ = ['wrap', 'unwrap', 'gen_headervaluestr_from_headervaluedict',
            'header_unwrap', 'header_wrap', 'gen_ac_headerdict',
-           'gen_ac_headervaluestr', 'parse_header_value', 'parse_ac_headers',
+           'gen_ac_headervaluestr', 'tokenize_header_value',
+           'parse_header_value', 'parse_ac_headers',
+           'scan_headers', 'scan_ac_headers',
            'gen_encrypted_email', 'add_headers', 'add_ac_headers',
-           'gen_ac_email', 'decrypt_email', 'parse_ac_email',
+           'get_ac_headervaluestr',
+           'gen_ac_email', 'decrypt_email', 'ParsedEmail', 'parse_ac_email',
            'header_unwrap_keydata', 'gen_gossip_headervalue',
            'gen_gossip_headervalues', 'parse_gossip_list_from_msg',
            'store_keys_from_gossiplist', 'get_seckey_from_msg',
@@ -85,31 +99,89 @@ def gen_headervaluestr_from_headervaluedict(headervaluedict):
                       if i in headervaluedict.keys()])
 
 
+def tokenize_header_value(headervaluestr):
+    """Iterate over the attributes of an Email header value.
+
+    The value is scanned once, the folding whitespace around the names
+    and the separators is skipped.
+
+    :param headervaluestr: an Email header value in the form:
+        "name=value; name=value"
+    :type headervaluestr: str
+    :return: (name, value) pairs, the values with the whitespace around
+        them
+    :rtype: generator
+    :raises ValueError: when the header value is longer than
+        AC_HEADER_MAXLEN or it is not a list of attributes
+    """
+    if len(headervaluestr) > AC_HEADER_MAXLEN:
+        raise ValueError('Header value longer than {} characters.'.format(
+            AC_HEADER_MAXLEN))
+    match = HEADER_ATTR_RE.match
+    find = headervaluestr.find
+    pos, end = 0, len(headervaluestr)
+    while pos < end:
+        m = match(headervaluestr, pos)
+        if m is None:
+            if HEADER_TAIL_RE.match(headervaluestr, pos):
+                return
+            raise ValueError('Malformed header value at {}.'.format(pos))
+        pos = find(';', m.end())
+        if pos == -1:
+            pos = end
+        yield m.group(1), headervaluestr[m.end():pos]
+        pos += 1
+
+
+def _unfold_keydata(value):
+    keydata = value.strip()
+    # NOTE: looking for each character is faster than splitting a keydata
+    # that is not folded
+    for ws in FOLDING_WS:
+        if ws in keydata:
+            return ''.join(keydata.split())
+    return keydata
+
+
 def parse_header_value(headervaluestr):
-    """Parse an Email header value.
+    """Parse an Autocrypt Email header value.
+
+    The non-critical attributes, starting with "_", are ignored. The keydata
+    is unfolded, removing all its whitespace.
 
     :param headervaluestr: an Email header value in the form:
         "addr=...; <prefer-encrypt:; >keydata=..."
     :type text: string
     :return: an Email header value dict
     :rtype: dict
+    :raises ValueError: when the header value is not valid, it lacks the
+        addr or keydata attribute or it has other critical attributes
     """
-    # NOTE: can not just do the following, as keydata may contain "="
-    # headervaluedict = dict([(k.strip(),v.strip()) for k,v in
-    #                     [i.split('=') for i in header.split(';')]])
-    # NOTE: email.mime splits keywords with '\n '
-    header_kv_list = re.split('; |;\n ', headervaluestr)
     headervaluedict = dict()
-    for kv in header_kv_list:
-        if kv.startswith('addr='):
-            headervaluedict[ADDR] = kv.split('addr=')[1].strip()
-        elif kv.startswith('prefer-encrypt='):
-            headervaluedict[PE] = kv.split('prefer-encrypt=')[1].strip()
-        elif kv.startswith('keydata='):
-            headervaluedict[KEYDATA] = kv.split('keydata=')[1].strip()
+    for name, value in tokenize_header_value(headervaluestr):
+        if name == KEYDATA:
+            headervaluedict[KEYDATA] = _unfold_keydata(value)
+        elif name in AC_HEADER_ATTRS:
+            headervaluedict[name] = value.strip()
+        elif not name.startswith('_'):
+            raise ValueError('Unknown critical attribute {}.'.format(name))
+    for name in [ADDR, KEYDATA]:
+        if name not in headervaluedict:
+            raise ValueError('Missing attribute {}.'.format(name))
     return headervaluedict
 
 
+def _parse_ac_values(values):
+    """Parse the valid header values, skipping the others."""
+    headervaluedicts = []
+    for value in values:
+        try:
+            headervaluedicts.append(parse_header_value(value))
+        except ValueError as e:
+            logger.warning('Ignoring invalid Autocrypt header: %s', e)
+    return headervaluedicts
+
+
 def header_unwrap(headervaluestr, wrapstr="\n "):
     headervaluedict = parse_header_value(headervaluestr)
     headervaluedict['keydata'] = unwrap(headervaluedict['keydata'], wrapstr)
@@ -167,13 +239,78 @@ def parse_ac_headers(msg):
 
     :param msg: an Email
     :type msg: string or Message
-    :return: list of Autcrypt header values as dict in the form:
+    :return: list of the valid Autcrypt header values as dict in the form:
         [{'addr': ..., 'keydata':...}, {'addr': ..., 'keydata':...},]
     :rtype: list
     """
     msg = msg if isinstance(msg, Message) else parser.parsestr(msg)
     ac_header_list = [v.strip() for k, v in msg.items() if k == AC]
-    return [parse_header_value(i) for i in ac_header_list]
+    return _parse_ac_values(ac_header_list)
+
+
+def scan_headers(raw, names=None):
+    """Unfolded values of the headers of a raw Email.
+
+    Only the header block is read, the body is not parsed nor, when raw is
+    a file, read.
+
+    :param raw: an Email
+    :type raw: bytes, str or binary file object
+    :param names: names of the headers to return, all if None
+    :type names: list
+    :return: header values by lower case header name, in the form:
+        {'autocrypt': ['addr=...; keydata=...'], }
+    :rtype: dict
+    """
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8', 'surrogateescape')
+    if isinstance(raw, bytes):
+        # NOTE: split only the header block in lines
+        end = HEADER_END_RE.search(raw)
+        lines = raw[:end.end() if end else len(raw)].splitlines(True)
+    else:
+        lines = raw
+    names = None if names is None else set(n.lower() for n in names)
+    headers = {}
+    name = value = None
+    for line in lines:
+        if line[:1] in (b' ', b'\t'):
+            # NOTE: unfolding removes only the line break
+            if value is not None:
+                value.append(line.rstrip(b'\r\n'))
+            continue
+        if name is not None:
+            headers.setdefault(name, []).append(
+                b''.join(value).decode('latin-1').strip())
+            name = value = None
+        if line in (b'\n', b'\r\n', b''):
+            break
+        field, sep, rest = line.partition(b':')
+        if not sep:
+            continue
+        field = field.strip().decode('latin-1').lower()
+        if names is None or field in names:
+            name, value = field, [rest.rstrip(b'\r\n')]
+    else:
+        if name is not None:
+            headers.setdefault(name, []).append(
+                b''.join(value).decode('latin-1').strip())
+    return headers
+
+
+def scan_ac_headers(raw):
+    """Autocrypt headers of a raw Email, without parsing the Email.
+
+    :param raw: an Email
+    :type raw: bytes, str or binary file object
+    :return: list of Autocrypt header values as dict, with the keydata
+        whitespace removed, and the Autocrypt-Setup-Message value or None
+    :rtype: list, str
+    """
+    headers = scan_headers(raw, [AC, AC_SETUP_MSG])
+    setup = headers.get(AC_SETUP_MSG.lower())
+    return (_parse_ac_values(headers.get(AC.lower(), [])),
+            setup[0] if setup else None)
 
 
 def add_headers(msg, sender, recipients, subject, date=None, _dto=False,
@@ -226,6 +363,32 @@ def add_ac_headers(msg, sender, keydata, pe):
     return msg
 
 
+def get_ac_headervaluestr(profile, sender, pe=None):
+    """Folded Autocrypt header value of an account, as in add_ac_headers.
+
+    It is generated once for each account key and prefer-encrypt, then it
+    is taken from the cache until the account changes.
+
+    :param sender: address of the account
+    :type sender: str
+    :param pe: prefer-encrypt
+    :type pe: str
+    :return: folded Autocrypt header value
+    :rtype: str
+    """
+    account = profile[ACCOUNTS][sender]
+    kbytes = account.keybytes(PUBKEY)
+    cached = ac_header_cache.get((sender, pe))
+    # NOTE: the key is compared too, as a profile restored after a
+    # transaction or another profile may have a different account key
+    if cached is not None and cached[0] == kbytes:
+        return cached[1]
+    ac_header = header_wrap(gen_ac_headervaluestr(sender, account[PUBKEY],
+                                                  pe))
+    ac_header_cache.put((sender, pe), (kbytes, ac_header))
+    return ac_header
+
+
 def gen_encrypted_email(encryptedstr, boundary=None):
     """Generate encrypted/multipart Email from encrypted body.
 
@@ -234,7 +397,7 @@ def gen_encrypted_email(encryptedstr, boundary=None):
     :return: an Email Message with the encrypted str as body
     :rtype: Message
     """
-    msg = MIMEMultipartPGP(encryptedstr, boundary=boundary)
+    msg = multipartpgp.MIMEMultipartPGP(encryptedstr, boundary=boundary)
     logger.debug('Generated encrypted MIME Multipart.')
     return msg
 
@@ -268,18 +431,49 @@ def gen_ac_email(profile, sender, recipients, subject, body, pe=None,
     assert sender in profile[ACCOUNTS].keys()
     for r in recipients:
         assert r in profile[PEERS].keys()
-    keydata = get_own_public_keydata(profile, sender)
 
     data = MIMEText(body)
     cmsg = sign_encrypt(profile, data.as_bytes(), sender, recipients)
-    msg = gen_encrypted_email(str(cmsg), boundary)
-    add_headers(msg, sender, recipients, subject, date, _dto,
-                message_id, _extra)
-    add_ac_headers(msg, sender, keydata, pe)
+    if cmsg is None:
+        raise ValueError('No key found to encrypt to {}.'.format(
+            ', '.join(recipients)))
+    with metrics.timer('mime_build'):
+        msg = gen_encrypted_email(str(cmsg), boundary)
+        add_headers(msg, sender, recipients, subject, date, _dto,
+                    message_id, _extra)
+        msg.add_header(AC, get_ac_headervaluestr(profile, sender, pe))
     logger.info('Generated Autcrypt Email: \n%s', msg)
     return msg
 
 
+class ParsedEmail(str):
+    """Decrypted Email text, with its headers, gossip and body parsed.
+
+    It is the decrypted text itself, so that it can be used as the str
+    that was returned before. The text is parsed once when created.
+
+    :param pt: decrypted Email text
+    :type pt: str
+    :param ac: Autocrypt header value of the outer Email as dict
+    :type ac: dict
+    """
+
+    def __new__(cls, pt, ac=None):
+        self = str.__new__(cls, pt)
+        with metrics.timer('mime_parse'):
+            pmsg = parser.parsestr(pt)
+        #: headers of the decrypted Email, as list of (name, value)
+        self.headers = pmsg.items()
+        #: Autocrypt Gossip header values, as in
+        #: :func:`parse_gossip_list_from_msg`
+        self.gossip = [v.strip() for k, v in self.headers if k == AC_GOSSIP]
+        part = pmsg.get_body(preferencelist=('plain', 'html'))
+        self.body = part.get_content() if part is not None \
+            else pmsg.get_payload()
+        self.ac = ac
+        return self
+
+
 def decrypt_email(msg, profile, key=None):
     """Decrypt Email.
 
@@ -297,44 +491,104 @@ def decrypt_email(msg, profile, key=None):
     return pt
 
 
+def _get_ac_header(msg):
+    """The Autocrypt header value of an Email as dict.
+
+    :return: the only valid header value, None when there is none or
+        more than one
+    :rtype: dict
+    """
+    ac_headers = parse_ac_headers(msg)
+    if len(ac_headers) > 1:
+        logger.error('There is more than one Autocrypt header.')
+    return ac_headers[0] if len(ac_headers) == 1 else None
+
+
+def _update_sender(profile, ac_headervaluedict, date):
+    update_peer(profile, ac_headervaluedict['addr'], date,
+                ac_headervaluedict['keydata'],
+                ac_headervaluedict.get('prefer-encrypt'))
+    logger.debug('Imported keydata from Autocrypt header.')
+
+
+def _parse_ac_plain(msg, profile, ac_headervaluedict):
+    """Store the Autocrypt header of an Email that is not encrypted.
+
+    :return: the Email text, its gossip headers are not stored
+    :rtype: ParsedEmail
+    """
+    with transaction(profile):
+        _update_sender(profile, ac_headervaluedict, message_date(msg['Date']))
+    return ParsedEmail(msg.as_string(), ac_headervaluedict)
+
+
+def _parse_ac_ct(msg, profile, ac_headervaluedict, gossip=False):
+    # NOTE: the Email is decrypted once and the decrypted text parsed once,
+    # also when it contains gossip headers, before the profile is locked.
+    # The Autocrypt header is stored whether the Email is decrypted or not,
+    # an Email that is not decrypted has no gossip.
+    pt = None
+    if msg.get_content_type() == 'multipart/encrypted':
+        key = get_seckey_from_msg(msg, profile)
+        pt = _decrypt_parsed(msg, profile, key, ac_headervaluedict)
+    date = message_date(msg['Date'])
+    with transaction(profile):
+        if ac_headervaluedict is not None:
+            _update_sender(profile, ac_headervaluedict, date)
+        if gossip and pt is not None:
+            store_keys_from_gossiplist(pt.gossip, profile, date)
+            logger.info('Parsed Autocrypt Gossip Email with content: %s', pt)
+    return pt
+
+
 def parse_ac_email(msg, profile):
     """Parse an Autocrypt Email.
 
-    :return: an Autocrypt Email Message and decrypted body
-    :rtype: Message, str
+    :return: decrypted Email, None when it can not be decrypted
+    :rtype: ParsedEmail
     """
     msg = msg if isinstance(msg, Message) else parser.parsestr(msg)
-    ac_headers = parse_ac_headers(msg)
-    if len(ac_headers) == 1:
-        ac_headervaluedict = ac_headers[0]
-    else:
-        # TODO: error
-        logger.error('There is more than one Autocrypt header.')
-    new_peer(profile, ac_headervaluedict['addr'],
-             ac_headervaluedict['keydata'],
-             ac_headervaluedict['prefer-encrypt'])
-    # TODO: add lastseen datetime.utcnow())
-    logger.debug('Imported keydata from Autcrypt header.')
-    key = get_seckey_from_msg(msg, profile)
-    pt = decrypt_email(msg, profile, key)
+    pt = _parse_ac_ct(msg, profile, _get_ac_header(msg))
     logger.info('Parsed Autocrypt Email.')
     return pt
 
 
-def gen_gossip_headervalues(recipients, profile):
+def _get_gossip_headervalues(profile, addr):
+    """Gossip header value of a peer and its folded form, cached.
+
+    :rtype: tuple
+    """
+    peer = profile[PEERS].get(addr)
+    if peer is None:
+        g = gen_gossip_headervalue(addr, None)
+        return g, g
+    field = _peer_key_field(peer)
+    kbytes = peer.keybytes(field)
+    cached = gossip_header_cache.get(addr)
+    # NOTE: the key is compared too, as in get_ac_headervaluestr
+    if cached is not None and cached[0] == kbytes:
+        return cached[1]
+    g = gen_gossip_headervalue(addr, peer[field])
+    values = (g, header_wrap(g))
+    gossip_header_cache.put(addr, (kbytes, values))
+    return values
+
+
+def gen_gossip_headervalues(recipients, profile, folded=False):
     """Generate Autcrypt Gossip header values.
 
+    The values of each peer are generated once, then they are taken from
+    the cache until the peer key changes.
+
+    :param folded: whether to return the values folded as in
+        add_ac_headers
+    :type folded: bool
     :return: Autcrypt Gossip header values in the form:
         ['addr=...; keydata=...', 'addr=...; keydata=...']
     :rtype: list
     """
-    gossip_list = []
-    for r in recipients:
-        logger.debug('Generating Gossip header for recipient:\n%s', r)
-        keydata = get_peer_keydata(profile, r)
-        g = gen_gossip_headervalue(r, keydata)
-        gossip_list.append(g)
-    return gossip_list
+    index = 1 if folded else 0
+    return [_get_gossip_headervalues(profile, r)[index] for r in recipients]
 
 
 def parse_gossip_list_from_msg(msg):
@@ -349,11 +603,15 @@ def parse_gossip_list_from_msg(msg):
     return gossip_list
 
 
-def store_keys_from_gossiplist(gossip_list, profile):
-    for g in gossip_list:
-        g_dict = parse_header_value(g)
+def store_keys_from_gossiplist(gossip_list, profile, date=None):
+    """Update the gossip state of the peers from gossip header values.
+
+    :param date: effective date of the message, the current time if None
+    :type date: int
+    """
+    for g_dict in _parse_ac_values(gossip_list):
         logger.debug('Import keydata from Gossip header.')
-        new_peer(profile, g_dict['addr'], g_dict['keydata'])
+        update_gossip(profile, g_dict['addr'], date, g_dict['keydata'])
 
 
 def get_seckey_from_msg(msg, profile):
@@ -367,36 +625,38 @@ def get_seckey_from_msg(msg, profile):
     return None
 
 
-def parse_gossip_ct(msg, profile, key=None):
-    msg = msg if isinstance(msg, Message) else parser.parsestr(msg)
-    pt = decrypt_email(msg, profile, key)
+def _decrypt_parsed(msg, profile, key=None, ac=None):
+    """Decrypted Email parsed, None when it can not be decrypted."""
+    try:
+        pt = decrypt_email(msg, profile, key)
+    except (ValueError, pgpy_errors.PGPError) as e:
+        logger.warning('Could not decrypt the Email: %s', e)
+        return None
+    if pt is None:
+        return None
     # NOTE: hacky workaround, because "\n" is added after "; ""
     pt = pt.replace(
         ";\n keydata|;\r keydata|;\r\n keydata|;\n\r keydata", "; keydata")
-    pmsg = parser.parsestr(pt)
-    gossip_list = parse_gossip_list_from_msg(pmsg)
-    logger.debug('gossip_list %s', gossip_list)
-    store_keys_from_gossiplist(gossip_list, profile)
+    pt = ParsedEmail(pt, ac)
+    logger.debug('gossip_list %s', pt.gossip)
+    return pt
+
+
+def parse_gossip_ct(msg, profile, key=None, ac=None):
+    msg = msg if isinstance(msg, Message) else parser.parsestr(msg)
+    pt = _decrypt_parsed(msg, profile, key, ac)
+    if pt is None:
+        return None
+    store_keys_from_gossiplist(pt.gossip, profile, message_date(msg['Date']))
     logger.info('Parsed Autocrypt Gossip Email with content: %s', pt)
     return pt
 
 
 def parse_gossip_email(msg, profile):
     msg = msg if isinstance(msg, Message) else parser.parsestr(msg)
-    ac_headers = parse_ac_headers(msg)
-    if len(ac_headers) == 1:
-        ac_headervaluedict = ac_headers[0]
-    else:
-        # TODO: error
-        ac_headervaluedict = ac_headers[0]
-    new_peer(profile, ac_headervaluedict['addr'],
-             ac_headervaluedict['keydata'],
-             ac_headervaluedict['prefer-encrypt'])
-    # TODO: add lastseen datetime.utcnow())
-    logger.debug('Imported keydata from Autocrypt header.')
-    key = get_seckey_from_msg(msg, profile)
-    pt = parse_gossip_ct(msg, profile, key)
-    return pt
+    # NOTE: the sender and all the gossiped peers are written at once, an
+    # Email without a valid Autocrypt header only has gossip
+    return _parse_ac_ct(msg, profile, _get_ac_header(msg), gossip=True)
 
 
 def gen_gossip_pt_email(recipients, body, profile):
@@ -412,16 +672,18 @@ def gen_gossip_email(sender, recipients, profile, subject, body, pe=None,
                      keyhandle=None, date=None, _dto=False, message_id=None,
                      boundary=None, _extra=None):
     """."""
-    keydata = get_own_public_keydata(profile, sender)
-
     pmsg = gen_gossip_pt_email(recipients, body, profile)
     logger.debug('pmsg %s', pmsg)
     pgpymsg = sign_encrypt(profile, pmsg.as_bytes(), sender, recipients)
-
-    cmsg = gen_encrypted_email(str(pgpymsg), boundary=boundary)
-    add_headers(cmsg, sender, recipients, subject,
-                date, _dto, message_id, _extra)
-    add_ac_headers(cmsg, sender, keydata, pe)
+    if pgpymsg is None:
+        raise ValueError('No key found to encrypt to {}.'.format(
+            ', '.join(recipients)))
+
+    with metrics.timer('mime_build'):
+        cmsg = gen_encrypted_email(str(pgpymsg), boundary=boundary)
+        add_headers(cmsg, sender, recipients, subject,
+                    date, _dto, message_id, _extra)
+        cmsg.add_header(AC, get_ac_headervaluestr(profile, sender, pe))
     logger.info('Generated Autocrypt Gossip Email:\n{}'.
                 format(cmsg.as_string()))
     logger.info('Decrypted:\n{}'.format(pmsg.as_string()))
@@ -540,19 +802,27 @@ def parse_ac_setup_email(msg, profile, passphrase):
 
 
 def parse_email(msg, profile, passphrase=None):
-    msg = msg if isinstance(msg, Message) else parser.parsestr(msg)
+    if not isinstance(msg, Message):
+        with metrics.timer('mime_parse'):
+            msg = parser.parsestr(msg)
     if msg.get(AC_SETUP_MSG) == LEVEL_NUMBER:
         logger.info('Email is an Autocrypt Setup Message.')
         if passphrase is None:
             passphrase = input('Introduce the passphrase:\n')
         return parse_ac_setup_email(msg, profile, passphrase)
-    elif msg.get(AC) is not None:
+    # NOTE: the header is parsed once, an Email without a valid Autocrypt
+    # header is parsed as if it had none
+    ac_headervaluedict = _get_ac_header(msg) \
+        if msg.get(AC) is not None else None
+    if msg.get_content_type() == 'multipart/encrypted':
+        if ac_headervaluedict is not None or \
+                msg.get(AC_GOSSIP) is not None:
+            logger.info('Email is an encrypted Autocrypt Email.')
+            # NOTE: gossip headers found in the decrypted Email are stored
+            # too
+            return _parse_ac_ct(msg, profile, ac_headervaluedict,
+                                gossip=True)
+    elif ac_headervaluedict is not None:
         logger.info('Email contains Autocrypt headers.')
-        pt = parse_ac_email(msg, profile)
-        logger.debug('pt %s', pt)
-        if parser.parsestr(pt).get(AC_GOSSIP) is not None:
-            return parse_gossip_email(msg, profile)
-        return pt
-    if msg.get(AC_GOSSIP) is not None:
-        logger.info('Email contains Autocrypt Gossip headers.')
-        return parse_gossip_email(msg, profile)
+        return _parse_ac_plain(msg, profile, ac_headervaluedict)
+    return None
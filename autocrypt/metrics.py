@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Counters and latency histograms of the Autocrypt operations.
+
+Instrumentation is disabled by default. When disabled, instrumented
+functions only check a flag before being called, timers are a shared
+do-nothing context manager and nothing is recorded.
+
+Example::
+
+    from autocrypt import metrics
+    metrics.enable()
+    parse_email(text, profile)
+    metrics.snapshot()['histograms']['decrypt']['count']
+    metrics.dump_prometheus('/var/lib/node_exporter/autocrypt.prom')
+
+"""
+
+import functools
+import os
+import threading
+import time
+
+from .cache import ac_header_cache, gossip_header_cache, key_cache
+from .constants import METRICS_BUCKETS, METRICS_PREFIX
+
+__all__ = ['Histogram', 'disable', 'dump_prometheus', 'enable', 'inc',
+           'is_enabled', 'observe', 'prometheus_text', 'reset', 'snapshot',
+           'timed', 'timer']
+
+# NOTE: a module attribute, so that checking it is a single lookup
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class Histogram(object):
+    """Count of observations in cumulative buckets, with their sum.
+
+    :param buckets: upper bounds of the buckets, sorted
+    :type buckets: list
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Observations less or equal than each bucket upper bound.
+
+        :return: [(upper bound, count),], the last one is +Inf
+        :rtype: list
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float('inf'), self.count))
+        return result
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Remove all the recorded values."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def inc(name, value=1):
+    """Increment a counter if instrumentation is enabled."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """Record the latency of a stage and count it."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def timed(name):
+    """Decorator recording the latency of each call with the stage name.
+
+    :param name: stage name
+    :type name: str
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name):
+    """Context manager recording the latency of a block of code.
+
+    :param name: stage name
+    :type name: str
+    """
+    return _Timer(name) if _enabled else _null_timer
+
+
+# NOTE: caches whose hits and misses are exported, by name
+_caches = [('key_cache', key_cache), ('ac_header_cache', ac_header_cache),
+           ('gossip_header_cache', gossip_header_cache)]
+
+
+def _cache_counters():
+    counters = {}
+    for name, cache in _caches:
+        info = cache.info()
+        counters[name + '_hits'] = info['hits']
+        counters[name + '_misses'] = info['misses']
+    return counters
+
+
+def snapshot():
+    """Copy of the counters and histograms.
+
+    The hits and misses of the key cache and of the Autocrypt and gossip
+    header caches are included as counters.
+
+    :return: {'counters': {name: value},
+        'histograms': {name: {'count':, 'sum':, 'buckets': [(le, count),]}}}
+    :rtype: dict
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = dict(
+            (name, {'count': h.count, 'sum': h.sum,
+                    'buckets': h.cumulative()})
+            for name, h in _histograms.items())
+    counters.update(_cache_counters())
+    return {'counters': counters, 'histograms': histograms}
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def prometheus_text(prefix=METRICS_PREFIX):
+    """Metrics in the Prometheus text exposition format.
+
+    :rtype: str
+    """
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data['counters'].items()):
+        metric = '{}_{}_total'.format(prefix, name)
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, value))
+    for name, h in sorted(data['histograms'].items()):
+        metric = '{}_{}_seconds'.format(prefix, name)
+        lines.append('# TYPE {} histogram'.format(metric))
+        for bound, count in h['buckets']:
+            lines.append('{}_bucket{{le="{}"}} {}'.format(
+                metric, _format_bound(bound), count))
+        lines.append('{}_sum {}'.format(metric, repr(h['sum'])))
+        lines.append('{}_count {}'.format(metric, h['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def dump_prometheus(path, prefix=METRICS_PREFIX):
+    """Write the metrics in Prometheus text format to a file.
+
+    The file is replaced at once, so that a collector never reads it half
+    written.
+    """
+    tmppath = path + '.tmp'
+    with open(tmppath, 'w') as fp:
+        fp.write(prometheus_text(prefix))
+    os.replace(tmppath, path)
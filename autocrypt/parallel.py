@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Decryption of batches of Emails in a pool of processes.
+
+Each worker process receives the accounts secret keys once, when it
+starts, and parses them before decrypting any message.
+"""
+import logging
+import os
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+from email.message import Message
+
+from .constants import ACCOUNTS, KEYHANDLES, PEERS, SECKEY
+from .crypto import _keydata2key
+from .message import decrypt_email
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['decrypt_emails']
+
+# NOTE: profile with only the accounts secret keys, in the worker processes
+_worker_profile = None
+
+
+def _secret_profile(profile):
+    """Copy of the profile with only what is needed to decrypt."""
+    return {
+        'path': profile['path'],
+        ACCOUNTS: dict((addr, {SECKEY: account[SECKEY]})
+                       for addr, account in profile[ACCOUNTS].items()),
+        PEERS: {},
+        KEYHANDLES: {ACCOUNTS: dict(profile[KEYHANDLES][ACCOUNTS]),
+                     PEERS: {}}
+    }
+
+
+def _init_worker(profile):
+    global _worker_profile
+    _worker_profile = profile
+    for account in profile[ACCOUNTS].values():
+        try:
+            _keydata2key(account[SECKEY])
+        except ValueError:
+            logger.warning('Could not parse secret key.')
+
+
+def _decrypt(msg):
+    pt = decrypt_email(msg, _worker_profile)
+    if pt is None:
+        raise ValueError('No secret key found to decrypt the message.')
+    return pt
+
+
+def decrypt_emails(msgs, profile, max_workers=None, mp_context=None,
+                   window=None):
+    """Decrypt Emails in a pool of processes.
+
+    The secret key to decrypt each Email is found from the key id the
+    Email is encrypted to.
+
+    :param msgs: Emails to decrypt
+    :type msgs: iterable of str or Message
+    :param max_workers: number of processes, the number of CPUs by default
+    :type max_workers: int
+    :param mp_context: multiprocessing context to start the processes
+    :param window: maximum number of Emails being decrypted or waiting to
+        be, 4 per process by default
+    :type window: int
+    :return: in completion order, (position of the Email in msgs,
+        decrypted text, None) or (position, None, exception)
+    :rtype: iterator
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    window = window or 4 * max_workers
+    with ProcessPoolExecutor(max_workers, mp_context,
+                             initializer=_init_worker,
+                             initargs=(_secret_profile(profile),)) \
+            as executor:
+        pending = {}
+        msgs = iter(enumerate(msgs))
+        while True:
+            for i, msg in msgs:
+                if isinstance(msg, Message):
+                    msg = msg.as_string()
+                pending[executor.submit(_decrypt, msg)] = i
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    yield i, future.result(), None
+                except Exception as e:
+                    logger.debug('Could not decrypt Email %s: %s', i, e)
+                    yield i, None, e
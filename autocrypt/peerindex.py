@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Memory-mapped backend for the profile.
+
+The profile is written in one file with:
+
+- a header with the number of peers and key handles and the offsets of
+  the other regions
+- the peers index, fixed size entries sorted by address hash, with the
+  offset and length of the peer record
+- the key handles index, the same for the key handles of the peers
+- the peer records, the address, the record and the key handles as JSON,
+  with the keys as offset and length in the keys region
+- the keys region, with each distinct key stored once as raw bytes
+- the accounts and the rest of the profile, as JSON
+
+The file is accessed with mmap. Loading it only reads the header and the
+accounts, whatever the number of peers, a peer lookup is a binary search
+in the index that reads the pages of that peer record, and the keys are
+only read when they are used. Processes loading the same profile share
+the pages.
+
+Peers added, updated or deleted are kept in memory, on top of the file,
+until the profile is saved, which writes a new file. The storage functions
+updating a record, like new_peer, save the profile, so that outside of a
+transaction each update writes the whole file again: updates should be
+grouped in storage.transaction.
+The file is neither locked nor versioned, only one process at a time
+writes a profile of this backend.
+
+Example::
+
+    profile = load('~/.pyac/profile.idx')
+    profile[PEERS][addr][PUBKEY]
+
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+from abc import abstractmethod
+from collections import defaultdict
+from collections.abc import MutableMapping
+from operator import itemgetter
+
+from .cache import keydata_digest
+from .constants import ACCOUNTS, KEYHANDLES, PEERS
+from .records import Peer, json_default, to_record
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['INDEX_EXTS', 'MappedHandles', 'MappedPeers', 'PeerIndexFile',
+           'is_peerindex', 'load', 'save']
+
+INDEX_EXTS = ('.idx',)
+MAGIC = b'PYACIDX1'
+# NOTE: magic, number of peers, number of key handles, offsets of the peers
+# index, the key handles index, the records, the keys and the rest of the
+# profile, and its length
+HEADER = struct.Struct('>8sQQQQQQQQ')
+# NOTE: address or key handle hash, record offset and record length
+ENTRY = struct.Struct('>8sQI')
+NOT_META = ['path', ACCOUNTS, PEERS, KEYHANDLES]
+
+
+def is_peerindex(path):
+    return os.path.splitext(path)[1] in INDEX_EXTS
+
+
+def _hash(name):
+    return hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+
+
+class PeerIndexFile(object):
+    """Memory-mapped profile file.
+
+    :param path: path to the file
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.npeers, self.nhandles, self.peers_offset,
+         self.handles_offset, self.records_offset, self.keys_offset,
+         self.meta_offset, self.meta_length) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError('{} is not a peer index file.'.format(path))
+
+    def meta(self):
+        """Accounts and the rest of the profile."""
+        return json.loads(self.mm[self.meta_offset:self.meta_offset +
+                                  self.meta_length].decode('utf-8'))
+
+    def _entry(self, table, i):
+        return ENTRY.unpack_from(self.mm, table + i * ENTRY.size)
+
+    def _find(self, table, count, name):
+        """Records of the entries with the hash of name."""
+        key = _hash(name)
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(table, mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < count:
+            digest, offset, length = self._entry(table, lo)
+            if digest != key:
+                return
+            yield self._record(offset, length)
+            lo += 1
+
+    def _record(self, offset, length):
+        start = self.records_offset + offset
+        return json.loads(self.mm[start:start + length].decode('utf-8'))
+
+    def _peer(self, data):
+        record = data['record']
+        for name in Peer._keyfields:
+            value = record.get(name)
+            if isinstance(value, list):
+                start = self.keys_offset + value[0]
+                # NOTE: a view, the key is read when it is used
+                record[name] = memoryview(self.mm)[start:start + value[1]]
+        return Peer(record)
+
+    def peer(self, addr):
+        """Peer record of an address, None if there is no peer."""
+        for data in self._find(self.peers_offset, self.npeers, addr):
+            if data['addr'] == addr:
+                return self._peer(data)
+        return None
+
+    def handle(self, handle):
+        """Address of the peer with a key handle, None if there is none."""
+        for data in self._find(self.handles_offset, self.nhandles, handle):
+            if handle in data['handles']:
+                return data['addr']
+        return None
+
+    def records(self):
+        """Iterate over the peer records data, in the index order."""
+        for i in range(self.npeers):
+            _, offset, length = self._entry(self.peers_offset, i)
+            yield self._record(offset, length)
+
+    def addrs(self):
+        for data in self.records():
+            yield data['addr']
+
+    def handles(self):
+        for data in self.records():
+            for handle in data['handles']:
+                yield handle, data['addr']
+
+
+class _MappedMapping(MutableMapping):
+    """Mapping of the file entries with the changes not saved on top."""
+
+    def __init__(self, indexfile=None):
+        self.indexfile = indexfile
+        # NOTE: entries set, entries of the file deleted and entries set
+        # that are not in the file
+        self._overlay = {}
+        self._deleted = set()
+        self._added = set()
+
+    @abstractmethod
+    def _file_get(self, name):
+        """Entry of the file, None when it is not in the file."""
+
+    @abstractmethod
+    def _file_keys(self):
+        """Names of the entries of the file."""
+
+    @abstractmethod
+    def _file_len(self):
+        """Number of entries of the file."""
+
+    @abstractmethod
+    def _file_items(self):
+        """(name, entry) pairs of the file."""
+
+    def _in_file(self, name):
+        return self.indexfile is not None and \
+            self._file_get(name) is not None
+
+    def __getitem__(self, name):
+        try:
+            return self._overlay[name]
+        except KeyError:
+            pass
+        if name in self._deleted or self.indexfile is None:
+            raise KeyError(name)
+        value = self._file_get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        if name in self._deleted:
+            self._deleted.discard(name)
+        elif name not in self._overlay and not self._in_file(name):
+            self._added.add(name)
+        self._overlay[name] = value
+
+    def __delitem__(self, name):
+        if name in self._overlay:
+            del self._overlay[name]
+            if name in self._added:
+                self._added.discard(name)
+                return
+            self._deleted.add(name)
+        elif name not in self._deleted and self._in_file(name):
+            self._deleted.add(name)
+        else:
+            raise KeyError(name)
+
+    def __iter__(self):
+        if self.indexfile is not None:
+            for name in self._file_keys():
+                if name not in self._deleted and name not in self._overlay:
+                    yield name
+        yield from list(self._overlay)
+
+    def __len__(self):
+        count = self._file_len() if self.indexfile is not None else 0
+        return count - len(self._deleted) + len(self._added)
+
+    def items(self):
+        # NOTE: the file entries are read once, not looked up by key
+        items = []
+        if self.indexfile is not None:
+            items.extend((name, value) for name, value in self._file_items()
+                         if name not in self._deleted and
+                         name not in self._overlay)
+        items.extend(self._overlay.items())
+        return items
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def copy(self):
+        mapping = type(self).__new__(type(self))
+        mapping.indexfile = self.indexfile
+        mapping._overlay = dict(self._overlay)
+        mapping._deleted = set(self._deleted)
+        mapping._added = set(self._added)
+        return mapping
+
+    def clear(self):
+        self.indexfile = None
+        self._overlay.clear()
+        self._deleted.clear()
+        self._added.clear()
+
+    def update(self, other=(), **kwargs):
+        # NOTE: a copy is restored without reading the file entries
+        if isinstance(other, type(self)) and not self and not kwargs:
+            self.indexfile = other.indexfile
+            self._overlay = dict(other._overlay)
+            self._deleted = set(other._deleted)
+            self._added = set(other._added)
+            return
+        MutableMapping.update(self, other, **kwargs)
+
+    def rebase(self, indexfile):
+        """Use a file with all the changes, forgetting them."""
+        self.indexfile = indexfile
+        self._overlay = {}
+        self._deleted = set()
+        self._added = set()
+
+
+class MappedPeers(_MappedMapping):
+    """Peer records by address."""
+
+    def _file_get(self, addr):
+        return self.indexfile.peer(addr)
+
+    def _file_keys(self):
+        return self.indexfile.addrs()
+
+    def _file_len(self):
+        return self.indexfile.npeers
+
+    def _file_items(self):
+        return ((data['addr'], self.indexfile._peer(data))
+                for data in self.indexfile.records())
+
+
+class MappedHandles(_MappedMapping):
+    """Peer addresses by key handle."""
+
+    def _file_get(self, handle):
+        return self.indexfile.handle(handle)
+
+    def _file_keys(self):
+        return (handle for handle, _ in self.indexfile.handles())
+
+    def _file_len(self):
+        return self.indexfile.nhandles
+
+    def _file_items(self):
+        return self.indexfile.handles()
+
+
+def load(path):
+    """Load a profile, reading only its header and accounts.
+
+    :rtype: dict
+    """
+    indexfile = PeerIndexFile(path)
+    profile = indexfile.meta()
+    profile['path'] = path
+    profile[ACCOUNTS] = dict((addr, to_record(ACCOUNTS, record))
+                             for addr, record in profile[ACCOUNTS].items())
+    profile[PEERS] = MappedPeers(indexfile)
+    profile[KEYHANDLES] = {ACCOUNTS: profile[KEYHANDLES][ACCOUNTS],
+                           PEERS: MappedHandles(indexfile)}
+    logger.debug('Loaded profile from %s, %s peers', path,
+                 indexfile.npeers)
+    return profile
+
+
+def save(profile):
+    """Write the whole profile in a new file, replacing the current one."""
+    path = profile['path']
+    handles = defaultdict(list)
+    for handle, addr in profile[KEYHANDLES][PEERS].items():
+        handles[addr].append(handle)
+    keys = bytearray()
+    key_offsets = {}
+
+    def keyref(kbytes):
+        digest = keydata_digest(kbytes)
+        if digest not in key_offsets:
+            key_offsets[digest] = [len(keys), len(kbytes)]
+            keys.extend(kbytes)
+        return key_offsets[digest]
+
+    records = bytearray()
+    peer_entries = []
+    handle_entries = []
+    for addr, record in profile[PEERS].items():
+        data = json.dumps({
+            'addr': addr,
+            'record': to_record(PEERS, record).to_dict(keyref=keyref),
+            'handles': handles.get(addr, [])}, separators=(',', ':'))
+        data = data.encode('utf-8')
+        entry = (len(records), len(data))
+        peer_entries.append((_hash(addr),) + entry)
+        handle_entries.extend((_hash(h),) + entry
+                              for h in handles.get(addr, []))
+        records.extend(data)
+    peer_entries.sort(key=itemgetter(0))
+    handle_entries.sort(key=itemgetter(0))
+    meta = dict((name, value) for name, value in profile.items()
+                if name not in NOT_META)
+    meta[ACCOUNTS] = profile[ACCOUNTS]
+    meta[KEYHANDLES] = {ACCOUNTS: profile[KEYHANDLES][ACCOUNTS]}
+    meta = json.dumps(meta, default=json_default).encode('utf-8')
+
+    peers_offset = HEADER.size
+    handles_offset = peers_offset + len(peer_entries) * ENTRY.size
+    records_offset = handles_offset + len(handle_entries) * ENTRY.size
+    keys_offset = records_offset + len(records)
+    meta_offset = keys_offset + len(keys)
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    tmppath = path + '.tmp'
+    with open(tmppath, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, len(peer_entries), len(handle_entries),
+                             peers_offset, handles_offset, records_offset,
+                             keys_offset, meta_offset, len(meta)))
+        for entries in [peer_entries, handle_entries]:
+            fp.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+        fp.write(records)
+        fp.write(keys)
+        fp.write(meta)
+        fp.flush()
+        os.fsync(fp.fileno())
+    # NOTE: the file being replaced stays mapped until it is not used
+    os.replace(tmppath, path)
+    indexfile = PeerIndexFile(path)
+    for mapping in [profile[PEERS], profile[KEYHANDLES][PEERS]]:
+        if isinstance(mapping, _MappedMapping):
+            mapping.rebase(indexfile)
+    logger.debug('Wrote profile in %s, %s peers', path, len(peer_entries))
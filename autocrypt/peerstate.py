@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Autocrypt Level 1 peer state updates.
+
+The state of a peer is updated from the messages it sends, as in the
+Level 1 "Updating Autocrypt Peer State" rules, using the effective date
+of the message, its Date or the current time when the Date is in the
+future or missing:
+
+- messages older than the last Autocrypt header of the peer are ignored
+- the last seen timestamp is set to the most recent date
+- an Autocrypt header sets the peer key, prefer-encrypt and Autocrypt
+  timestamp
+- an Autocrypt-Gossip header more recent than the last gossip sets the
+  gossip key and timestamp
+
+A peer record is only replaced, and written, when the state changes: a
+new peer, a key with different bytes, a different prefer-encrypt
+or timestamps at least PEER_TIMESTAMP_RESOLUTION newer. Headers
+repeating the state of a known peer do not write the profile.
+
+Example::
+
+    with transaction(profile):
+        update_peer(profile, addr, message_date(msg['Date']), keydata, pe)
+        update_gossip(profile, gossip_addr, date, gossip_keydata)
+
+"""
+import logging
+import time
+from email.utils import parsedate_to_datetime
+
+from .constants import (ACTIMESTAMP, GOSSIPKEY, GOSSIPTS, LASTSEEN,
+                        NOPREFERENCE, PEER_TIMESTAMP_RESOLUTION, PEERS,
+                        PREFERENCRYPT, PUBKEY)
+from .records import _keydata2bytes
+from .storage import _lock, new_peer
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['message_date', 'same_key', 'update_gossip', 'update_peer']
+
+
+def message_date(date):
+    """Effective date of a message as a POSIX timestamp.
+
+    As in Autocrypt, dates in the future are replaced by the current
+    time.
+
+    :param date: Date header value
+    :type date: str
+    :return: timestamp or None when there is no valid Date
+    :rtype: int
+    """
+    if date is None:
+        return None
+    try:
+        timestamp = int(parsedate_to_datetime(date).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return None
+    return min(timestamp, int(time.time()))
+
+
+def same_key(kbytes, other):
+    """Whether two keys have the same bytes.
+
+    A key with the same fingerprint but other bytes, e.g. with a new
+    subkey or self-signature, is another key, that replaces the stored
+    one. The keys are not parsed.
+
+    :param kbytes: key bytes or keydata
+    :type kbytes: bytes or str
+    :param other: key bytes or keydata
+    :type other: bytes or str
+    :rtype: bool
+    """
+    return _keydata2bytes(kbytes) == _keydata2bytes(other)
+
+
+def _advanced(timestamp, date):
+    return timestamp is None or date - timestamp >= PEER_TIMESTAMP_RESOLUTION
+
+
+def _effective_date(date):
+    now = int(time.time())
+    return now if date is None else min(int(date), now)
+
+
+def update_peer(profile, addr, date=None, keydata=None, pe=None):
+    """Update the state of a peer from a message it sent.
+
+    :param addr: address of the sender
+    :type addr: str
+    :param date: effective date of the message, as in
+        :func:`message_date`, the current time if None
+    :type date: int
+    :param keydata: keydata of the Autocrypt header of the message, None
+        when the message has no valid Autocrypt header
+    :type keydata: str or bytes
+    :param pe: prefer-encrypt of the Autocrypt header
+    :type pe: str
+    :return: whether the peer state changed and was written
+    :rtype: bool
+    """
+    date = _effective_date(date)
+    with _lock(profile):
+        peer = profile[PEERS].get(addr)
+        if peer is None:
+            if keydata is None:
+                return False
+            lastseen = actimestamp = gossipkey = gossipts = None
+        else:
+            actimestamp = peer.get(ACTIMESTAMP)
+            if actimestamp is not None and date < actimestamp:
+                logger.debug('Ignoring message older than the Autocrypt '
+                             'header of %s.', addr)
+                return False
+            lastseen = peer.get(LASTSEEN)
+            gossipkey = peer.keybytes(GOSSIPKEY)
+            gossipts = peer.get(GOSSIPTS)
+        if lastseen is None or date > lastseen:
+            advanced = _advanced(lastseen, date)
+            lastseen = date
+        else:
+            advanced = False
+        if keydata is None:
+            if not advanced:
+                return False
+            new_peer(profile, addr, peer.keybytes(PUBKEY),
+                     peer.get(PREFERENCRYPT), lastseen, actimestamp,
+                     gossipkey, gossipts)
+            return True
+        pe = pe or NOPREFERENCE
+        kbytes = _keydata2bytes(keydata)
+        if peer is not None and peer.get(PREFERENCRYPT) == pe and \
+                not _advanced(actimestamp, date) and \
+                same_key(peer.keybytes(PUBKEY), kbytes):
+            return False
+        new_peer(profile, addr, kbytes, pe, lastseen, date, gossipkey,
+                 gossipts)
+        logger.debug('Updated peer %s from Autocrypt header.', addr)
+        return True
+
+
+def update_gossip(profile, addr, date=None, keydata=None):
+    """Update the gossip state of a peer from an Autocrypt-Gossip header.
+
+    :param addr: address of the gossip header
+    :type addr: str
+    :param date: effective date of the message, as in
+        :func:`message_date`, the current time if None
+    :type date: int
+    :param keydata: keydata of the gossip header
+    :type keydata: str or bytes
+    :return: whether the peer state changed and was written
+    :rtype: bool
+    """
+    date = _effective_date(date)
+    kbytes = _keydata2bytes(keydata)
+    with _lock(profile):
+        peer = profile[PEERS].get(addr)
+        if peer is None:
+            new_peer(profile, addr, gpk=kbytes, gts=date)
+            return True
+        gossipts = peer.get(GOSSIPTS)
+        if gossipts is not None and date <= gossipts:
+            return False
+        if not _advanced(gossipts, date) and \
+                same_key(peer.keybytes(GOSSIPKEY), kbytes):
+            return False
+        new_peer(profile, addr, peer.keybytes(PUBKEY),
+                 peer.get(PREFERENCRYPT), peer.get(LASTSEEN),
+                 peer.get(ACTIMESTAMP), kbytes, date)
+        logger.debug('Updated peer %s from Autocrypt-Gossip header.', addr)
+        return True
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Autocrypt Level 1 recommendations for message encryption.
+
+The peers state is kept as columns, arrays of fixed size integers, and
+the recommendations are computed column by column, for a list of
+recipients or for all the peers at once, instead of looking up each
+peer record.
+
+Example::
+
+    columns = PeerColumns(profile)
+    recommend(profile, sender, recipients, columns=columns)
+    recommend_all(profile, sender, columns=columns)
+
+"""
+
+import operator
+from array import array
+from collections import OrderedDict
+from itertools import repeat
+
+from .constants import (AC_STALE_SECONDS, ACCOUNTS, ACTIMESTAMP, GOSSIPKEY,
+                        LASTSEEN, MUTUAL, PEERS, PREFERENCRYPT, PUBKEY,
+                        RECOMMENDATIONS)
+
+__all__ = ['PeerColumns', 'preliminary', 'recommend', 'recommend_all']
+
+# NOTE: recommendations are computed as their index in RECOMMENDATIONS
+DISABLE_CODE, DISCOURAGE_CODE, AVAILABLE_CODE, ENCRYPT_CODE = range(4)
+
+
+class PeerColumns(object):
+    """Peers state needed for the recommendations, as columns.
+
+    Timestamps not set are 0.
+
+    :param profile: profile
+    :type profile: dict
+    :param addrs: addresses of the peers to keep, the ones that are not
+        peers are skipped, all the peers if None
+    :type addrs: list
+    """
+
+    def __init__(self, profile, addrs=None):
+        peers = profile[PEERS]
+        self.addrs = list(peers) if addrs is None \
+            else [addr for addr in addrs if addr in peers]
+        self.index = dict((addr, i) for i, addr in enumerate(self.addrs))
+        records = [peers[addr] for addr in self.addrs]
+        self.lastseen = array('q', [r.get(LASTSEEN) or 0 for r in records])
+        self.actimestamp = array('q', [r.get(ACTIMESTAMP) or 0
+                                       for r in records])
+        # NOTE: the keys are not base 64 encoded to know if they are set
+        self.has_ackey = array('b', [getattr(r, PUBKEY, None) is not None
+                                     for r in records])
+        self.has_key = array('b', [getattr(r, PUBKEY, None) is not None or
+                                   getattr(r, GOSSIPKEY, None) is not None
+                                   for r in records])
+        self.mutual = array('b', [r.get(PREFERENCRYPT) == MUTUAL
+                                  for r in records])
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def take(self, rows):
+        """Columns with only the given rows.
+
+        :param rows: row numbers
+        :type rows: list
+        :return: new columns
+        :rtype: PeerColumns
+        """
+        columns = PeerColumns.__new__(PeerColumns)
+        columns.addrs = [self.addrs[i] for i in rows]
+        columns.index = dict((addr, i) for i, addr in
+                             enumerate(columns.addrs))
+        for name in ['lastseen', 'actimestamp', 'has_ackey', 'has_key',
+                     'mutual']:
+            column = getattr(self, name)
+            setattr(columns, name, array(column.typecode,
+                                         [column[i] for i in rows]))
+        return columns
+
+
+def preliminary(columns):
+    """Preliminary recommendation codes of all the peers in the columns.
+
+    - disable: there is no key for the peer
+    - discourage: there is only a gossip key, or the Autocrypt key is
+      stale, its header is more than 35 days older than the last message
+    - available: otherwise
+
+    :param columns: peers state
+    :type columns: PeerColumns
+    :return: recommendation codes, indexes in RECOMMENDATIONS
+    :rtype: array
+    """
+    fresh = map(operator.le,
+                map(operator.sub, columns.lastseen,
+                    repeat(AC_STALE_SECONDS)),
+                columns.actimestamp)
+    # NOTE: has_key + has_key * has_ackey * fresh gives 0 for disable,
+    # 1 for discourage and 2 for available
+    return array('b', map(operator.add, columns.has_key,
+                          map(operator.mul, columns.has_ackey,
+                              map(operator.mul, columns.has_key, fresh))))
+
+
+def _final(codes, mutual, sender_mutual, reply_to_encrypted):
+    if reply_to_encrypted:
+        # NOTE: replies to encrypted messages are encrypted when there is
+        # a key
+        return array('b', [ENCRYPT_CODE if c else DISABLE_CODE
+                           for c in codes])
+    if not sender_mutual:
+        return codes
+    # NOTE: available becomes encrypt when the peer prefers encryption too
+    return array('b', map(operator.add, codes,
+                          map(operator.mul, mutual,
+                              map(operator.eq, codes,
+                                  repeat(AVAILABLE_CODE)))))
+
+
+def _sender_mutual(profile, sender):
+    account = profile[ACCOUNTS].get(sender) if sender is not None else None
+    return account is not None and account.get(PREFERENCRYPT) == MUTUAL
+
+
+def recommend(profile, sender, recipients, reply_to_encrypted=False,
+              columns=None):
+    """Recommendation for a message to some recipients.
+
+    The recommendation for the message is the worst of the recipients
+    ones, so that it is encrypt only when it is encrypt for all of them.
+
+    :param sender: address of the account sending the message
+    :type sender: str
+    :param recipients: addresses of the recipients
+    :type recipients: list
+    :param reply_to_encrypted: whether the message is a reply to an
+        encrypted message
+    :type reply_to_encrypted: bool
+    :param columns: peers state, built for the recipients from the
+        profile if None
+    :type columns: PeerColumns
+    :return: recommendation for the message and for each recipient
+    :rtype: str, dict
+    """
+    # NOTE: a recipient repeated is counted once, so that it does not
+    # stand for an unknown one
+    recipients = list(OrderedDict.fromkeys(recipients))
+    if columns is None:
+        columns = PeerColumns(profile, recipients)
+    known = [columns.index[r] for r in recipients if r in columns.index]
+    subset = columns.take(known)
+    codes = _final(preliminary(subset), subset.mutual,
+                   _sender_mutual(profile, sender), reply_to_encrypted)
+    per_recipient = dict((r, RECOMMENDATIONS[DISABLE_CODE])
+                         for r in recipients)
+    per_recipient.update(zip(subset.addrs,
+                             [RECOMMENDATIONS[c] for c in codes]))
+    if not recipients:
+        return RECOMMENDATIONS[DISABLE_CODE], per_recipient
+    worst = DISABLE_CODE if len(known) < len(recipients) \
+        else min(codes)
+    return RECOMMENDATIONS[worst], per_recipient
+
+
+def recommend_all(profile, sender=None, reply_to_encrypted=False,
+                  columns=None):
+    """Recommendation for a message to each peer alone.
+
+    :param sender: address of the account sending the message, when None
+        the recommendations are never encrypt
+    :type sender: str
+    :return: recommendation by peer address
+    :rtype: dict
+    """
+    columns = columns if columns is not None else PeerColumns(profile)
+    codes = _final(preliminary(columns), columns.mutual,
+                   _sender_mutual(profile, sender), reply_to_encrypted)
+    return dict(zip(columns.addrs, map(RECOMMENDATIONS.__getitem__, codes)))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Compact account and peer records.
+
+Records have a fixed set of fields stored in ``__slots__``, instead of a
+dict per record:
+
+- keys are stored as raw bytes, not base 64 text, or as a memoryview of
+  a memory-mapped profile, that is only read when the key is used
+- timestamps are stored as integers
+- preferences are interned, so that all the records share the same
+  strings
+
+Records are read only mappings, so that ``profile[PEERS][addr][PUBKEY]``
+keeps returning the keydata (base 64 encoded key) and code that expects
+dicts keeps working. They are replaced, not modified.
+
+Example::
+
+    peer = Peer({PUBKEY: keydata, PREFERENCRYPT: MUTUAL})
+    peer[PUBKEY] == keydata
+    peer.keybytes(PUBKEY)
+    json.dumps(peer, default=json_default)
+
+"""
+
+import sys
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from collections.abc import Mapping
+
+from .constants import (ACCOUNTS, ACTIMESTAMP, GOSSIPKEY, GOSSIPTS,
+                        LASTSEEN, PEERS, PREFERENCRYPT, PUBKEY, SECKEY)
+
+__all__ = ['Account', 'Peer', 'json_default', 'to_record']
+
+KEYBYTES_TYPES = (bytes, memoryview)
+
+
+def _keydata2bytes(keydata):
+    if keydata is None or isinstance(keydata, KEYBYTES_TYPES):
+        return keydata
+    try:
+        kbytes = b64decode(keydata)
+    except (BinasciiError, ValueError):
+        kbytes = None
+    # NOTE: keydata that would not be written back the same, e.g. with
+    # line breaks or not base 64 characters, is kept as it is
+    if kbytes is None or b64encode(kbytes).decode('ascii') != keydata:
+        return keydata
+    return kbytes
+
+
+def _bytes2keydata(kbytes):
+    if isinstance(kbytes, KEYBYTES_TYPES):
+        return b64encode(kbytes).decode('ascii')
+    return kbytes
+
+
+def _timestamp(value):
+    return None if value is None else int(value)
+
+
+def _preference(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Record(Mapping):
+    """Base of the records, with the fields of the subclass."""
+
+    __slots__ = ('_extra',)
+    _fields = ()
+    _keyfields = ()
+    _timestamps = ()
+
+    def __init__(self, record=None, **fields):
+        record = dict(record or {}, **fields)
+        for name in self._fields:
+            value = record.pop(name, None)
+            if name in self._keyfields:
+                value = _keydata2bytes(value)
+            elif name in self._timestamps:
+                value = _timestamp(value)
+            elif name == PREFERENCRYPT:
+                value = _preference(value)
+            object.__setattr__(self, name, value)
+        # NOTE: fields not known, e.g. from newer versions, are kept so
+        # that they are written back
+        object.__setattr__(self, '_extra', record or None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Records are replaced, not modified.')
+
+    def __getitem__(self, name):
+        if name in self._fields:
+            value = getattr(self, name)
+            if name in self._keyfields:
+                return _bytes2keydata(value)
+            return value
+        if self._extra is not None:
+            return self._extra[name]
+        raise KeyError(name)
+
+    def __iter__(self):
+        yield from self._fields
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._fields) + len(self._extra or ())
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.to_dict())
+
+    def __reduce__(self):
+        return type(self), (self.to_dict(),)
+
+    def keybytes(self, name):
+        """Key of a field as raw bytes, without base 64 decoding it again.
+
+        :param name: key field, e.g. PUBKEY
+        :type name: str
+        :rtype: bytes
+        """
+        value = getattr(self, name)
+        if isinstance(value, str):
+            return b64decode(value.encode('ascii'))
+        if isinstance(value, memoryview):
+            return value.tobytes()
+        return value
+
+    def to_dict(self, keyref=_bytes2keydata):
+        """Record as a dict, as it is written in the profile.
+
+        :param keyref: function returning what is written for the key
+            bytes, the keydata by default
+        :type keyref: function
+        :rtype: dict
+        """
+        record = dict((name, getattr(self, name)) for name in self._fields)
+        for name in self._keyfields:
+            if isinstance(record[name], KEYBYTES_TYPES):
+                record[name] = keyref(record[name])
+        record.update(self._extra or ())
+        return record
+
+
+class Account(_Record):
+    """Account record."""
+
+    __slots__ = (SECKEY, PUBKEY, PREFERENCRYPT)
+    _fields = __slots__
+    _keyfields = (SECKEY, PUBKEY)
+
+
+class Peer(_Record):
+    """Peer record."""
+
+    __slots__ = (PUBKEY, PREFERENCRYPT, LASTSEEN, ACTIMESTAMP, GOSSIPKEY,
+                 GOSSIPTS)
+    _fields = __slots__
+    _keyfields = (PUBKEY, GOSSIPKEY)
+    _timestamps = (LASTSEEN, ACTIMESTAMP, GOSSIPTS)
+
+
+RECORD_TYPES = {ACCOUNTS: Account, PEERS: Peer}
+
+
+def to_record(section, record):
+    """Record of a section from a dict, records are returned as they are.
+
+    :param section: ACCOUNTS or PEERS
+    :type section: str
+    :param record: record
+    :type record: dict
+    :rtype: Account or Peer
+    """
+    cls = RECORD_TYPES[section]
+    if isinstance(record, cls):
+        return record
+    return cls(record)
+
+
+def json_default(obj):
+    """``default`` argument for json.dump to write records as objects."""
+    if isinstance(obj, _Record):
+        return obj.to_dict()
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        type(obj).__name__))
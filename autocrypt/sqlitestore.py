@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""SQLite backend for the profile.
+
+Accounts and peers are stored one row per address, so that adding or
+updating a record does not rewrite the whole profile.
+The key handles index is stored in its own table, indexed by key handle
+and address.
+"""
+import json
+import logging
+import os.path
+import sqlite3
+
+from .constants import ACCOUNTS, KEYHANDLES, PEERS
+from .crypto import _keydata_handles, _record_keydatas
+from .records import json_default, to_record
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SQLITE_EXTS', 'is_sqlite', 'connect', 'close', 'load', 'save',
+           'store_records']
+
+SQLITE_EXTS = ('.db', '.sqlite', '.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    addr TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS peers (
+    addr TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS keyhandles (
+    section TEXT NOT NULL,
+    handle TEXT NOT NULL,
+    addr TEXT NOT NULL,
+    PRIMARY KEY (section, handle)
+);
+CREATE INDEX IF NOT EXISTS keyhandles_addr ON keyhandles (section, addr);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# NOTE: profile items that are not stored in the meta table
+NOT_META = ['path', ACCOUNTS, PEERS, KEYHANDLES]
+
+_connections = {}
+
+
+def is_sqlite(path):
+    return path.endswith(SQLITE_EXTS)
+
+
+def connect(path):
+    """Return the (cached) connection to the database at path."""
+    conn = _connections.get(path)
+    if conn is None:
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.executescript(SCHEMA)
+        _connections[path] = conn
+    return conn
+
+
+def close(path):
+    conn = _connections.pop(path, None)
+    if conn is not None:
+        conn.close()
+
+
+def load(path):
+    conn = connect(path)
+    profile = {'path': path, ACCOUNTS: {}, PEERS: {},
+               KEYHANDLES: {ACCOUNTS: {}, PEERS: {}}}
+    for section in [ACCOUNTS, PEERS]:
+        for addr, record in conn.execute(
+                'SELECT addr, record FROM %s' % section):
+            profile[section][addr] = to_record(section,
+                                               json.loads(record))
+    for section, handle, addr in conn.execute(
+            'SELECT section, handle, addr FROM keyhandles'):
+        profile[KEYHANDLES][section][handle] = addr
+    for name, value in conn.execute('SELECT name, value FROM meta'):
+        profile[name] = json.loads(value)
+    logger.debug('Loaded profile from %s', path)
+    return profile
+
+
+def _upsert(conn, profile, section, addr):
+    record = profile[section][addr]
+    conn.execute('INSERT OR REPLACE INTO %s (addr, record) VALUES (?, ?)'
+                 % section, (addr, json.dumps(record, default=json_default)))
+    conn.execute('DELETE FROM keyhandles WHERE section = ? AND addr = ?',
+                 (section, addr))
+    index = profile[KEYHANDLES][section]
+    handles = [h for keydata in _record_keydatas(section, record)
+               for h in _keydata_handles(keydata) if index.get(h) == addr]
+    conn.executemany('INSERT OR REPLACE INTO keyhandles '
+                     '(section, handle, addr) VALUES (?, ?, ?)',
+                     [(section, h, addr) for h in handles])
+
+
+def _delete(conn, section, addr):
+    conn.execute('DELETE FROM %s WHERE addr = ?' % section, (addr,))
+    conn.execute('DELETE FROM keyhandles WHERE section = ? AND addr = ?',
+                 (section, addr))
+
+
+def store_records(profile, keys):
+    """Insert, update or delete account or peer records.
+
+    :param keys: records to store, in the form [(section, addr),], the
+        records not in the profile are deleted
+    :type keys: list
+    """
+    conn = connect(profile['path'])
+    with conn:
+        for section, addr in keys:
+            if addr in profile[section]:
+                _upsert(conn, profile, section, addr)
+            else:
+                _delete(conn, section, addr)
+    logger.debug('Stored %s records in %s', len(keys), profile['path'])
+
+
+def save(profile):
+    """Write the whole profile, replacing what is in the database."""
+    conn = connect(profile['path'])
+    with conn:
+        for section in [ACCOUNTS, PEERS]:
+            conn.execute('DELETE FROM %s' % section)
+            conn.executemany(
+                'INSERT INTO %s (addr, record) VALUES (?, ?)' % section,
+                [(addr, json.dumps(record, default=json_default))
+                 for addr, record in profile[section].items()])
+        conn.execute('DELETE FROM keyhandles')
+        conn.executemany(
+            'INSERT INTO keyhandles (section, handle, addr) VALUES (?, ?, ?)',
+            [(section, handle, addr)
+             for section in [ACCOUNTS, PEERS]
+             for handle, addr in profile[KEYHANDLES][section].items()])
+        conn.execute('DELETE FROM meta')
+        conn.executemany(
+            'INSERT INTO meta (name, value) VALUES (?, ?)',
+            [(name, json.dumps(value)) for name, value in profile.items()
+             if name not in NOT_META])
+    logger.debug('Wrote profile in %s', profile['path'])
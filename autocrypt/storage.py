@@ -8,85 +8,549 @@ import json
 import logging
 import os
 import os.path
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from .conflog import LOGGING
+from .cache import ac_header_cache, gossip_header_cache
 from .constants import (ACCOUNTS, ACTIMESTAMP, GOSSIPKEY, GOSSIPTS,
-                        LASTSEEN, NOPREFERENCE, PEERS,
-                        PREFERENCRYPT, PROFILE_PATH, PUBKEY, SECKEY)
-from .crypto import _key2keydatas, gen_key
+                        KEY_ALG, KEYHANDLES, LASTSEEN, NOPREFERENCE,
+                        PEERS, PE_HEADER_TYPES, PREFERENCRYPT, PROFILE_PATH,
+                        PUBKEY, SECKEY, VERSION)
+from .crypto import (_index_keydata, _index_profile, _key2keydatas,
+                     _uncache_keydata, _unindex_keydata, gen_key)
+from . import metrics, peerindex, sqlitestore
+from .records import json_default, to_record
+from .journal import DEL, PUT, get_journal, close_journal, \
+    journal_in_use, journal_paths, open_journal, replay
+from .keystore import close_keystore, get_keystore, keystore_path, \
+    open_keystore
+from .utils import file_lock
 
-logging.config.dictConfig(LOGGING)
 logger = logging.getLogger(__name__)
 
+# NOTE: per profile path, transaction being run and lock
+_transactions = {}
+_locks = {}
+# NOTE: JSON profile paths read or written by this process
+_synced = set()
+# NOTE: the version is the first member written in a JSON profile
+VERSION_RE = re.compile(r'\{\s*"%s":\s*(\d+)' % VERSION)
 
-def save(datadict):
+
+class StaleProfileError(Exception):
+    """The profile has been written by another writer since it was loaded.
+
+    Raised when saving the whole profile, that can not be merged, the
+    profile has to be loaded again and updated.
+    """
+
+
+def _write_json(datadict):
     jpath = datadict['path']
     if not os.path.exists(os.path.dirname(jpath)):
-        os.makedirs(jpath)
-    with open(jpath, 'w') as fp:
-        json.dump(datadict, fp, indent=2)
+        os.makedirs(os.path.dirname(jpath))
+    # NOTE: write to a temporary file and rename it, so that the profile
+    # is never left half written
+    tmppath = jpath + '.tmp'
+    keystore = get_keystore(jpath)
+    live = set()
+    default = json_default if keystore is None \
+        else keystore.json_default(live)
+    # NOTE: the version first, so that it is read without the whole file
+    data = {VERSION: datadict.get(VERSION, 0)}
+    data.update(datadict)
+    with open(tmppath, 'w') as fp:
+        json.dump(data, fp, indent=2, default=default)
+        fp.flush()
+        os.fsync(fp.fileno())
+    if keystore is not None:
+        # NOTE: the keys are written before the profile referencing them
+        keystore.flush()
+    os.replace(tmppath, jpath)
+    if keystore is not None:
+        keystore.collect(live)
     logger.debug('Wrote profile in %s', jpath)
 
 
+def _file_version(path):
+    """Version of the JSON profile written at path."""
+    with open(path) as fp:
+        match = VERSION_RE.match(fp.read(64))
+        if match is not None:
+            return int(match.group(1))
+        # NOTE: profiles written before the version existed
+        fp.seek(0)
+        return json.load(fp).get(VERSION, 0)
+
+
+def _read_json(jpath):
+    keystore = get_keystore(jpath)
+    if keystore is not None:
+        # NOTE: keys added by other processes are referenced
+        keystore.refresh()
+    with open(jpath) as fp:
+        profile = json.load(fp)
+    _synced.add(jpath)
+    # NOTE: a profile that has been copied or moved is written where
+    # it is loaded from
+    profile['path'] = jpath
+    _to_records(profile)
+    # NOTE: profiles written before the key handles index existed
+    # are indexed once here, the index is stored on the next save.
+    if KEYHANDLES not in profile:
+        _index_profile(profile)
+    return profile
+
+
+def _is_stale(profile):
+    """Whether the file has been written since the profile was synced."""
+    path = profile['path']
+    if path not in _synced:
+        # NOTE: a new profile, or one moved to this path
+        return False
+    try:
+        version = _file_version(path)
+    except FileNotFoundError:
+        return False
+    return version != profile.get(VERSION, 0)
+
+
+def _merge_json(profile, keys):
+    """Replace the profile with the file, with the records in keys on top."""
+    merged = _read_json(profile['path'])
+    for section, addr in keys:
+        old = merged[section].get(addr)
+        if old is not None:
+            _unindex_keydata(merged, section, addr, old)
+            del merged[section][addr]
+        record = profile[section].get(addr)
+        if record is not None:
+            merged[section][addr] = record
+            _index_keydata(merged, section, addr, record)
+    _restore_profile(profile, merged)
+    logger.debug('Merged %s records in %s, version %s', len(keys),
+                 profile['path'], profile.get(VERSION, 0))
+
+
+def _fold_journals(path):
+    """Fold in the file the journals of a process that has exited.
+
+    A journal is folded into the profile by the process appending to it,
+    the journals left by a process that exited without compacting them
+    are replayed on the file and removed, so that they do not revert
+    later writes when the profile is loaded.
+    Called with the file locked.
+    """
+    jpaths = [jpath for jpath in journal_paths(path)
+              if os.path.isfile(jpath)]
+    if not jpaths or journal_in_use(path):
+        return
+    if os.path.isfile(path):
+        profile = _read_json(path)
+    else:
+        profile = init_profile(path)
+    _replay_journal(profile)
+    profile[VERSION] = profile.get(VERSION, 0) + 1
+    _write_json(profile)
+    for jpath in jpaths:
+        os.remove(jpath)
+    logger.info('Folded the journals left in %s', path)
+
+
+def _sync_json(profile, keys=None):
+    """Write a JSON profile, merging it with the file if it is stale.
+
+    The file is locked while it is checked and written, a profile loaded
+    before the last write of the file is merged with it, keeping the
+    records in keys from the profile and the others from the file.
+
+    :param keys: records updated or deleted since the profile was last
+        written, in the form [(section, addr),], None when the whole
+        profile is written
+    :type keys: list
+    :return: whether the profile was merged with the file
+    :rtype: bool
+    :raises StaleProfileError: when the whole profile is written and it
+        is stale
+    """
+    path = profile['path']
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with file_lock(path):
+        _fold_journals(path)
+        stale = _is_stale(profile)
+        if stale:
+            if keys is None:
+                raise StaleProfileError(
+                    '{} has been written since it was loaded.'.format(path))
+            _merge_json(profile, keys)
+        profile[VERSION] = profile.get(VERSION, 0) + 1
+        _write_json(profile)
+        _synced.add(path)
+    return stale
+
+
+@metrics.timed('save')
+def save(datadict):
+    jpath = datadict['path']
+    state = _transactions.get(jpath)
+    if state is not None:
+        state['save'] = True
+    elif sqlitestore.is_sqlite(jpath):
+        sqlitestore.save(datadict)
+    elif peerindex.is_peerindex(jpath):
+        peerindex.save(datadict)
+    elif get_journal(jpath) is not None:
+        compact(datadict)
+    else:
+        _sync_json(datadict)
+
+
+def _copy_profile(profile):
+    # NOTE: records are replaced, not modified, by this module, so that
+    # copying the dicts that contain them is enough
+    snapshot = dict(profile)
+    for section in [ACCOUNTS, PEERS]:
+        snapshot[section] = profile[section].copy()
+    snapshot[KEYHANDLES] = dict((section, index.copy()) for section, index
+                                in profile[KEYHANDLES].items())
+    return snapshot
+
+
+def _write_snapshot(profile, snapshot, keys, sealed_path):
+    # NOTE: the journaled records are merged with the records written by
+    # other processes meanwhile
+    if not _sync_json(snapshot, keys):
+        # NOTE: otherwise the profile is merged again on the next one
+        profile[VERSION] = snapshot[VERSION]
+    os.remove(sealed_path)
+    logger.debug('Compacted journal into %s', snapshot['path'])
+
+
+def compact(profile, background=False):
+    """Fold the journal of a profile into the profile file.
+
+    :param background: write the profile in a thread, while new records
+        are appended to a new journal
+    :type background: bool
+    """
+    journal = get_journal(profile['path'])
+    if journal is None:
+        save(profile)
+        return
+    with journal.lock:
+        sealed_path, keys = journal.seal()
+        snapshot = _copy_profile(profile)
+    args = (profile, snapshot, keys, sealed_path)
+    if background:
+        journal.compaction = threading.Thread(target=_write_snapshot,
+                                              args=args)
+        journal.compaction.start()
+    else:
+        _write_snapshot(*args)
+
+
+def close(profile):
+    """Release the resources held for the profile by its backend."""
+    close_journal(profile['path'])
+    close_keystore(profile['path'])
+    sqlitestore.close(profile['path'])
+
+
+def _lock(profile):
+    """Lock serializing the updates of a profile between threads."""
+    return _locks.setdefault(profile['path'], threading.RLock())
+
+
+@metrics.timed('write_records')
+def _write_records(profile, keys, sync=False):
+    """Write account or peer records that have been updated or deleted.
+
+    The SQLite backend upserts or deletes only those records and the
+    journal mode appends them to the journal. The JSON backend has to
+    rewrite the whole profile, merging those records with the profile
+    written by other processes meanwhile.
+
+    :param keys: records to write, in the form [(section, addr),]
+    :type keys: list
+    :param sync: sync the journal to disk after the records
+    :type sync: bool
+    """
+    path = profile['path']
+    journal = get_journal(path)
+    if sqlitestore.is_sqlite(path):
+        sqlitestore.store_records(profile, keys)
+    elif peerindex.is_peerindex(path):
+        # NOTE: the whole index is written again, updates should be
+        # grouped in a transaction
+        peerindex.save(profile)
+    elif journal is not None:
+        compact_due = False
+        for section, addr in keys:
+            record = profile[section].get(addr)
+            if record is None:
+                compact_due = journal.append(DEL, section, addr)
+            else:
+                compact_due = journal.append(PUT, section, addr, record)
+        if sync:
+            journal.sync()
+        if compact_due:
+            compact(profile, background=True)
+    else:
+        _sync_json(profile, keys)
+
+
+def _store(profile, section, addr):
+    """Write an account or peer record, or defer it to the transaction."""
+    state = _transactions.get(profile['path'])
+    if state is not None:
+        state['keys'][(section, addr)] = None
+    else:
+        _write_records(profile, [(section, addr)])
+
+
+def _restore_profile(profile, snapshot):
+    for section in [ACCOUNTS, PEERS]:
+        profile[section].clear()
+        profile[section].update(snapshot[section])
+        profile[KEYHANDLES][section].clear()
+        profile[KEYHANDLES][section].update(snapshot[KEYHANDLES][section])
+    for name in list(profile):
+        if name not in snapshot:
+            del profile[name]
+    for name, value in snapshot.items():
+        if name not in [ACCOUNTS, PEERS, KEYHANDLES]:
+            profile[name] = value
+
+
+@contextmanager
+def transaction(profile):
+    """Group the writes of the profile updates done inside in one write.
+
+    The records added, updated or deleted inside are written once on
+    exit, and a save inside is deferred to the exit too.
+    On exception, the profile is restored to its state on entry and
+    nothing is written.
+    Nested transactions are part of the outermost one.
+
+    Example::
+
+        with transaction(profile):
+            new_peer(profile, addr1, keydata1)
+            new_peer(profile, addr2, keydata2)
+
+    """
+    path = profile['path']
+    with _lock(profile):
+        if path in _transactions:
+            yield profile
+            return
+        state = _transactions[path] = {
+            'keys': OrderedDict(), 'save': False,
+            'snapshot': _copy_profile(profile)}
+        try:
+            yield profile
+        except BaseException:
+            del _transactions[path]
+            _restore_profile(profile, state['snapshot'])
+            logger.debug('Rolled back transaction on %s', path)
+            raise
+        del _transactions[path]
+        if state['save']:
+            save(profile)
+        elif state['keys']:
+            _write_records(profile, list(state['keys']), sync=True)
+        logger.debug('Committed transaction on %s, %s records', path,
+                     len(state['keys']))
+
+
 def init_profile(path=PROFILE_PATH):
-    return {'path': path, ACCOUNTS: {}, PEERS: {}}
+    return {'path': path, ACCOUNTS: {}, PEERS: {},
+            KEYHANDLES: {ACCOUNTS: {}, PEERS: {}}}
+
 
+def load(jpath=PROFILE_PATH, journal=False, keystore=False):
+    """Load a profile.
 
-def load(jpath=PROFILE_PATH):
+    A peer index profile (.idx) is written whole on each record update,
+    like new_peer, outside of a transaction.
+
+    :param jpath: path to the profile
+    :type jpath: str
+    :param journal: append record updates to a journal instead of
+        rewriting the profile (JSON backend only)
+    :type journal: bool
+    :param keystore: store the keys in a key store and reference them in
+        the profile, profiles that have a key store always use it (JSON
+        backend only)
+    :type keystore: bool
+    :return: the profile
+    :rtype: dict
+    """
+    if sqlitestore.is_sqlite(jpath):
+        return sqlitestore.load(jpath)
+    if peerindex.is_peerindex(jpath):
+        if not os.path.isfile(jpath):
+            return init_profile(jpath)
+        return peerindex.load(jpath)
+    if keystore or os.path.isfile(keystore_path(jpath)):
+        open_keystore(jpath)
+    if journal or any(os.path.isfile(p) for p in journal_paths(jpath)):
+        # NOTE: the journal is opened with the file locked, so that other
+        # processes do not fold it
+        with file_lock(jpath):
+            _fold_journals(jpath)
+            if journal:
+                open_journal(jpath)
     if not os.path.isfile(jpath):
-        return init_profile()
-    with open(jpath) as fp:
-        return json.load(fp)
+        profile = init_profile(jpath)
+        # NOTE: a profile created meanwhile by another process is merged
+        _synced.add(jpath)
+    else:
+        profile = _read_json(jpath)
+    # NOTE: the journal of this process or of another one running
+    _replay_journal(profile)
     logger.debug('Loaded profile from %s', jpath)
+    return profile
+
+
+def _to_record(profile, section, record):
+    keystore = get_keystore(profile['path'])
+    if keystore is not None:
+        record = keystore.resolve(section, record)
+    return to_record(section, record)
+
+
+def _to_records(profile):
+    for section in [ACCOUNTS, PEERS]:
+        records = profile[section]
+        for addr, record in records.items():
+            records[addr] = _to_record(profile, section, record)
 
 
-def new_account(profile, addr, sk=None, pk=None, pe=None):
+def _replay_journal(profile):
+    for op, section, addr, record in replay(profile['path']):
+        if op == PUT:
+            _replace_record(profile, section, addr, record)
+        elif addr in profile[section]:
+            _delete_record(profile, section, addr)
+
+
+def migrate(jpath, newpath):
+    """Copy the profile at jpath to newpath, converting the backend.
+
+    :param jpath: path to the current profile, e.g. ~/.pyac/profile.json
+    :type jpath: str
+    :param newpath: path to the new profile, e.g. ~/.pyac/profile.sqlite
+    :type newpath: str
+    :return: the profile stored at newpath
+    :rtype: dict
+    """
+    profile = load(jpath)
+    profile['path'] = newpath
+    save(profile)
+    logger.info('Migrated profile from %s to %s', jpath, newpath)
+    return profile
+
+
+def _uncache_headers(section, addr, old, record=None):
+    """Drop the cached headers of a record deleted or changed."""
+    if record is not None and \
+            old.keybytes(PUBKEY) == record.keybytes(PUBKEY) and \
+            old.get(PREFERENCRYPT) == record.get(PREFERENCRYPT):
+        return
+    if section == PEERS:
+        gossip_header_cache.invalidate(addr)
+        return
+    for pe in PE_HEADER_TYPES:
+        ac_header_cache.invalidate((addr, pe))
+
+
+def _replace_record(profile, section, addr, record):
+    record = _to_record(profile, section, record)
+    old = profile[section].get(addr)
+    if old is not None:
+        _unindex_keydata(profile, section, addr, old)
+        _uncache_keydata(section, old, keep=record)
+        _uncache_headers(section, addr, old, record)
+    profile[section][addr] = record
+    _index_keydata(profile, section, addr, record)
+
+
+def _delete_record(profile, section, addr):
+    old = profile[section][addr]
+    _unindex_keydata(profile, section, addr, old)
+    _uncache_keydata(section, old)
+    _uncache_headers(section, addr, old)
+    del(profile[section][addr])
+
+
+def new_account(profile, addr, sk=None, pk=None, pe=None, pool=None,
+                alg=None):
     if sk is None:
-        key = gen_key(addr)
+        # NOTE: taking the key from a KeyPool avoids waiting for the key
+        # generation, the key algorithm is the one of the pool
+        if pool is not None:
+            if alg is not None and alg != pool.alg:
+                raise ValueError('The key pool has {} keys, not {}.'.format(
+                    pool.alg, alg))
+            key = pool.get(addr)
+        else:
+            key = gen_key(addr, alg or KEY_ALG)
         sk, pk = _key2keydatas(key)
     else:
         assert pk is not None
-    profile[ACCOUNTS][addr] = {
-        SECKEY: sk,
-        PUBKEY: pk,
-        PREFERENCRYPT: pe
-    }
-    save(profile)
+    with _lock(profile):
+        _replace_record(profile, ACCOUNTS, addr, {
+            SECKEY: sk,
+            PUBKEY: pk,
+            PREFERENCRYPT: pe
+        })
+        _store(profile, ACCOUNTS, addr)
 
 
 def del_account(profile, addr):
-    del(profile[ACCOUNTS][addr])
+    with _lock(profile):
+        _delete_record(profile, ACCOUNTS, addr)
+        _store(profile, ACCOUNTS, addr)
 
 
 def new_peer(profile, addr, pk=None, pe=NOPREFERENCE, ls=None, ats=None,
              gpk=None, gts=None):
-    profile[PEERS][addr] = {
-        PUBKEY: pk,
-        PREFERENCRYPT: pe,
-        LASTSEEN: ls,
-        ACTIMESTAMP: ats,
-        GOSSIPKEY: gpk,
-        GOSSIPTS: gts
-    }
-    save(profile)
+    with _lock(profile):
+        _replace_record(profile, PEERS, addr, {
+            PUBKEY: pk,
+            PREFERENCRYPT: pe,
+            LASTSEEN: ls,
+            ACTIMESTAMP: ats,
+            GOSSIPKEY: gpk,
+            GOSSIPTS: gts
+        })
+        _store(profile, PEERS, addr)
 
 
 def del_peer(profile, addr):
-    del(profile[PEERS][addr])
+    with _lock(profile):
+        _delete_record(profile, PEERS, addr)
+        _store(profile, PEERS, addr)
 
 
 def repr_account(profile, addr):
     s = "\n{}\n--------------------\n".format(addr)
-    s += "\n".join([": ".join([k, str(v)])
-                    for k, v in profile[ACCOUNTS][addr].items()
+    record = profile[ACCOUNTS][addr]
+    # NOTE: the keys are not read
+    s += "\n".join([": ".join([k, str(record[k])]) for k in record
                     if k not in [PUBKEY, SECKEY]])
     return s
 
 
 def repr_peer(profile, addr):
     s = "\n{}\n--------------------\n".format(addr)
-    s += "\n".join([": ".join([k, str(v)])
-                    for k, v in profile[PEERS][addr].items()
+    record = profile[PEERS][addr]
+    s += "\n".join([": ".join([k, str(record[k])]) for k in record
                     if k not in [PUBKEY, GOSSIPKEY]])
     return s
 
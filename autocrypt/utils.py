@@ -1,6 +1,11 @@
 """For compatibility with previous py-autocrypt code."""
 
+import fcntl
+import importlib
 from base64 import b64encode
+from contextlib import contextmanager
+
+from .constants import LOCK_EXT
 
 
 def b64encode_u(x):
@@ -8,3 +13,53 @@ def b64encode_u(x):
     if isinstance(res, bytes):
         res = res.decode("ascii")
     return res
+
+
+class LazyModule(object):
+    """Module imported the first time one of its attributes is used.
+
+    Heavy dependencies, like pgpy, are only imported when they are needed,
+    so that commands not using them start faster.
+
+    :param name: absolute name of the module
+    :type name: str
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        # NOTE: cache it, so that next accesses are plain lookups
+        self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+        self.__dict__[attr] = value
+
+    def __repr__(self):
+        return '<LazyModule {!r}>'.format(self.__dict__['_name'])
+
+
+@contextmanager
+def file_lock(path):
+    """Lock serializing the writes of a file between processes.
+
+    :param path: path to the file, the lock is held on path + LOCK_EXT
+    :type path: str
+    """
+    with open(path + LOCK_EXT, 'a') as fp:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
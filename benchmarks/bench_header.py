@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Compare the throughput of the Autocrypt header value parsers.
+
+The previous parser, splitting the value with a regular expression and
+every attribute with str.split, and then removing the keydata whitespace
+as its callers did, is timed against parse_header_value, with an unfolded
+header value and with one folded as in an Email.
+
+Run from the repository root::
+
+    python benchmarks/bench_header.py -n 20000
+
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from autocrypt.constants import ADDR, KEYDATA, PE  # noqa: E402
+from autocrypt.message import parse_header_value, wrap  # noqa: E402
+from autocrypt.tests_data import BOB, BOB_KEYDATA  # noqa: E402
+
+
+def split_header_value(headervaluestr):
+    """parse_header_value before the tokenizer, and the keydata unfolding."""
+    header_kv_list = re.split('; |;\n ', headervaluestr)
+    headervaluedict = dict()
+    for kv in header_kv_list:
+        if kv.startswith('addr='):
+            headervaluedict[ADDR] = kv.split('addr=')[1].strip()
+        elif kv.startswith('prefer-encrypt='):
+            headervaluedict[PE] = kv.split('prefer-encrypt=')[1].strip()
+        elif kv.startswith('keydata='):
+            headervaluedict[KEYDATA] = kv.split('keydata=')[1].strip()
+    headervaluedict[KEYDATA] = ''.join(headervaluedict[KEYDATA].split())
+    return headervaluedict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, default=20000,
+                        help='Header values parsed in each measure.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Measures of each parser.')
+    args = parser.parse_args()
+    keydata = ''.join(BOB_KEYDATA.split())
+    values = [
+        ('unfolded', 'addr={}; prefer-encrypt=mutual; keydata={}'.format(
+            BOB, keydata)),
+        ('folded', 'addr={}; prefer-encrypt=mutual;\n keydata={}'.format(
+            BOB, wrap(keydata, wrapstr='\n '))),
+    ]
+    print('{:<10} {:<10} {:>12} {:>12}'.format(
+        'value', 'parser', 'headers/s', 'MB/s'))
+    for name, value in values:
+        for pname, func in [('split', split_header_value),
+                            ('tokenize', parse_header_value)]:
+            seconds = min(timeit.repeat(lambda: func(value),
+                                        number=args.number,
+                                        repeat=args.repeat))
+            print('{:<10} {:<10} {:>12.0f} {:>12.1f}'.format(
+                name, pname, args.number / seconds,
+                args.number * len(value) / seconds / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
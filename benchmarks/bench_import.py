@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Measure the time to import the autocrypt modules in a new interpreter.
+
+Run from the repository root::
+
+    python benchmarks/bench_import.py -n 10
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['autocrypt.cli', 'autocrypt.crypto', 'autocrypt.message',
+           'autocrypt.storage']
+CODE = """import time
+start = time.perf_counter()
+import {}
+print(time.perf_counter() - start)
+"""
+
+
+def import_time(module):
+    out = subprocess.check_output([sys.executable, '-c', CODE.format(module)],
+                                  cwd=ROOT)
+    return float(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help='Interpreters started per module.')
+    parser.add_argument('-m', '--module', action='append',
+                        help='Module to import (default: {}).'.format(
+                            ', '.join(MODULES)))
+    args = parser.parse_args()
+    print('{:<20} {:>12} {:>12}'.format('module', 'median ms', 'min ms'))
+    for module in args.module or MODULES:
+        times = sorted(import_time(module) for _ in range(args.number))
+        print('{:<20} {:>12.2f} {:>12.2f}'.format(
+            module, times[len(times) // 2] * 1000, times[0] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Compare key generation, sign+encrypt and decrypt latency by key algorithm.
+
+Run from the repository root::
+
+    python benchmarks/bench_keyalg.py -n 10
+
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from autocrypt.constants import KEY_ALGS  # noqa: E402
+from autocrypt.crypto import decrypt, sign_encrypt  # noqa: E402
+from autocrypt.storage import init_profile, new_account  # noqa: E402
+
+ADDR = 'bench@autocrypt.example'
+DATA = 'x' * 4096
+
+
+def timeit(func, number):
+    times = []
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[0]
+
+
+def bench(alg, number):
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+
+    def keygen():
+        profile = init_profile(os.path.join(tmpdir, 'profile.json'))
+        new_account(profile, ADDR, alg=alg)
+        return profile
+
+    results['keygen'] = timeit(keygen, number)
+    profile = keygen()
+    results['sign+encrypt'] = timeit(
+        lambda: sign_encrypt(profile, DATA, ADDR, [ADDR]), number)
+    cmsg = str(sign_encrypt(profile, DATA, ADDR, [ADDR]))
+    results['decrypt'] = timeit(lambda: decrypt(profile, cmsg), number)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help='Repetitions of each operation.')
+    parser.add_argument('-a', '--alg', choices=KEY_ALGS, action='append',
+                        help='Key algorithm to benchmark (default: all).')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    print('{:<8} {:<14} {:>12} {:>12}'.format('alg', 'operation',
+                                              'median ms', 'min ms'))
+    for alg in args.alg or KEY_ALGS:
+        for op, (median, best) in bench(alg, args.number).items():
+            print('{:<8} {:<14} {:>12.2f} {:>12.2f}'.format(
+                alg, op, median * 1000, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
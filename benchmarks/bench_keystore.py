@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Compare the size and load time of profiles with and without key store.
+
+Run from the repository root::
+
+    python benchmarks/bench_keystore.py -n 10000
+
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from autocrypt import storage  # noqa: E402
+from autocrypt.constants import MUTUAL, PEERS  # noqa: E402
+from autocrypt.keystore import keystore_path  # noqa: E402
+from autocrypt.records import Peer  # noqa: E402
+
+
+def write_profile(path, number, keysize, keystore):
+    profile = storage.load(path, keystore=keystore)
+    for i in range(number):
+        # NOTE: the peers gossip key is usually their Autocrypt key
+        kbytes = os.urandom(keysize)
+        profile[PEERS]['p{}@autocrypt.example'.format(i)] = Peer(
+            pubkey=kbytes, preferencrypt=MUTUAL, lastseen=1510062985,
+            actimestamp=1510062985, gossipkey=kbytes,
+            gossiptimestamp=1510062985)
+    storage.save(profile)
+    storage.close(profile)
+
+
+def profile_size(path):
+    return sum(os.path.getsize(p) for p in [path, keystore_path(path)]
+               if os.path.exists(p))
+
+
+def load_time(path):
+    start = time.perf_counter()
+    profile = storage.load(path)
+    seconds = time.perf_counter() - start
+    storage.close(profile)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='Number of peers.')
+    parser.add_argument('-k', '--keysize', type=int, default=1200,
+                        help='Size in bytes of each peer key.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Loads of each profile.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{:<10} {:>12} {:>12} {:>12}'.format(
+            'profile', 'size MiB', 'median ms', 'min ms'))
+        for name, keystore in [('inline', False), ('keystore', True)]:
+            path = os.path.join(tmpdir, name, 'profile.json')
+            write_profile(path, args.number, args.keysize, keystore)
+            times = sorted(load_time(path) for _ in range(args.repeat))
+            print('{:<10} {:>12.1f} {:>12.2f} {:>12.2f}'.format(
+                name, profile_size(path) / 2 ** 20,
+                times[len(times) // 2] * 1000, times[0] * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Compare loading a JSON profile and a memory-mapped peer index.
+
+Each profile is loaded and one peer key is read, as a lookup for one
+message does.
+
+Run from the repository root::
+
+    python benchmarks/bench_peerindex.py -n 1000 -n 100000
+
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from autocrypt import storage  # noqa: E402
+from autocrypt.constants import MUTUAL, PEERS, PUBKEY  # noqa: E402
+from autocrypt.records import Peer  # noqa: E402
+
+
+def write_profile(path, number, keysize):
+    profile = storage.init_profile(path)
+    for i in range(number):
+        profile[PEERS]['p{}@autocrypt.example'.format(i)] = Peer(
+            pubkey=os.urandom(keysize), preferencrypt=MUTUAL,
+            lastseen=1510062985, actimestamp=1510062985)
+    storage.save(profile)
+
+
+def lookup_time(path, addr):
+    start = time.perf_counter()
+    profile = storage.load(path)
+    profile[PEERS][addr][PUBKEY]
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, action='append',
+                        help='Number of peers (default: 1000, 10000).')
+    parser.add_argument('-k', '--keysize', type=int, default=1200,
+                        help='Size in bytes of each peer key.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Loads of each profile.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{:<8} {:>8} {:>12} {:>12}'.format(
+            'profile', 'peers', 'median ms', 'min ms'))
+        for number in args.number or [1000, 10000]:
+            addr = 'p{}@autocrypt.example'.format(number // 2)
+            for ext in ['.json', '.idx']:
+                path = os.path.join(tmpdir, '{}{}'.format(number, ext))
+                write_profile(path, number, args.keysize)
+                times = sorted(lookup_time(path, addr)
+                               for _ in range(args.repeat))
+                print('{:<8} {:>8} {:>12.3f} {:>12.3f}'.format(
+                    ext, number, times[len(times) // 2] * 1000,
+                    times[0] * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
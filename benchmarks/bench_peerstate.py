@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Compare the profile writes of new_peer and update_peer on a gateway.
+
+Messages from known peers, repeating their Autocrypt header, are
+processed one by one, as a gateway does, storing the peer with new_peer,
+as it was done before, or updating it with update_peer.
+
+Run from the repository root::
+
+    python benchmarks/bench_peerstate.py -p 100 -m 1000
+
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from autocrypt import storage  # noqa: E402
+from autocrypt.constants import MUTUAL  # noqa: E402
+from autocrypt.crypto import _key2keydatas, _keydata2key  # noqa: E402
+from autocrypt.peerstate import update_peer  # noqa: E402
+
+KEYS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'keys.json')
+DATE = 1510062985
+
+
+def run(path, headers, update):
+    profile = storage.load(path)
+    writes = []
+    write_records = storage._write_records
+
+    def counting(profile, keys, sync=False):
+        writes.append(keys)
+        write_records(profile, keys, sync)
+
+    storage._write_records = counting
+    try:
+        start = time.perf_counter()
+        for i, (addr, keydata) in enumerate(headers):
+            if update:
+                update_peer(profile, addr, DATE + i, keydata, MUTUAL)
+            else:
+                storage.new_peer(profile, addr, keydata, MUTUAL)
+        seconds = time.perf_counter() - start
+    finally:
+        storage._write_records = write_records
+    return len(writes), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-p', '--peers', type=int, default=100,
+                        help='Number of peers, at most the number of keys.')
+    parser.add_argument('-m', '--messages', type=int, default=1000,
+                        help='Number of messages.')
+    args = parser.parse_args()
+    with open(KEYS_PATH) as fp:
+        keys = list(json.load(fp)['keys'].items())[:args.peers]
+    pubkeys = [(addr, _key2keydatas(_keydata2key(k))[1]) for addr, k in keys]
+    headers = [random.choice(pubkeys) for _ in range(args.messages)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{:<12} {:>8} {:>12}'.format('function', 'writes', 'ms'))
+        for name, update in [('new_peer', False), ('update_peer', True)]:
+            path = os.path.join(tmpdir, name, 'profile.json')
+            profile = storage.load(path)
+            with storage.transaction(profile):
+                for addr, keydata in pubkeys:
+                    update_peer(profile, addr, DATE, keydata, MUTUAL)
+            writes, seconds = run(path, headers, update)
+            print('{:<12} {:>8} {:>12.1f}'.format(
+                name, writes, seconds * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
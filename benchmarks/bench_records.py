@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Measure the memory used by peers stored as dicts and as records.
+
+Run from the repository root::
+
+    python benchmarks/bench_records.py -n 100000
+
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from autocrypt.constants import (ACTIMESTAMP, GOSSIPKEY, GOSSIPTS,  # noqa
+                                 LASTSEEN, MUTUAL, PREFERENCRYPT, PUBKEY)
+from autocrypt.records import Peer  # noqa: E402
+
+
+def peer_dicts(number, keysize):
+    # NOTE: every value is a new object, as when it is loaded from JSON
+    return [{PUBKEY: base64.b64encode(os.urandom(keysize)).decode('ascii'),
+             PREFERENCRYPT: ''.join(MUTUAL),
+             LASTSEEN: 1510062985 + i,
+             ACTIMESTAMP: 1510062985 + i,
+             GOSSIPKEY: None,
+             GOSSIPTS: None} for i in range(number)]
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    peers = build()
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peers, size, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='Number of peers.')
+    parser.add_argument('-k', '--keysize', type=int, default=1200,
+                        help='Size in bytes of each peer key.')
+    args = parser.parse_args()
+    dicts, dicts_size, _ = measure(
+        lambda: peer_dicts(args.number, args.keysize))
+    _, records_size, seconds = measure(
+        lambda: [Peer(record) for record in dicts])
+    print('{:<10} {:>14} {:>14}'.format('peers', 'bytes/peer', 'total MiB'))
+    for name, size in [('dict', dicts_size), ('record', records_size)]:
+        print('{:<10} {:>14.0f} {:>14.1f}'.format(
+            name, size / args.number, size / 2 ** 20))
+    print('saved {:.0%}, converted in {:.2f} ms'.format(
+        1 - records_size / dicts_size, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
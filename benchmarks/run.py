@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Time the main Autocrypt operations and compare them with a baseline.
+
+The keys are read from benchmarks/data/keys.json, generated once with
+``--gen-keys``, so that every run uses the same keys. The messages are
+timed with the keys of each algorithm, RSA-3072 being the default one.
+The results are written as JSON and compared with the baseline results,
+benchmarks/baseline.json, medians that are slower than the baseline by
+more than the threshold are reported as regressions and the exit status
+is 1. The baseline depends on the machine it was measured on, write a
+new one before comparing on another machine.
+
+Run from the repository root::
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py -o benchmarks/baseline.json  # new baseline
+    python benchmarks/run.py -k parse --sizes 100 1000
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+from importlib import metadata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from autocrypt import storage  # noqa: E402
+from autocrypt.constants import (KEY_ALG, KEY_ALG_25519,  # noqa: E402
+                                 KEY_ALG_RSA, MUTUAL, PEERS)
+from autocrypt.crypto import _key2keydatas, _keydata2key, gen_key  # noqa
+from autocrypt.message import (gen_ac_email, gen_ac_setup_email,  # noqa
+                               gen_ac_setup_passphrase, gen_gossip_email,
+                               gen_gossip_headervalues, parse_email,
+                               parse_header_value, unwrap, wrap)
+from autocrypt.records import Peer  # noqa: E402
+
+KEYS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'keys.json')
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+ALGS = [KEY_ALG_RSA, KEY_ALG_25519]
+SENDER = 'sender@autocrypt.example'
+RECIPIENTS = ['r{}@autocrypt.example'.format(i) for i in range(100)]
+RECIPIENT_COUNTS = [1, 10, 100]
+SIZES = [100, 1000, 10000, 100000]
+SUBJECT = 'Benchmark'
+BODY = 'Hi,\n\nthis is a benchmark message.\n' * 10
+
+
+def gen_keys(path=KEYS_PATH):
+    """Generate the keys of the sender and the recipients once.
+
+    For each algorithm, in the form {alg: {addr: seckeydata}}.
+    """
+    keys = {}
+    for alg in ALGS:
+        keys[alg] = dict((addr, _key2keydatas(gen_key(addr, alg))[0])
+                         for addr in [SENDER] + RECIPIENTS)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fp:
+        json.dump({'keys': keys}, fp, indent=2)
+
+
+def fixture_profile(path, keys):
+    """Profile with every address as account and as peer.
+
+    So that the messages generated for any recipient can be parsed.
+    """
+    profile = storage.load(path)
+    with storage.transaction(profile):
+        for addr, seckeydata in keys.items():
+            sk, pk = _key2keydatas(_keydata2key(seckeydata))
+            storage.new_account(profile, addr, sk, pk, MUTUAL)
+            storage.new_peer(profile, addr, pk, MUTUAL)
+    return profile
+
+
+def peers_profile(path, size, keys):
+    """Profile with size peers, using the fixture public keys."""
+    pubkeys = [_key2keydatas(_keydata2key(k))[1] for k in keys.values()]
+    profile = storage.init_profile(path)
+    for i in range(size):
+        profile[PEERS]['p{}@autocrypt.example'.format(i)] = Peer(
+            pubkey=pubkeys[i % len(pubkeys)], preferencrypt=MUTUAL,
+            lastseen=1510062985, actimestamp=1510062985)
+    storage.save(profile)
+    return profile
+
+
+def message_benchmarks(tmpdir, alg, keys):
+    """Benchmarks of the messages, with the keys of one algorithm."""
+    profile = fixture_profile(
+        os.path.join(tmpdir, 'profile-{}.json'.format(alg)), keys)
+    for count in RECIPIENT_COUNTS:
+        recipients = RECIPIENTS[:count]
+        yield ('gen_ac_email[{},{}]'.format(alg, count),
+               lambda r=recipients: gen_ac_email(profile, SENDER, r,
+                                                 SUBJECT, BODY, MUTUAL))
+        yield ('gen_gossip_email[{},{}]'.format(alg, count),
+               lambda r=recipients: gen_gossip_email(SENDER, r, profile,
+                                                     SUBJECT, BODY, MUTUAL))
+        yield ('gen_gossip_headervalues[{},{}]'.format(alg, count),
+               lambda r=recipients: gen_gossip_headervalues(r, profile))
+    passphrase = gen_ac_setup_passphrase()
+    messages = [
+        ('plain', 'From: {}\nTo: {}\nSubject: {}\n\n{}'.format(
+            SENDER, RECIPIENTS[0], SUBJECT, BODY), None),
+        ('ac', gen_ac_email(profile, SENDER, RECIPIENTS[:1], SUBJECT, BODY,
+                            MUTUAL).as_string(), None),
+        ('gossip', gen_gossip_email(SENDER, RECIPIENTS[:10], profile,
+                                    SUBJECT, BODY, MUTUAL).as_string(),
+         None),
+        ('setup', gen_ac_setup_email(SENDER, MUTUAL, profile,
+                                     passphrase=passphrase).as_string(),
+         passphrase),
+    ]
+    for kind, text, msg_passphrase in messages:
+        # NOTE: the profile writes are not included, storage.save is
+        # timed on its own
+        def parse(text=text, msg_passphrase=msg_passphrase):
+            with storage.transaction(profile):
+                parse_email(text, profile, msg_passphrase)
+        yield 'parse_email[{},{}]'.format(alg, kind), parse
+
+
+def benchmarks(tmpdir, keys, sizes, selected):
+    """Benchmarks as (name, function) pairs, built lazily.
+
+    :param keys: keys by algorithm, as written by gen_keys
+    :type keys: dict
+    :param selected: function telling whether a benchmark name is run, the
+        storage profiles are only built for those
+    :type selected: function
+    """
+    keydata = _key2keydatas(_keydata2key(keys[KEY_ALG][SENDER]))[1]
+    wrapped = wrap(keydata, wrapstr='\n ')
+    headervalue = 'addr={}; prefer-encrypt=mutual; keydata={}'.format(
+        SENDER, keydata)
+    for alg in ALGS:
+        yield 'gen_key[{}]'.format(alg), lambda a=alg: gen_key(SENDER, a)
+    for alg in ALGS:
+        yield from message_benchmarks(tmpdir, alg, keys[alg])
+    yield 'parse_header_value', lambda: parse_header_value(headervalue)
+    yield 'wrap', lambda: wrap(keydata, wrapstr='\n ')
+    yield 'unwrap', lambda: unwrap(wrapped)
+    for size in sizes:
+        names = ['storage.save[{}]'.format(size),
+                 'storage.load[{}]'.format(size)]
+        if not any(map(selected, names)):
+            continue
+        path = os.path.join(tmpdir, 'peers{}.json'.format(size))
+        peers = peers_profile(path, size, keys[KEY_ALG])
+        yield names[0], lambda p=peers: storage.save(p)
+        yield names[1], lambda p=path: storage.load(p)
+
+
+def measure(func, repeat):
+    """Seconds per call of func, as in timeit."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {'median': statistics.median(times), 'min': min(times),
+            'max': max(times), 'number': number, 'repeat': repeat}
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'pgpy': metadata.version('PGPy')}
+
+
+def compare(results, baseline, threshold):
+    """Names of the benchmarks slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is not None and \
+                result['median'] > base['median'] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def report(results, baseline, regressions):
+    print('{:<34} {:>12} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'median ms', 'min ms', 'baseline ms', 'change'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            base_str, change = '', ''
+        else:
+            base_str = '{:.3f}'.format(base['median'] * 1000)
+            change = '{:+.0%}'.format(result['median'] / base['median'] - 1)
+        print('{:<34} {:>12.3f} {:>12.3f} {:>12} {:>8}{}'.format(
+            name, result['median'] * 1000, result['min'] * 1000, base_str,
+            change, '  REGRESSION' if name in regressions else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', '--keyword',
+                        help='Run only the benchmarks matching this regex.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Measures of each benchmark.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='Number of peers of the storage benchmarks.')
+    parser.add_argument('-o', '--output',
+                        help='Path to write the results as JSON.')
+    parser.add_argument('-b', '--baseline', default=BASELINE_PATH,
+                        help='Results to compare with, if the file exists.')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='Slow down, relative to the baseline median, '
+                        'reported as regression.')
+    parser.add_argument('--gen-keys', action='store_true',
+                        help='Generate the keys in {}.'.format(KEYS_PATH))
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    if args.gen_keys:
+        gen_keys()
+        return 0
+    with open(KEYS_PATH) as fp:
+        keys = json.load(fp)['keys']
+    baseline = {}
+    if args.baseline and os.path.isfile(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+    pattern = re.compile(args.keyword or '')
+
+    def selected(name):
+        return pattern.search(name) is not None
+
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, func in benchmarks(tmpdir, keys, args.sizes, selected):
+            if selected(name):
+                results[name] = measure(func, args.repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+    regressions = compare(results, baseline, args.threshold)
+    report(results, baseline, regressions)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'environment': environment(), 'results': results},
+                      fp, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
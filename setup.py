@@ -28,8 +28,8 @@ def main():
                      'Topic :: Utilities',
                      'Topic :: Communications :: Email',
                      'Intended Audience :: Developers',
-                     'Programming Language :: Python :: 3.5',
-                     'Programming Language :: Python :: 3.6'],
+                     'Programming Language :: Python :: 3.7',
+                     'Programming Language :: Python :: 3.8'],
         packages=['autocrypt'],
         entry_points='''
             [console_scripts]
@@ -42,7 +42,7 @@ def main():
             'test': ['tox', 'pytest'],
             'doc': ['sphinx', 'pylint']
         },
-        python_requires=">=3.5",
+        python_requires=">=3.7",
         tests_require=['pytest'],
         zip_safe=False,
     )
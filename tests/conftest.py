@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 # vim:ts=4:sw=4:expandtab
 
+import shutil
+
 import pytest
 
 from autocrypt.storage import load
@@ -38,9 +40,12 @@ def datadir(request):
 
 
 @pytest.fixture
-def profile_maker(request, datadir):
+def profile_maker(request, datadir, tmpdir_factory):
     def maker():
-        path = datadir.join('profile.json')
+        # NOTE: a copy, so that the peers state written by a test is not
+        # seen by the others
+        path = tmpdir_factory.mktemp('profile').join('profile.json').strpath
+        shutil.copy(datadir.join('profile.json'), path)
         profile = load(path)
         return profile
     return maker
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for the asyncio functions."""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from autocrypt import aio, message, storage
+from autocrypt.constants import MUTUAL, PEERS
+from autocrypt.tests_data import (ALICE, BOB, BODY_AC, BODY_GOSSIP,
+                                  SUBJECT_GOSSIP)
+
+
+def test_aio_concurrency():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        threading.Event().wait(0.02)
+        with lock:
+            running.pop()
+
+    async def main():
+        await asyncio.gather(*[aio.run(work) for _ in range(10)])
+
+    aio.configure(ThreadPoolExecutor(8), concurrency=2)
+    try:
+        asyncio.new_event_loop().run_until_complete(main())
+    finally:
+        aio.configure()
+    assert max(peak) == 2
+
+
+def test_aio_gen_parse_email(profile, datadir):
+    async def main():
+        msg = await aio.gen_ac_email(profile, ALICE, [BOB], SUBJECT_GOSSIP,
+                                     BODY_GOSSIP, pe=MUTUAL)
+        assert msg.get_content_subtype() == 'encrypted'
+        return await asyncio.gather(
+            aio.parse_email(datadir.read('example-simple-autocrypt-pyac.eml'),
+                            profile),
+            aio.parse_email(datadir.read('example-gossip_pyac2.eml'),
+                            profile),
+            *[aio.new_peer(profile, 'p{}@autocrypt.example'.format(i))
+              for i in range(5)])
+
+    aio.configure(ThreadPoolExecutor(4), concurrency=4)
+    try:
+        results = asyncio.new_event_loop().run_until_complete(main())
+    finally:
+        aio.configure()
+    assert results[0].body == BODY_AC
+    assert results[1].body == BODY_GOSSIP
+    for i in range(5):
+        assert 'p{}@autocrypt.example'.format(i) in profile[PEERS]
+
+
+def test_aio_parse_email_unlocked(profile, datadir, monkeypatch):
+    locked = []
+    decrypt = message.decrypt
+
+    def try_lock():
+        lock = storage._lock(profile)
+        acquired = lock.acquire(blocking=False)
+        if acquired:
+            lock.release()
+        locked.append(not acquired)
+
+    def checking_decrypt(*args, **kwargs):
+        # NOTE: the lock is tried from another thread, it is reentrant
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return decrypt(*args, **kwargs)
+
+    monkeypatch.setattr(message, 'decrypt', checking_decrypt)
+    pt = asyncio.new_event_loop().run_until_complete(
+        aio.parse_email(datadir.read('example-gossip_pyac2.eml'), profile))
+    assert pt.body == BODY_GOSSIP
+    assert locked == [False]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for cache."""
+
+from __future__ import unicode_literals
+
+from autocrypt.cache import LRUCache, key_cache, keydata_digest
+from autocrypt.constants import ACCOUNTS, SECKEY
+from autocrypt.crypto import _key2keydatas, _keydata2key
+from autocrypt.storage import del_peer, init_profile, new_peer
+from autocrypt.tests_data import ALICE, BOB
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    # NOTE: 'b' is the least recently used
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert cache.info() == {'hits': 1, 'misses': 2, 'size': 1, 'maxsize': 2}
+
+
+def test_keydata2key_cached(profile, tmpdir):
+    keydata = profile[ACCOUNTS][ALICE][SECKEY]
+    key_cache.clear()
+    key = _keydata2key(keydata)
+    assert _keydata2key(keydata) is key
+    assert key_cache.info()['hits'] == 1
+
+    pk = _key2keydatas(key)[1]
+    tmp_profile = init_profile(tmpdir.join('profile.json').strpath)
+    new_peer(tmp_profile, BOB, pk)
+    assert keydata_digest(pk) in key_cache
+    del_peer(tmp_profile, BOB)
+    assert keydata_digest(pk) not in key_cache
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for the daemon."""
+
+import json
+import os
+import shutil
+import threading
+
+import pytest
+
+from autocrypt.daemon import Client, DaemonError, Server
+from autocrypt.tests_data import ALICE, BODY_GOSSIP, RECIPIENTS
+
+CAROL = 'carol@autocrypt.example'
+
+
+@pytest.fixture
+def server(tmpdir, datadir):
+    path = str(tmpdir.join('profile.json'))
+    shutil.copy(datadir.join('profile.json'), path)
+    server = Server(path, str(tmpdir.join('autocrypt.sock')),
+                    flush_seconds=60)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_daemon(server, datadir):
+    assert os.stat(server.server_address).st_mode & 0o777 == 0o600
+    with Client(server.server_address) as client:
+        assert client.call('ping') == 'pong'
+        assert client.peer('nobody@autocrypt.example') is None
+
+        result = client.parse_email(datadir.read('example-gossip_pyac2.eml'))
+        assert result['body'] == BODY_GOSSIP
+        assert len(result['gossip']) == len(RECIPIENTS)
+
+        ct = client.encrypt('123', [CAROL])
+        assert client.decrypt(ct) == '123'
+
+        with pytest.raises(DaemonError):
+            client.call('unknown')
+        with pytest.raises(DaemonError):
+            client.parse_email(
+                datadir.read('example-setup-message-pyac.eml'))
+        assert client.call('ping') == 'pong'
+        assert client.peer(ALICE) is not None
+
+        # NOTE: the peers imported are in the journal until it is flushed
+        path = server.profile['path']
+        assert os.path.getsize(path + '.log')
+        assert client.flush()
+        assert not os.path.getsize(path + '.log')
+        with open(path) as fp:
+            assert ALICE in json.load(fp)['peers']
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for ingest."""
+
+from __future__ import unicode_literals
+
+import mailbox
+
+from autocrypt.constants import (ACTIMESTAMP, GOSSIPKEY, GOSSIPTS, MUTUAL,
+                                 PEERS, PREFERENCRYPT, PUBKEY)
+from autocrypt.ingest import ingest, iter_messages
+from autocrypt.message import parse_ac_headers
+from autocrypt.tests_data import ALICE, BOB, CAROL
+
+
+def make_mailboxes(datadir, tmpdir):
+    mbox_path = tmpdir.join('mbox').strpath
+    maildir_path = tmpdir.join('Maildir').strpath
+    mbox = mailbox.mbox(mbox_path)
+    maildir = mailbox.Maildir(maildir_path)
+    # NOTE: the most recent message is the first one
+    mbox.add(datadir.read_bytes('example-gossip_pyac2.eml'))
+    maildir.add(datadir.read_bytes('example-simple-autocrypt-pyac.eml'))
+    mbox.close()
+    return [mbox_path, maildir_path]
+
+
+def test_iter_messages(datadir, tmpdir):
+    dates = [date for date, raw in
+             iter_messages(make_mailboxes(datadir, tmpdir))]
+    assert dates == sorted(dates)
+
+
+def test_ingest(profile, datadir, tmpdir):
+    profile['path'] = tmpdir.join('profile.json').strpath
+    stats = ingest(profile, make_mailboxes(datadir, tmpdir), batch=1)
+    assert stats['messages'] == 2
+    assert stats['updates'] == 2
+    keydata = parse_ac_headers(
+        datadir.read('example-gossip_pyac2.eml'))[0]['keydata']
+    assert profile[PEERS][ALICE][PUBKEY] == ''.join(keydata.split())
+    assert profile[PEERS][ALICE][PREFERENCRYPT] == MUTUAL
+    assert profile[PEERS][ALICE][ACTIMESTAMP] == 1510062985
+
+
+def test_ingest_gossip(profile, datadir, tmpdir):
+    profile['path'] = tmpdir.join('profile.json').strpath
+    stats = ingest(profile, make_mailboxes(datadir, tmpdir)[:1],
+                   decrypt=True)
+    assert stats['updates'] == 3
+    for addr in [BOB, CAROL]:
+        assert profile[PEERS][addr][GOSSIPKEY] is not None
+        assert profile[PEERS][addr][GOSSIPTS] == 1510062985
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for the key pool."""
+
+import multiprocessing
+
+import pytest
+
+from autocrypt.constants import ACCOUNTS, KEY_ALG_25519, KEY_ALG_RSA, SECKEY
+from autocrypt.crypto import _keydata2key, decrypt, sign_encrypt
+from autocrypt.keypool import KeyPool
+from autocrypt.storage import init_profile, new_account
+
+
+def test_keypool(tmpdir):
+    path = str(tmpdir.join('keypool.json'))
+    pool = KeyPool(path, size=2, low=1)
+    pool.fill()
+    assert len(pool) == 2
+    assert len(KeyPool(path, size=2, low=1)) == 2
+
+    profile = init_profile(str(tmpdir.join('profile.json')))
+    new_account(profile, 'alice@autocrypt.example', pool=pool)
+    assert len(pool) == 1
+    key = _keydata2key(profile[ACCOUNTS]['alice@autocrypt.example'][SECKEY])
+    assert key.userids[0].name == 'alice@autocrypt.example'
+    assert len(key.subkeys) == 1
+    ct = sign_encrypt(profile, b'hello', 'alice@autocrypt.example',
+                      ['alice@autocrypt.example'])
+    pt = decrypt(profile, ct)
+    assert pt == 'hello'
+    pool.wait()
+    assert len(KeyPool(path, size=2, low=1)) == 1
+
+
+def test_keypool_alg(tmpdir):
+    pool = KeyPool(str(tmpdir.join('keypool.json')), size=1, low=0,
+                   alg=KEY_ALG_25519)
+    pool.fill()
+    profile = init_profile(str(tmpdir.join('profile.json')))
+    with pytest.raises(ValueError):
+        new_account(profile, 'alice@autocrypt.example', pool=pool,
+                    alg=KEY_ALG_RSA)
+    # NOTE: the key algorithm is the one of the pool
+    new_account(profile, 'alice@autocrypt.example', pool=pool)
+    assert len(pool) == 0
+
+
+def take_key(path, queue):
+    queue.put(str(KeyPool(path, size=4, low=0).get(
+        'alice@autocrypt.example').fingerprint))
+
+
+def test_keypool_processes(tmpdir):
+    path = str(tmpdir.join('keypool.json'))
+    KeyPool(path, size=4, low=0).fill()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    procs = [context.Process(target=take_key, args=(path, queue))
+             for _ in range(4)]
+    for proc in procs:
+        proc.start()
+    fingerprints = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+    # NOTE: every process has taken a different key
+    assert len(set(fingerprints)) == 4
+    assert len(KeyPool(path, size=4, low=0)) == 0
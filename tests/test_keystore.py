@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for keystore."""
+
+import json
+import os.path
+
+from autocrypt.constants import GOSSIPKEY, MUTUAL, PEERS, PUBKEY
+from autocrypt.keystore import KeyStore, is_keyref, keystore_path
+from autocrypt.storage import close, del_peer, load, new_peer, save
+from autocrypt.tests_data import ALICE_KEYDATA, BOB, BOB_KEYDATA, CAROL
+
+KEYDATA = ''.join(BOB_KEYDATA.split())
+
+
+def test_keystore_profile(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    profile = load(path, keystore=True)
+    new_peer(profile, BOB, BOB_KEYDATA, MUTUAL, gpk=BOB_KEYDATA)
+    new_peer(profile, CAROL, BOB_KEYDATA)
+    save(profile)
+    close(profile)
+    with open(path) as fp:
+        stored = json.load(fp)[PEERS]
+    assert is_keyref(stored[BOB][PUBKEY])
+    assert stored[BOB][PUBKEY] == stored[BOB][GOSSIPKEY] == \
+        stored[CAROL][PUBKEY]
+    assert len(KeyStore(path)) == 1
+
+    loaded = load(path)
+    assert loaded[PEERS][BOB][PUBKEY] == KEYDATA
+    assert loaded[PEERS][BOB].pubkey is loaded[PEERS][BOB].gossipkey
+    assert loaded[PEERS][BOB].pubkey is loaded[PEERS][CAROL].pubkey
+    close(loaded)
+
+
+def test_keystore_truncated(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    keystore = KeyStore(path)
+    keystore.put(b'key1')
+    keystore.flush()
+    with open(keystore_path(path), 'ab') as fp:
+        fp.write(b'half written')
+    keystore = KeyStore(path)
+    assert list(keystore.keys.values()) == [b'key1']
+    keyref = keystore.put(b'key2')
+    keystore.flush()
+    assert KeyStore(path).get(keyref) == b'key2'
+    assert os.path.getsize(keystore_path(path)) == keystore.size
+
+
+def test_keystore_collect(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    profile = load(path, keystore=True)
+    new_peer(profile, BOB, BOB_KEYDATA)
+    new_peer(profile, CAROL, ALICE_KEYDATA)
+    save(profile)
+    keystore_size = os.path.getsize(keystore_path(path))
+    del_peer(profile, BOB)
+    del_peer(profile, CAROL)
+    new_peer(profile, CAROL, ALICE_KEYDATA)
+    save(profile)
+    close(profile)
+    assert os.path.getsize(keystore_path(path)) < keystore_size
+    assert load(path)[PEERS][CAROL][PUBKEY] == ''.join(ALICE_KEYDATA.split())
@@ -6,22 +6,39 @@
 from __future__ import unicode_literals
 
 import logging
+import logging.config
+import io
 from email import policy
 from email.parser import Parser
 
+import pytest
+
+from autocrypt import message
+from autocrypt.cache import ac_header_cache, gossip_header_cache
 from autocrypt.conflog import LOGGING
-from autocrypt.constants import (AC_PASSPHRASE_LEN, AC_PASSPHRASE_NUM_BLOCKS,
-                                 AC_PASSPHRASE_NUM_WORDS, MUTUAL)
-from autocrypt.message import (gen_ac_headervaluestr, gen_ac_setup_ct,
+from autocrypt.constants import (AC_HEADER_MAXLEN, AC_PASSPHRASE_LEN,
+                                 AC_PASSPHRASE_NUM_BLOCKS,
+                                 AC_PASSPHRASE_NUM_WORDS, ACCOUNTS,
+                                 KEY_ALG_25519, LEVEL_NUMBER, MUTUAL,
+                                 NOPREFERENCE, PEERS, PUBKEY)
+from autocrypt.crypto import _get_seckey_from_addr, _key2keydatas
+from autocrypt.message import (decrypt_email, gen_ac_email,
+                               gen_ac_headervaluestr, gen_ac_setup_ct,
                                gen_ac_setup_email, gen_ac_setup_passphrase,
                                gen_ac_setup_payload, gen_gossip_email,
                                gen_gossip_headervalue, gen_gossip_headervalues,
-                               gen_gossip_pt_email, header_unwrap,
-                               parse_ac_email, parse_ac_setup_ct,
+                               gen_gossip_pt_email, get_ac_headervaluestr,
+                               header_unwrap, header_wrap,
+                               ParsedEmail, parse_ac_email, parse_ac_headers,
+                               parse_ac_setup_ct,
                                parse_ac_setup_email, parse_ac_setup_payload,
                                parse_email, parse_gossip_email,
-                               parse_gossip_list_from_msg, wrap)
-from autocrypt.storage import repr_profile
+                               parse_gossip_list_from_msg, parse_header_value,
+                               scan_ac_headers, scan_headers,
+                               tokenize_header_value, wrap)
+from autocrypt.peerstate import update_gossip
+from autocrypt.storage import (del_peer, init_profile, migrate,
+                               new_account, new_peer, repr_profile)
 from autocrypt.tests_data import (AC_SETUP_ENC, AC_SETUP_PAYLOAD, ALICE,
                                   ALICE_AC, ALICE_KEYDATA, BOB, BOB_GOSSIP,
                                   BOB_KEYDATA, BOB_KEYDATA_WRAPPED, BODY_AC,
@@ -45,10 +62,50 @@ def test_ac_header_wrap():
 
 
 def test_gen_ac_headervaluestr():
-    h = gen_ac_headervaluestr(ALICE, ALICE_KEYDATA, MUTUAL)
+    # NOTE: the keydata is unfolded when it is parsed
+    h = gen_ac_headervaluestr(ALICE, ''.join(ALICE_KEYDATA.split()), MUTUAL)
     assert h == header_unwrap(ALICE_AC)
 
 
+def test_parse_header_value():
+    keydata = ''.join(BOB_KEYDATA.split())
+    assert list(tokenize_header_value('addr=a@x;keydata= xy\r\n\tz ;')) == \
+        [('addr', 'a@x'), ('keydata', ' xy\r\n\tz ')]
+    for value in ['addr={}; keydata={}'.format(BOB, keydata),
+                  'addr={};\n keydata={}'.format(BOB, BOB_KEYDATA_WRAPPED),
+                  ' addr = {} ;\r\n\t_x=y;keydata=\r\n {}; '.format(
+                      BOB, BOB_KEYDATA)]:
+        assert parse_header_value(value) == {'addr': BOB,
+                                             'keydata': keydata}
+    for value in ['addr={}; type=1; keydata={}'.format(BOB, keydata),
+                  'addr={}; keydata'.format(BOB),
+                  'addr={}; prefer-encrypt=mutual'.format(BOB),
+                  'prefer-encrypt=mutual; keydata={}'.format(keydata),
+                  'addr={}; keydata={}'.format(BOB, 'a' * AC_HEADER_MAXLEN)]:
+        with pytest.raises(ValueError):
+            parse_header_value(value)
+    assert parse_ac_headers('Autocrypt: addr=a@x; type=1; keydata=xy\n\n'
+                            'body') == []
+    assert parse_ac_headers('Autocrypt: addr=a@x; prefer-encrypt=mutual\n\n'
+                            'body') == []
+
+
+def test_get_ac_headervaluestr(profile, tmpdir):
+    profile = migrate(profile['path'], tmpdir.join('profile.json').strpath)
+    ac_header_cache.clear()
+    h = get_ac_headervaluestr(profile, BOB, MUTUAL)
+    assert h == header_wrap(gen_ac_headervaluestr(
+        BOB, profile[ACCOUNTS][BOB][PUBKEY], MUTUAL))
+    assert get_ac_headervaluestr(profile, BOB, MUTUAL) is h
+    assert get_ac_headervaluestr(profile, BOB, NOPREFERENCE) != h
+    assert ac_header_cache.info()['hits'] == 1
+
+    new_account(profile, BOB, pe=MUTUAL, alg=KEY_ALG_25519)
+    assert (BOB, MUTUAL) not in ac_header_cache
+    assert get_ac_headervaluestr(profile, BOB, MUTUAL) == header_wrap(
+        gen_ac_headervaluestr(BOB, profile[ACCOUNTS][BOB][PUBKEY], MUTUAL))
+
+
 def test_gen_ac_email(profile, datadir):
     pass
     # msg = gen_ac_email(ALICE, [BOB], profile, SUBJECT_AC, BODY_AC, MUTUAL,
@@ -61,6 +118,22 @@ def test_gen_ac_email(profile, datadir):
 #         text.split('\n')[:23]
 
 
+def test_gen_ac_email_gossip_key(profile):
+    dave, eve = 'dave@autocrypt.example', 'eve@autocrypt.example'
+    keydata = _key2keydatas(_get_seckey_from_addr(profile, BOB))[1]
+    # NOTE: a peer only known from gossip
+    update_gossip(profile, dave, None, keydata)
+    assert profile[PEERS][dave][PUBKEY] is None
+    assert gen_gossip_headervalues([dave], profile) == \
+        [gen_gossip_headervalue(dave, keydata)]
+    msg = gen_ac_email(profile, BOB, [dave], SUBJECT_GOSSIP, BODY_AC)
+    assert parser.parsestr(decrypt_email(msg, profile)).get_content() == \
+        BODY_AC
+    new_peer(profile, eve)
+    with pytest.raises(ValueError):
+        gen_ac_email(profile, BOB, [dave, eve], SUBJECT_GOSSIP, BODY_AC)
+
+
 def test_parse_ac_email(profile, datadir):
     logger.debug(repr_profile(profile))
     logger.debug(datadir.basepath)
@@ -73,7 +146,7 @@ def test_parse_ac_email(profile, datadir):
 
 
 def test_gen_gossip_headervalue():
-    h = gen_gossip_headervalue(BOB, BOB_KEYDATA)
+    h = gen_gossip_headervalue(BOB, ''.join(BOB_KEYDATA.split()))
     assert h == header_unwrap(BOB_GOSSIP)
 
 
@@ -86,6 +159,25 @@ def test_parse_gossip_list_from_msg(profile, datadir):
     assert headers == gossip_list
 
 
+def test_gen_gossip_headervalues_cache(profile, tmpdir):
+    profile = migrate(profile['path'], tmpdir.join('profile.json').strpath)
+    gossip_header_cache.clear()
+    headers = gen_gossip_headervalues(RECIPIENTS, profile)
+    assert gen_gossip_headervalues(RECIPIENTS, profile) == headers
+    assert gossip_header_cache.info()['hits'] == len(RECIPIENTS)
+    assert gen_gossip_headervalues(RECIPIENTS, profile, folded=True) == \
+        [header_wrap(h) for h in headers]
+
+    keydata = profile[PEERS][RECIPIENTS[1]][PUBKEY]
+    new_peer(profile, RECIPIENTS[0], keydata)
+    assert RECIPIENTS[0] not in gossip_header_cache
+    assert RECIPIENTS[1] in gossip_header_cache
+    assert gen_gossip_headervalues(RECIPIENTS[:1], profile) == \
+        [gen_gossip_headervalue(RECIPIENTS[0], keydata)]
+    del_peer(profile, RECIPIENTS[1])
+    assert RECIPIENTS[1] not in gossip_header_cache
+
+
 def test_gen_gossip_pt_email(profile, datadir):
     # text = datadir.read('example-gossip-cleartext_pyac.eml')
     msg = gen_gossip_pt_email(RECIPIENTS, BODY_GOSSIP, profile)
@@ -206,3 +298,75 @@ def test_parse_email(profile, datadir):
     text = datadir.read('example-simple-autocrypt-pyac.eml')
     pt = parse_ac_email(text, profile)
     assert parser.parsestr(pt).get_payload() == BODY_AC
+
+
+def test_parse_email_decrypts_once(profile, datadir, monkeypatch):
+    calls = []
+    decrypt = message.decrypt
+
+    def counting_decrypt(*args, **kwargs):
+        calls.append(args)
+        return decrypt(*args, **kwargs)
+
+    monkeypatch.setattr(message, 'decrypt', counting_decrypt)
+    headers = []
+    parse_headers = message.parse_ac_headers
+    monkeypatch.setattr(message, 'parse_ac_headers',
+                        lambda msg: headers.append(msg) or parse_headers(msg))
+    text = datadir.read('example-gossip_pyac2.eml')
+    pt = parse_email(text, profile)
+    assert len(calls) == 1
+    assert len(headers) == 1
+    assert isinstance(pt, ParsedEmail)
+    assert pt.ac['addr'] == ALICE
+    assert len(pt.gossip) == len(RECIPIENTS)
+    assert pt.body == BODY_GOSSIP
+    for g in pt.gossip:
+        assert parse_header_value(g)['addr'] in profile[PEERS]
+
+
+def test_parse_email_not_decrypted(profile, tmpdir, datadir):
+    # NOTE: the Autocrypt header of an Email that is not encrypted, or can
+    # not be decrypted, is stored
+    text = 'From: {}\nTo: {}\nDate: Tue, 07 Nov 2017 14:56:25 +0100\n' \
+        'Autocrypt: {}\n\nhello\n'.format(ALICE, BOB, ALICE_AC)
+    del_peer(profile, ALICE)
+    pt = parse_email(text, profile)
+    assert pt.body == 'hello\n'
+    assert pt.ac['addr'] == ALICE
+    assert profile[PEERS][ALICE][PUBKEY] == ''.join(ALICE_KEYDATA.split())
+
+    empty = init_profile(tmpdir.join('profile.json').strpath)
+    text = datadir.read('example-simple-autocrypt-pyac.eml')
+    assert parse_email(text, empty) is None
+    assert ALICE in empty[PEERS]
+
+
+def test_parse_email_invalid_ac_header(profile):
+    # NOTE: an Email with only invalid Autocrypt headers is a plain Email
+    peers = dict(profile[PEERS])
+    text = 'From: a@x\nAutocrypt: addr=a@x; foo=bar; keydata=AAAA\n\n' \
+        'hello\n'
+    assert parse_email(text, profile) is None
+    assert profile[PEERS] == peers
+
+
+def test_scan_headers(datadir):
+    raw = datadir.read('example-gossip_pyac2.eml').encode()
+    ac_headers, setup = scan_ac_headers(raw)
+    assert setup is None
+    assert len(ac_headers) == 1
+    assert ac_headers[0]['addr'] == ALICE
+    assert ac_headers[0]['prefer-encrypt'] == MUTUAL
+    assert ac_headers[0]['keydata'] == \
+        ''.join(parse_ac_headers(raw.decode())[0]['keydata'].split())
+
+    folded = (b'From: a@x\r\nSubject: a\r\n folded\r\n\tsubject\r\n'
+              b'\r\nSubject: body\r\n')
+    fp = io.BytesIO(folded + b'x' * 1000)
+    assert scan_headers(fp) == {'from': ['a@x'],
+                                'subject': ['a folded\tsubject']}
+    assert fp.tell() == len(folded) - len(b'Subject: body\r\n')
+
+    raw = datadir.read('example-setup-message-pyac.eml')
+    assert scan_ac_headers(raw) == ([], LEVEL_NUMBER)
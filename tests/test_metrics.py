@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for the metrics."""
+
+from autocrypt import metrics
+from autocrypt.cache import ac_header_cache, gossip_header_cache
+from autocrypt.constants import MUTUAL
+from autocrypt.message import (gen_gossip_headervalues, get_ac_headervaluestr,
+                               parse_email)
+from autocrypt.tests_data import BOB
+
+
+def test_histogram():
+    h = metrics.Histogram([0.1, 1])
+    for value in [0.05, 0.5, 0.5, 2]:
+        h.observe(value)
+    assert h.cumulative() == [(0.1, 1), (1, 3), (float('inf'), 4)]
+    assert h.sum == 3.05
+
+
+def test_metrics_disabled(profile, datadir):
+    metrics.reset()
+    parse_email(datadir.read('example-gossip_pyac2.eml'), profile)
+    assert metrics.snapshot()['histograms'] == {}
+
+
+def test_metrics(profile, datadir, tmpdir):
+    metrics.reset()
+    metrics.enable()
+    try:
+        parse_email(datadir.read('example-gossip_pyac2.eml'), profile)
+    finally:
+        metrics.disable()
+    data = metrics.snapshot()
+    for stage in ['decrypt', 'key_lookup', 'mime_parse', 'write_records']:
+        assert data['histograms'][stage]['count'] >= 1
+    assert data['histograms']['decrypt']['count'] == 1
+    assert 'key_cache_hits' in data['counters']
+
+    path = str(tmpdir.join('autocrypt.prom'))
+    metrics.dump_prometheus(path)
+    text = open(path).read()
+    assert '# TYPE autocrypt_decrypt_seconds histogram' in text
+    assert 'autocrypt_decrypt_seconds_bucket{le="+Inf"} 1' in text
+    assert 'autocrypt_decrypt_seconds_count 1' in text
+    assert '# TYPE autocrypt_key_cache_hits_total counter' in text
+    metrics.reset()
+
+
+def test_metrics_header_caches(profile):
+    ac_header_cache.clear()
+    gossip_header_cache.clear()
+    for _ in range(2):
+        get_ac_headervaluestr(profile, BOB, MUTUAL)
+        gen_gossip_headervalues([BOB], profile)
+    counters = metrics.snapshot()['counters']
+    for name in ['ac_header_cache', 'gossip_header_cache']:
+        assert counters[name + '_hits'] == 1
+        assert counters[name + '_misses'] == 1
+    assert 'autocrypt_gossip_header_cache_hits_total 1' in \
+        metrics.prometheus_text()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for parallel."""
+
+from __future__ import unicode_literals
+
+from autocrypt.constants import ACCOUNTS, SECKEY
+from autocrypt.crypto import _key2keydatas, _keydata2key, encrypt
+from autocrypt.message import gen_encrypted_email
+from autocrypt.parallel import decrypt_emails
+from autocrypt.storage import init_profile, new_account
+from autocrypt.tests_data import ALICE
+
+
+def test_decrypt_emails(profile, tmpdir):
+    tmp_profile = init_profile(tmpdir.join('profile.json').strpath)
+    keydata = profile[ACCOUNTS][ALICE][SECKEY]
+    new_account(tmp_profile, ALICE, *_key2keydatas(_keydata2key(keydata)))
+    msgs = [gen_encrypted_email(str(encrypt(tmp_profile, str(i), [ALICE])))
+            for i in range(3)]
+    msgs.append('Subject: not encrypted\n\nbody')
+    results = sorted(decrypt_emails(msgs, tmp_profile, max_workers=2,
+                                    window=2))
+    assert [(i, pt) for i, pt, _ in results[:3]] == \
+        [(0, '0'), (1, '1'), (2, '2')]
+    assert results[3][:2] == (3, None)
+    assert isinstance(results[3][2], Exception)
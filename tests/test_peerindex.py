@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for peerindex."""
+
+import pytest
+
+from autocrypt.constants import ACCOUNTS, KEYHANDLES, PEERS, PUBKEY
+from autocrypt.crypto import _get_addr_from_keyhandle, _get_pubkey_from_addr
+from autocrypt.peerindex import MappedPeers
+from autocrypt.storage import (del_peer, load, migrate, new_peer, save,
+                               transaction)
+from autocrypt.tests_data import BOB, CAROL
+
+
+def test_peerindex_migrate(profile, tmpdir):
+    path = tmpdir.join('profile.idx').strpath
+    migrate(profile['path'], path)
+    loaded = load(path)
+    assert isinstance(loaded[PEERS], MappedPeers)
+    assert len(loaded[PEERS]) == len(profile[PEERS])
+    for name in [ACCOUNTS, PEERS]:
+        assert dict(loaded[name].items()) == profile[name]
+        assert dict(loaded[KEYHANDLES][name].items()) == \
+            profile[KEYHANDLES][name]
+    assert 'missing@autocrypt.example' not in loaded[PEERS]
+    key = _get_pubkey_from_addr(loaded, CAROL)
+    keyid = key.fingerprint.keyid
+    assert keyid == _get_pubkey_from_addr(profile, CAROL).fingerprint.keyid
+    assert loaded[KEYHANDLES][PEERS][keyid] == CAROL
+    assert _get_addr_from_keyhandle(loaded, keyid) == \
+        _get_addr_from_keyhandle(profile, keyid)
+
+
+def test_peerindex_update(profile, tmpdir):
+    path = tmpdir.join('profile.idx').strpath
+    migrate(profile['path'], path)
+    loaded = load(path)
+    keydata = loaded[PEERS][CAROL][PUBKEY]
+    npeers = len(loaded[PEERS])
+    with pytest.raises(ValueError):
+        with transaction(loaded):
+            del_peer(loaded, CAROL)
+            raise ValueError()
+    assert loaded[PEERS][CAROL][PUBKEY] == keydata
+
+    del_peer(loaded, BOB)
+    new_peer(loaded, 'dave@autocrypt.example', keydata)
+    assert len(loaded[PEERS]) == npeers
+    save(loaded)
+    reloaded = load(path)
+    assert BOB not in reloaded[PEERS]
+    assert reloaded[PEERS]['dave@autocrypt.example'][PUBKEY] == keydata
+    assert sorted(reloaded[PEERS]) == sorted(loaded[PEERS])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for peerstate."""
+
+import time
+
+from autocrypt import storage
+from autocrypt.constants import (ACTIMESTAMP, GOSSIPKEY, GOSSIPTS,
+                                 KEY_ALG_25519, LASTSEEN, MUTUAL,
+                                 NOPREFERENCE,
+                                 PEER_TIMESTAMP_RESOLUTION, PEERS,
+                                 PREFERENCRYPT, PUBKEY)
+from autocrypt.crypto import (_gen_ssubkey, _pgpy_constants, gen_key,
+                              key_bytes)
+from autocrypt.peerstate import (message_date, same_key, update_gossip,
+                                 update_peer)
+from autocrypt.storage import init_profile
+from autocrypt.tests_data import BOB, CAROL
+
+DATE = 1510062985
+ADDR = 'dave@autocrypt.example'
+
+
+def counting_writes(monkeypatch):
+    writes = []
+    write_records = storage._write_records
+
+    def counting(profile, keys, sync=False):
+        writes.append(keys)
+        return write_records(profile, keys, sync)
+
+    monkeypatch.setattr(storage, '_write_records', counting)
+    return writes
+
+
+def test_message_date():
+    assert message_date('Tue, 07 Nov 2017 14:56:25 +0100') == DATE
+    assert message_date('Tue, 07 Nov 2117 14:56:25 +0100') <= time.time()
+    assert message_date('not a date') is None
+
+
+def test_update_peer(profile, tmpdir, monkeypatch):
+    keydata, other = profile[PEERS][BOB][PUBKEY], profile[PEERS][CAROL][PUBKEY]
+    assert same_key(keydata, profile[PEERS][BOB][PUBKEY])
+    assert not same_key(keydata, other)
+    profile = init_profile(tmpdir.join('profile.json').strpath)
+    writes = counting_writes(monkeypatch)
+
+    assert not update_peer(profile, ADDR, DATE)
+    assert update_peer(profile, ADDR, DATE, keydata, MUTUAL)
+    peer = profile[PEERS][ADDR]
+    assert (peer[PUBKEY], peer[PREFERENCRYPT], peer[LASTSEEN],
+            peer[ACTIMESTAMP]) == (keydata, MUTUAL, DATE, DATE)
+    # NOTE: headers repeating the state are not written
+    assert not update_peer(profile, ADDR, DATE + 60, keydata, MUTUAL)
+    assert not update_peer(profile, ADDR, DATE - 60, other)
+    assert len(writes) == 1
+    assert profile[PEERS][ADDR] is peer
+
+    date = DATE + PEER_TIMESTAMP_RESOLUTION
+    assert update_peer(profile, ADDR, date, keydata, MUTUAL)
+    assert profile[PEERS][ADDR][ACTIMESTAMP] == date
+    assert update_peer(profile, ADDR, date, other)
+    assert profile[PEERS][ADDR][PUBKEY] == other
+    assert profile[PEERS][ADDR][PREFERENCRYPT] == NOPREFERENCE
+    # NOTE: a message without Autocrypt header only updates the last seen
+    assert update_peer(profile, ADDR, date + PEER_TIMESTAMP_RESOLUTION)
+    assert profile[PEERS][ADDR][LASTSEEN] == date + PEER_TIMESTAMP_RESOLUTION
+    assert profile[PEERS][ADDR][ACTIMESTAMP] == date
+    assert len(writes) == 4
+
+
+def test_update_peer_new_subkey(tmpdir):
+    key = gen_key(ADDR, KEY_ALG_25519)
+    kbytes = key_bytes(key.pubkey)
+    # NOTE: a key with the same fingerprint and a new encryption subkey
+    key.add_subkey(_gen_ssubkey(KEY_ALG_25519),
+                   usage=_pgpy_constants()['SKEY_USAGE_ENC'])
+    new_kbytes = key_bytes(key.pubkey)
+    assert not same_key(kbytes, new_kbytes)
+    profile = init_profile(tmpdir.join('profile.json').strpath)
+    assert update_peer(profile, ADDR, DATE, kbytes)
+    assert update_peer(profile, ADDR, DATE, new_kbytes)
+    assert profile[PEERS][ADDR].keybytes(PUBKEY) == new_kbytes
+
+
+def test_update_gossip(profile, tmpdir, monkeypatch):
+    keydata, other = profile[PEERS][BOB][PUBKEY], profile[PEERS][CAROL][PUBKEY]
+    profile = init_profile(tmpdir.join('profile.json').strpath)
+    writes = counting_writes(monkeypatch)
+
+    assert update_gossip(profile, ADDR, DATE, keydata)
+    assert profile[PEERS][ADDR][PUBKEY] is None
+    assert profile[PEERS][ADDR][GOSSIPKEY] == keydata
+    assert not update_gossip(profile, ADDR, DATE, other)
+    assert not update_gossip(profile, ADDR, DATE + 60, keydata)
+    assert update_gossip(profile, ADDR, DATE + 60, other)
+    assert profile[PEERS][ADDR][GOSSIPTS] == DATE + 60
+    assert update_peer(profile, ADDR, DATE, keydata)
+    assert profile[PEERS][ADDR][GOSSIPKEY] == other
+    assert len(writes) == 3
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for the recommendations."""
+
+from autocrypt.constants import (AC_STALE_SECONDS, ACCOUNTS, AVAILABE,
+                                 DISABLE, DISCOURAGE, ENCRYPT, MUTUAL,
+                                 NOPREFERENCE, PEERS, PREFERENCRYPT)
+from autocrypt.recommendation import PeerColumns, recommend, recommend_all
+from autocrypt.records import to_record
+from autocrypt.storage import init_profile
+
+NOW = 1510062985
+SENDER = 'alice@autocrypt.example'
+
+
+def make_profile(tmpdir):
+    profile = init_profile(str(tmpdir.join('profile.json')))
+    profile[ACCOUNTS][SENDER] = {PREFERENCRYPT: MUTUAL}
+    peers = profile[PEERS]
+    peers['mutual@x'] = {'pubkey': 'k', PREFERENCRYPT: MUTUAL,
+                         'lastseen': NOW, 'actimestamp': NOW}
+    peers['nopref@x'] = {'pubkey': 'k', PREFERENCRYPT: NOPREFERENCE,
+                         'lastseen': NOW, 'actimestamp': NOW}
+    peers['stale@x'] = {'pubkey': 'k', PREFERENCRYPT: MUTUAL,
+                        'lastseen': NOW,
+                        'actimestamp': NOW - AC_STALE_SECONDS - 1}
+    peers['gossip@x'] = {'pubkey': None, 'gossipkey': 'k',
+                         PREFERENCRYPT: MUTUAL}
+    peers['nokey@x'] = {'pubkey': None, PREFERENCRYPT: MUTUAL}
+    for addr, record in peers.items():
+        peers[addr] = to_record(PEERS, record)
+    return profile
+
+
+def test_recommend_all(tmpdir):
+    profile = make_profile(tmpdir)
+    assert recommend_all(profile, SENDER) == {
+        'mutual@x': ENCRYPT, 'nopref@x': AVAILABE, 'stale@x': DISCOURAGE,
+        'gossip@x': DISCOURAGE, 'nokey@x': DISABLE}
+    assert recommend_all(profile)['mutual@x'] == AVAILABE
+    assert recommend_all(profile, reply_to_encrypted=True) == {
+        'mutual@x': ENCRYPT, 'nopref@x': ENCRYPT, 'stale@x': ENCRYPT,
+        'gossip@x': ENCRYPT, 'nokey@x': DISABLE}
+
+
+def test_recommend(tmpdir):
+    profile = make_profile(tmpdir)
+    columns = PeerColumns(profile)
+    assert recommend(profile, SENDER, ['mutual@x'], columns=columns) == \
+        (ENCRYPT, {'mutual@x': ENCRYPT})
+    assert recommend(profile, SENDER, ['mutual@x', 'nopref@x'])[0] == \
+        AVAILABE
+    assert recommend(profile, SENDER, ['mutual@x', 'gossip@x'])[0] == \
+        DISCOURAGE
+    rec, per_recipient = recommend(profile, SENDER,
+                                   ['mutual@x', 'unknown@x'])
+    assert rec == DISABLE
+    assert per_recipient == {'mutual@x': ENCRYPT, 'unknown@x': DISABLE}
+    rec, per_recipient = recommend(profile, SENDER,
+                                   ['mutual@x', 'mutual@x', 'unknown@x'])
+    assert rec == DISABLE
+    assert per_recipient == {'mutual@x': ENCRYPT, 'unknown@x': DISABLE}
+    assert recommend(profile, SENDER, [])[0] == DISABLE
+    assert PeerColumns(profile, ['unknown@x', 'nopref@x']).addrs == \
+        ['nopref@x']
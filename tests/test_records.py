@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for records."""
+
+import json
+import pickle
+
+import pytest
+
+from autocrypt.constants import (ACCOUNTS, LASTSEEN, MUTUAL, PEERS,
+                                 PREFERENCRYPT, PUBKEY, SECKEY)
+from autocrypt.records import Account, Peer, json_default
+from autocrypt.storage import load, new_peer, save
+from autocrypt.tests_data import BOB, BOB_KEYDATA
+
+
+def test_peer_dict_view():
+    record = {PUBKEY: BOB_KEYDATA, PREFERENCRYPT: ''.join(MUTUAL),
+              LASTSEEN: 1510062985.0, 'extra': 1}
+    peer = Peer(record)
+    assert isinstance(peer.pubkey, bytes)
+    assert peer[PUBKEY] == BOB_KEYDATA
+    assert peer[PREFERENCRYPT] is MUTUAL
+    assert peer[LASTSEEN] == 1510062985 and isinstance(peer[LASTSEEN], int)
+    assert peer.get('gossipkey') is None
+    assert peer['extra'] == 1
+    assert dict(peer, gossipkey=None, actimestamp=None,
+                gossiptimestamp=None) == peer
+    with pytest.raises(KeyError):
+        peer['missing']
+    with pytest.raises(AttributeError):
+        peer.pubkey = None
+    assert pickle.loads(pickle.dumps(peer)) == peer
+    assert json.loads(json.dumps(peer, default=json_default)) == peer
+
+
+def test_account_keeps_invalid_keydata():
+    account = Account({SECKEY: "'abc", PUBKEY: 'ab\ncd'})
+    assert account[SECKEY] == "'abc"
+    assert account[PUBKEY] == 'ab\ncd'
+
+
+def test_storage_records(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    profile = load(path)
+    new_peer(profile, BOB, BOB_KEYDATA, MUTUAL, 1510062985)
+    save(profile)
+    loaded = load(path)
+    assert isinstance(loaded[PEERS][BOB], Peer)
+    assert loaded[PEERS][BOB] == profile[PEERS][BOB]
+    assert loaded[PEERS][BOB][PUBKEY] == BOB_KEYDATA
+    assert loaded[ACCOUNTS] == {}
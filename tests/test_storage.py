@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for storage."""
+
+from __future__ import unicode_literals
+
+import multiprocessing
+import os.path
+
+import pytest
+
+from autocrypt import sqlitestore, storage
+from autocrypt.constants import ACCOUNTS, KEYHANDLES, PEERS, PUBKEY, VERSION
+from autocrypt.journal import (DEL, PUT, Journal, get_journal,
+                               journal_paths, replay)
+from autocrypt.storage import (StaleProfileError, close, compact, del_peer,
+                               load, migrate, new_peer, save, transaction)
+from autocrypt.tests_data import BOB, BOB_KEYDATA
+
+
+def test_sqlite_migrate(profile, tmpdir):
+    dbpath = tmpdir.join('profile.sqlite').strpath
+    migrate(profile['path'], dbpath)
+    sqlitestore.close(dbpath)
+    dbprofile = load(dbpath)
+    assert dbprofile['path'] == dbpath
+    for name in [ACCOUNTS, PEERS, KEYHANDLES, 'emails']:
+        assert dbprofile[name] == profile[name]
+
+
+def test_sqlite_new_del_peer(tmpdir):
+    dbpath = tmpdir.join('profile.sqlite').strpath
+    profile = load(dbpath)
+    new_peer(profile, BOB, BOB_KEYDATA)
+    new_peer(profile, 'dave@autocrypt.example')
+    sqlitestore.close(dbpath)
+    dbprofile = load(dbpath)
+    assert dbprofile[PEERS][BOB][PUBKEY] == BOB_KEYDATA
+    assert dbprofile[KEYHANDLES] == profile[KEYHANDLES]
+
+    del_peer(dbprofile, BOB)
+    sqlitestore.close(dbpath)
+    assert list(load(dbpath)[PEERS]) == ['dave@autocrypt.example']
+
+
+def test_journal(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    sealed_path, journal_path = journal_paths(path)
+    profile = load(path, journal=True)
+    get_journal(path).sync_every = 3
+    for i in range(7):
+        new_peer(profile, 'peer%s@autocrypt.example' % i)
+    del_peer(profile, 'peer0@autocrypt.example')
+    assert get_journal(path).syncs == 2
+    assert not os.path.exists(path)
+    assert len(open(journal_path).readlines()) == 8
+    close(profile)
+    assert sorted(load(path)[PEERS]) == sorted(profile[PEERS])
+
+    profile = load(path, journal=True)
+    compact(profile, background=True)
+    new_peer(profile, BOB, BOB_KEYDATA)
+    get_journal(path).wait()
+    assert not os.path.exists(sealed_path)
+    assert len(open(journal_path).readlines()) == 1
+    close(profile)
+    assert sorted(load(path)[PEERS]) == sorted(profile[PEERS])
+
+
+def test_journal_left(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    sealed_path, journal_path = journal_paths(path)
+    profile = load(path, journal=True)
+    new_peer(profile, BOB)
+    close(profile)
+    # NOTE: a process that exited without compacting its journal
+    profile = load(path)
+    assert not os.path.exists(journal_path)
+    new_peer(profile, BOB, BOB_KEYDATA)
+    assert load(path)[PEERS][BOB][PUBKEY] == BOB_KEYDATA
+
+    # NOTE: the entries appended after a truncated one are replayed
+    with open(journal_path, 'w') as fp:
+        fp.write('{"op":"del","section":"peers","addr":"%s"}\n' % BOB)
+        fp.write('{"op":"put","sect')
+    journal = Journal(path)
+    journal.append(PUT, PEERS, 'dave@autocrypt.example', {})
+    journal.close()
+    assert [entry[:3] for entry in replay(path)] == [
+        (DEL, PEERS, BOB), (PUT, PEERS, 'dave@autocrypt.example')]
+
+
+def test_journal_failed_compaction(tmpdir, monkeypatch):
+    path = tmpdir.join('profile.json').strpath
+    profile = load(path, journal=True)
+
+    def fail(profile, keys=None):
+        raise OSError('No space left on device')
+
+    with monkeypatch.context() as m:
+        m.setattr(storage, '_sync_json', fail)
+        new_peer(profile, BOB)
+        with pytest.raises(OSError):
+            compact(profile)
+        new_peer(profile, 'dave@autocrypt.example')
+        with pytest.raises(OSError):
+            compact(profile)
+    # NOTE: the records of the first sealed journal are kept on disk
+    assert [entry[2] for entry in replay(path)] == [
+        BOB, 'dave@autocrypt.example']
+    compact(profile)
+    close(profile)
+    assert sorted(load(path)[PEERS]) == [BOB, 'dave@autocrypt.example']
+
+
+def add_peer_compact(path, addr):
+    profile = load(path, journal=True)
+    new_peer(profile, addr)
+    compact(profile)
+    close(profile)
+
+
+def test_journal_concurrent_writer(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    profile = load(path)
+    context = multiprocessing.get_context('fork')
+    proc = context.Process(target=add_peer_compact,
+                           args=(path, 'dave@autocrypt.example'))
+    proc.start()
+    proc.join()
+    assert proc.exitcode == 0
+    # NOTE: the compaction has been seen, the profile is merged
+    new_peer(profile, BOB, BOB_KEYDATA)
+    assert sorted(load(path)[PEERS]) == [BOB, 'dave@autocrypt.example']
+
+
+def test_transaction(tmpdir, monkeypatch):
+    writes = []
+    write_json = storage._write_json
+    monkeypatch.setattr(storage, '_write_json',
+                        lambda p: writes.append(p) or write_json(p))
+    path = tmpdir.join('profile.json').strpath
+    profile = load(path)
+    with transaction(profile):
+        new_peer(profile, BOB, BOB_KEYDATA)
+        with transaction(profile):
+            new_peer(profile, 'dave@autocrypt.example')
+        save(profile)
+        assert not writes
+    assert len(writes) == 1
+    assert sorted(load(path)[PEERS]) == [BOB, 'dave@autocrypt.example']
+
+    keyhandles = dict(profile[KEYHANDLES][PEERS])
+    with pytest.raises(RuntimeError):
+        with transaction(profile):
+            del_peer(profile, BOB)
+            new_peer(profile, 'eve@autocrypt.example')
+            raise RuntimeError()
+    assert len(writes) == 1
+    assert sorted(profile[PEERS]) == [BOB, 'dave@autocrypt.example']
+    assert profile[KEYHANDLES][PEERS] == keyhandles
+
+
+def peer_key(n, i):
+    return 'key of peer {}-{}'.format(n, i).encode() * 4
+
+
+def add_peers(path, n, number, keystore=False):
+    profile = load(path, keystore=keystore)
+    for i in range(number):
+        pk = peer_key(n, i) if keystore else None
+        new_peer(profile, 'p{}-{}@autocrypt.example'.format(n, i), pk)
+
+
+def test_concurrent_writers(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    nprocs, number = 4, 20
+    context = multiprocessing.get_context('fork')
+    procs = [context.Process(target=add_peers, args=(path, n, number))
+             for n in range(nprocs)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+    profile = load(path)
+    assert len(profile[PEERS]) == nprocs * number
+    assert profile[VERSION] == nprocs * number
+
+    # NOTE: in one process, a stale profile merges its updated records and
+    # can not be saved whole
+    stale = load(path)
+    del_peer(profile, 'p0-0@autocrypt.example')
+    new_peer(stale, BOB, BOB_KEYDATA)
+    assert 'p0-0@autocrypt.example' not in stale[PEERS]
+    assert stale[KEYHANDLES] == load(path)[KEYHANDLES]
+    with pytest.raises(StaleProfileError):
+        save(profile)
+    assert sorted(load(path)[PEERS]) == sorted(stale[PEERS])
+
+
+def test_concurrent_writers_keystore(tmpdir):
+    path = tmpdir.join('profile.json').strpath
+    nprocs, number = 4, 20
+    context = multiprocessing.get_context('fork')
+    procs = [context.Process(target=add_peers,
+                             args=(path, n, number, True))
+             for n in range(nprocs)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+    profile = load(path)
+    assert len(profile[PEERS]) == nprocs * number
+    for n in range(nprocs):
+        for i in range(number):
+            peer = profile[PEERS]['p{}-{}@autocrypt.example'.format(n, i)]
+            assert peer.keybytes(PUBKEY) == peer_key(n, i)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:expandtab
+# Copyright 2017 juga (juga at riseup dot net), under MIT license.
+"""Tests for utils."""
+
+import subprocess
+import sys
+
+from autocrypt.utils import LazyModule
+
+
+def test_lazy_module():
+    json = LazyModule('json')
+    assert json._module is None
+    assert json.loads('[1]') == [1]
+    assert json._module is sys.modules['json']
+
+
+def test_cli_import_is_lazy():
+    code = ("import sys, autocrypt.cli; "
+            "print(sorted(m for m in sys.modules if m.startswith("
+            "('pgpy', 'emailpgp', 'autocrypt.tests_data'))))")
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.strip() == b'[]'